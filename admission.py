@@ -0,0 +1,215 @@
+import math
+import time
+import threading
+from collections import OrderedDict
+
+from flask import g, jsonify, request
+
+# Priority classes. Each class may only fill its share of the global concurrency cap, so the classes
+# below it can never take the last slots away from checkout and delivery.
+CRITICAL = 'critical'  # Checkout and order state transitions
+STANDARD = 'standard'  # Carts, product writes and single-record reads
+BULK = 'bulk'  # Catalog and listing reads that fan out over many records
+CLASS_SHARES = {CRITICAL: 1.0, STANDARD: 0.8, BULK: 0.5}
+
+DEFAULT_MAX_IN_FLIGHT = 64
+DEFAULT_USER_LIMIT = (20.0, 40)  # Per client across all routes: (tokens per second, burst)
+DEFAULT_MAX_BUCKETS = 100000
+
+# Seconds a client is told to wait when the concurrency cap sheds its request
+OVERLOAD_RETRY_AFTER = 1
+
+
+def parse_limit(value):
+    """Parse a 'rate,burst' limit, e.g. '20,40'. Returns None for an empty value or 'off'."""
+    if not value or value.strip().lower() == 'off':
+        return None
+    rate, burst = value.split(',')
+    return float(rate), int(burst)
+
+
+class TokenBucket:
+    """Allows rate requests per second on average and bursts of up to burst requests."""
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = now
+
+    def take(self, now):
+        """Spend one token. Returns 0 if allowed, otherwise the seconds until a token is available."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """Token buckets per (limit name, client), kept in a bounded LRU so idle clients are forgotten."""
+
+    def __init__(self, max_buckets=DEFAULT_MAX_BUCKETS, clock=time.monotonic):
+        self._max_buckets = max_buckets
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+
+    def take(self, key, rate, burst):
+        """Spend a token from the bucket of key. Returns 0 if allowed, otherwise the seconds to wait."""
+        with self._lock:
+            now = self._clock()
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(rate, burst, now)
+                if len(self._buckets) > self._max_buckets:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            return bucket.take(now)
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class ConcurrencyLimiter:
+    """Global cap on requests in flight, where each priority class may only use its share of the slots."""
+
+    def __init__(self, max_in_flight=DEFAULT_MAX_IN_FLIGHT, shares=None):
+        shares = shares or CLASS_SHARES
+        self.max_in_flight = max_in_flight
+        self._limits = {name: max(1, int(max_in_flight * share)) for name, share in shares.items()}
+        self._lock = threading.Lock()
+        self.in_flight = 0
+
+    def acquire(self, priority):
+        """Take a slot for a request of the given class. Returns False if the class is at its limit."""
+        with self._lock:
+            if self.in_flight >= self._limits[priority]:
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+
+class AdmissionController:
+    """Decides per request whether to serve it: per-route and per-client token buckets, then the concurrency cap.
+
+    route_limits maps endpoint names to (rate, burst) applied per client; user_limit applies per client
+    across all routes except the critical ones, so other traffic from the same address can never use up
+    checkout and delivery. Exempt endpoints (long-lived streams, metrics) skip every check.
+    """
+
+    def __init__(self, route_limits=None, user_limit=DEFAULT_USER_LIMIT, max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+                 priorities=None, exempt=(), clock=time.monotonic):
+        self.route_limits = dict(route_limits or {})
+        self.user_limit = user_limit
+        self.priorities = dict(priorities or {})
+        self.exempt = frozenset(exempt)
+        self.rate_limiter = RateLimiter(clock=clock)
+        self.concurrency = ConcurrencyLimiter(max_in_flight) if max_in_flight else None
+        self._lock = threading.Lock()
+        self.admitted = 0
+        self.rate_limited = 0
+        self.shed = {name: 0 for name in CLASS_SHARES}
+
+    def priority(self, endpoint):
+        return self.priorities.get(endpoint, STANDARD)
+
+    def check_rate(self, endpoint, client):
+        """Seconds the client must wait before calling endpoint again, or 0 if it may go ahead."""
+        wait = 0
+        if endpoint in self.route_limits:
+            wait = self.rate_limiter.take(('route', endpoint, client), *self.route_limits[endpoint])
+        if not wait and self.user_limit and self.priority(endpoint) != CRITICAL:
+            wait = self.rate_limiter.take(('user', client), *self.user_limit)
+        if wait:
+            with self._lock:
+                self.rate_limited += 1
+        return wait
+
+    def acquire(self, endpoint):
+        """Take a concurrency slot for endpoint. Returns False if the request must be shed."""
+        if self.concurrency is None:
+            return True
+        priority = self.priority(endpoint)
+        acquired = self.concurrency.acquire(priority)
+        with self._lock:
+            if acquired:
+                self.admitted += 1
+            else:
+                self.shed[priority] += 1
+        return acquired
+
+    def release(self):
+        if self.concurrency is not None:
+            self.concurrency.release()
+
+    def stats(self):
+        """Admission counters and the current load."""
+        with self._lock:
+            stats = {
+                'admitted': self.admitted,
+                'rate_limited': self.rate_limited,
+                'in_flight': self.concurrency.in_flight if self.concurrency else 0,
+                'max_in_flight': self.concurrency.max_in_flight if self.concurrency else 0,
+                'buckets': len(self.rate_limiter),
+            }
+            stats.update({f'shed_{name}': count for name, count in self.shed.items()})
+            return stats
+
+
+def client_key():
+    """Who a request is charged to: the client address.
+
+    User, rider and store owner IDs in the URL or body are not authenticated, so charging them would let
+    anyone drain another user's buckets, or dodge their own by changing the ID. Key on an authenticated
+    identity once requests carry one.
+
+    The address is remote_addr as set by the app's ProxyFix from the trusted proxies' X-Forwarded-For
+    entries only, so a client cannot pick a fresh bucket by sending its own header.
+    """
+    return request.remote_addr
+
+
+def admit_requests(app, controller):
+    """Apply controller to every request of app: rate-limited requests get 429 and shed requests get 503,
+    both with Retry-After."""
+
+    @app.before_request
+    def admit():
+        endpoint = request.endpoint
+        if endpoint is None or endpoint in controller.exempt:
+            return None
+
+        wait = controller.check_rate(endpoint, client_key())
+        if wait:
+            response = jsonify({"error": "Too many requests. Please retry later."})
+            response.headers['Retry-After'] = str(max(1, math.ceil(wait)))
+            return response, 429
+
+        if not controller.acquire(endpoint):
+            response = jsonify({"error": "Server is busy. Please retry later."})
+            response.headers['Retry-After'] = str(OVERLOAD_RETRY_AFTER)
+            return response, 503
+        g.admission_slot = True
+        return None
+
+    @app.after_request
+    def release_when_sent(response):
+        # Streamed responses (full exports) do their reads while the body is sent, after the view returns, so
+        # the slot is held until the server closes the response
+        if g.pop('admission_slot', None):
+            response.call_on_close(controller.release)
+        return response
+
+    @app.teardown_request
+    def release(exc):
+        # The request failed before a response was built
+        if g.pop('admission_slot', None):
+            controller.release()
@@ -1,24 +1,221 @@
+import os
+import json
+import time
 import uuid
-from flask import Flask, request, jsonify
-import firebase_admin
-from firebase_admin import credentials, db
+import threading
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS  # Import Flask-CORS
-from nltk.sem.chat80 import items
+from werkzeug.middleware.proxy_fix import ProxyFix
+from storage import InsufficientValueError, create_storage, generate_push_id, is_valid_key, split_path
+from indexes import (FINGERPRINT_FIELDS, fingerprint_path, get_store_products, product_fingerprint,
+                     rebuild_product_fingerprints, rebuild_store_index, rebuild_user_order_index,
+                     store_index_updates, user_orders_path)
+from pagination import (NEXT_CURSOR_HEADER, iter_children, key_order_page, newest_first_page,
+                        page_args, stream_json_object)
+from user_cache import UserCache
+from loaders import request_loader
+from dispatch import (dispatch_summary, price_items, ready_for_pickup_path, ready_for_pickup_updates,
+                      rebuild_dispatch_view)
+from response_cache import ResponseCache, cached_response
+from carts import cart_item_path, cart_items, legacy_item_keys, migrate_carts
+from events import (ORDER_CLAIMED, ORDER_DELIVERED, ORDER_READY, RESYNC, SSE_KEEPALIVE_SECONDS, EventBus,
+                    format_sse)
+from search import SORT_OPTIONS, ProductSearchIndex, price_arg
+from admission import BULK, CRITICAL, DEFAULT_USER_LIMIT, AdmissionController, admit_requests, parse_limit
+from idempotency import IdempotencyStore, idempotent
+from archive import (DEFAULT_COMPACTION_SECONDS, OrderArchiver, archive_partition_path, archived_orders,
+                     archived_user_orders_path, partition_date, valid_partition)
+from riders import (OrderNotAvailableError, assigned_order_ids, assigned_order_path, claim_status, completed_count_path,
+                    completed_history_path, completed_orders, delivery_decrements, delivery_updates,
+                    migrate_rider_orders, rider_orders_migrated, take_legacy_assigned_order)
+from replica import ProductReplica, ReplicatedStorage
+from metrics import PROMETHEUS_CONTENT_TYPE, InstrumentedStorage, RouteMetrics, instrument_app, render_gauges
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
-# Initialize Firebase Admin SDK with Realtime Database URL
-cred = credentials.Certificate("firebase_credentials.json")
-firebase_admin.initialize_app(cred, {
-    'databaseURL': 'https://dashdrobe-website-form-default-rtdb.firebaseio.com/'
-})
-
-users = {}
-carts = {}
-orders = {}
-products = {}
-riders = {}
+# The app runs behind TRUSTED_PROXY_HOPS proxies (Vercel's edge by default; 0 when clients connect directly).
+# Each one appends to X-Forwarded-For, so only that many entries from the right are trusted as remote_addr;
+# anything further left was sent by the client.
+app.wsgi_app = ProxyFix(app.wsgi_app, x_for=int(os.environ.get('TRUSTED_PROXY_HOPS', 1)))
+
+# Bulk endpoints accept at most MAX_BATCH_SIZE items and write them BATCH_WRITE_CHUNK at a time
+MAX_BATCH_SIZE = 5000
+BATCH_WRITE_CHUNK = 500
+
+# Storage backend (firebase, memory or sqlite) is selected by the STORAGE_BACKEND environment variable.
+# The wrapper records each request's DB calls (and, for sampled requests, payload sizes) for /metrics.
+database = InstrumentedStorage(create_storage())
+
+# Per-route latency, DB call and payload histograms. Requests slower than SLOW_REQUEST_MS are logged
+# together with their DB call trace. Payload sizes cost a JSON encoding of every read and write, so only the
+# fraction DB_BYTES_SAMPLE_RATE (0 to 1, off by default) of requests measure them.
+request_metrics = RouteMetrics()
+instrument_app(
+    app, request_metrics,
+    slow_request_ms=float(os.environ['SLOW_REQUEST_MS']) if os.environ.get('SLOW_REQUEST_MS') else None,
+    byte_sample_rate=float(os.environ.get('DB_BYTES_SAMPLE_RATE', 0))
+)
+
+# Single-user lookups (role validation) are cached instead of downloading the whole users node
+user_cache = UserCache(
+    database,
+    max_entries=int(os.environ.get('USER_CACHE_SIZE', 10000)),
+    ttl=float(os.environ.get('USER_CACHE_TTL', 300))
+)
+
+# Serialized catalog responses; every product or stock write bumps its version
+catalog_cache = ResponseCache(
+    max_entries=int(os.environ.get('CATALOG_CACHE_SIZE', 1024)),
+    ttl=float(os.environ.get('CATALOG_CACHE_TTL', 10))
+)
+
+# Optional in-process replica of the products node (PRODUCT_REPLICA=on), loaded in the background at startup and
+# kept current by the database's change stream. Once it has synced, product reads are served from memory; until
+# then they go to the database. PRODUCT_REPLICA_MAX_ENTRIES bounds how many products it holds.
+product_replica = None
+if os.environ.get('PRODUCT_REPLICA', 'off').lower() == 'on':
+    product_replica = ProductReplica(
+        database,
+        max_entries=(int(os.environ['PRODUCT_REPLICA_MAX_ENTRIES'])
+                     if os.environ.get('PRODUCT_REPLICA_MAX_ENTRIES') else None),
+        # Responses cached before a change arrived (e.g. from another worker) must not outlive it
+        on_change=catalog_cache.bump
+    )
+    database = ReplicatedStorage(database, product_replica)
+    threading.Thread(target=product_replica.start, daemon=True).start()
+
+# Admission control: token buckets per client address (RATE_LIMITS is a JSON object of endpoint -> [rate, burst]
+# overriding the defaults below; USER_RATE_LIMIT is 'rate,burst' across all routes but checkout and delivery)
+# and a cap of MAX_IN_FLIGHT concurrent requests in which checkout and delivery always get capacity before
+# catalog and listing reads.
+# ADMISSION_CONTROL=off disables it.
+ROUTE_RATE_LIMITS = {
+    'get_all_users': (1, 5),
+    'get_all_products': (5, 10),
+    'get_available_orders_for_riders': (2, 5),
+    'search_products': (10, 20),
+    'add_products_batch': (1, 3),
+}
+ROUTE_RATE_LIMITS.update(json.loads(os.environ.get('RATE_LIMITS', '{}')))
+admission = AdmissionController(
+    route_limits=ROUTE_RATE_LIMITS,
+    user_limit=parse_limit(os.environ.get('USER_RATE_LIMIT', ','.join(map(str, DEFAULT_USER_LIMIT)))),
+    max_in_flight=int(os.environ.get('MAX_IN_FLIGHT', 64)),
+    priorities={
+        'create_order': CRITICAL,
+        'review_order': CRITICAL,
+        'accept_order_for_delivery': CRITICAL,
+        'mark_order_as_delivered': CRITICAL,
+        'get_all_users': BULK,
+        'get_all_products': BULK,
+        'get_products_by_store': BULK,
+        'search_products': BULK,
+        'get_available_orders_for_riders': BULK,
+        'get_user_orders': BULK,
+        'get_user_order_history': BULK,
+        'get_archived_orders_by_date': BULK,
+        'get_rider_orders': BULK,
+        'get_rider_completed_orders': BULK,
+        'add_products_batch': BULK,
+    },
+    # Streams hold a connection open for minutes, and metrics must stay readable during an overload
+    exempt=('stream_available_orders_for_riders', 'get_metrics', 'get_user_cache_stats', 'get_catalog_cache_stats',
+            'get_idempotency_stats', 'get_admission_stats', 'get_product_replica_stats', 'get_order_archive_stats')
+)
+if os.environ.get('ADMISSION_CONTROL', 'on').lower() != 'off':
+    admit_requests(app, admission)
+
+# Text/price/store search over the catalog, built on the first search and updated by the product writes
+product_search = ProductSearchIndex(database, refresh_interval=float(os.environ.get('PRODUCT_SEARCH_REFRESH', 300)))
+
+# Responses to checkout and delivery requests sent with an Idempotency-Key, replayed when clients retry
+idempotency_store = IdempotencyStore(
+    max_entries=int(os.environ.get('IDEMPOTENCY_CACHE_SIZE', 10000)),
+    ttl=float(os.environ.get('IDEMPOTENCY_TTL', 3600))
+)
+
+# Delivered and rejected orders move to the date-partitioned archive as they finish (ORDER_ARCHIVE=off keeps them
+# in the hot nodes), and a background sweep every ORDER_COMPACTION_INTERVAL seconds (0 disables it) moves any
+# finished order still left there. The sweep waits until migrate-rider-orders has run, and its queries need the
+# indexes in database.rules.json.
+ARCHIVE_FINISHED_ORDERS = os.environ.get('ORDER_ARCHIVE', 'on').lower() != 'off'
+order_archiver = OrderArchiver(
+    database,
+    interval=float(os.environ.get('ORDER_COMPACTION_INTERVAL', DEFAULT_COMPACTION_SECONDS)),
+    ready=lambda: rider_orders_migrated(database)
+)
+
+# In-process pub/sub carrying dispatch changes to the riders' event streams
+events = EventBus()
+DISPATCH_TOPIC = 'dispatch'
+
+# ---------------------- Helpers ----------------------
+
+def list_node(path, not_found, wrap_key=None):
+    """Respond with the children of a node, either as one key-ordered page or as a streamed export.
+
+    not_found builds the response used when there is nothing to list. If wrap_key is given the
+    children are returned as {wrap_key: {...}}.
+    """
+    try:
+        limit, cursor = page_args(request.args, default_limit=None)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if limit is not None:
+        page, next_cursor = key_order_page(database, path, limit, cursor)
+        if not page:
+            return not_found()
+        response = jsonify({wrap_key: dict(page)} if wrap_key else dict(page))
+        if next_cursor:
+            response.headers[NEXT_CURSOR_HEADER] = next_cursor
+        return response, 200
+
+    # Full export: read and write the node a chunk at a time instead of holding all of it in memory.
+    # The first child is read up front so an empty node still gets a proper 404.
+    children = iter_children(database, path, cursor=cursor)
+    first = next(children, None)
+    if first is None:
+        return not_found()
+
+    def all_children():
+        yield first
+        yield from children
+
+    if wrap_key:
+        body = stream_json_object(all_children(), prefix='{' + json.dumps(wrap_key) + ':', suffix='}')
+    else:
+        body = stream_json_object(all_children())
+    return Response(body, mimetype='application/json'), 200
+
+class ProductNotFoundError(Exception):
+    """Raised inside a product transaction to abort it when the product no longer exists."""
+
+def add_stock(product_id, quantity):
+    """Atomically add quantity to a product's stock. Returns False if the product no longer exists."""
+    def increment(product):
+        if not product:
+            raise ProductNotFoundError()  # Abort: writing None back would delete the path
+        return dict(product, stock=product.get('stock', 0) + quantity)
+    try:
+        database.transaction(f'products/{product_id}', increment)
+    except ProductNotFoundError:
+        return False
+    catalog_cache.bump()
+    return True
+
+def has_required_product_fields(data):
+    """Whether a product has a name, description, price, image_url and store_name."""
+    return isinstance(data, dict) and all(data.get(field) for field in FINGERPRINT_FIELDS)
+
+def is_valid_stock(stock):
+    """Whether stock is a non-negative integer."""
+    return isinstance(stock, int) and not isinstance(stock, bool) and stock >= 0
+
+def chunked(items, size):
+    """Split a list into consecutive chunks of at most size items."""
+    return [items[start:start + size] for start in range(0, len(items), size)]
 
 # ---------------------- User APIs ----------------------
 
@@ -38,52 +235,87 @@ def create_user():
         'user_type': user_type
     }
 
-    # Store the user data in Firebase Realtime Database
-    ref = db.reference('users')  # Refers to 'users' node
-    ref.child(user_id).set(user_data)  # Save user under their unique ID
+    # Store the user data in the database
+    database.set(f'users/{user_id}', user_data)  # Save user under their unique ID
+    user_cache.invalidate(user_id)
 
     return jsonify({"message": "User created successfully", "user_id": user_id}), 201
 
 @app.route('/api/users', methods=['GET'])
 def get_all_users():
-    """Retrieve all users with their user_id and user_type."""
-    # Reference to the 'users' node in Firebase
-    ref = db.reference('users')
-
-    # Fetch all user data from Firebase
-    users_data = ref.get()  # This will return all the user data in the 'users' node
+    """Retrieve all users with their user_id and user_type.
 
-    if not users_data:
-        return jsonify({"message": "No users found"}), 404
-
-    return jsonify({"users": users_data}), 200
+    With limit (and cursor) returns one page; otherwise the whole node is streamed in chunks.
+    """
+    return list_node('users', lambda: (jsonify({"message": "No users found"}), 404), wrap_key='users')
 
 # ---------------------- Customer APIs ----------------------
 
 @app.route('/api/products', methods=['GET'])
+@cached_response(catalog_cache)
 def get_all_products():
-    """Retrieve all products."""
-    ref = db.reference('products')
-    products = ref.get()
-    if not products:
+    """Retrieve all products.
+
+    With limit (and cursor) returns one page; otherwise the whole catalog is streamed in chunks.
+    """
+    return list_node('products', lambda: (jsonify({"error": "No products found"}), 404))
+
+@app.route('/api/products/search', methods=['GET'])
+@cached_response(catalog_cache)
+def search_products():
+    """Search products by text (q), price range (min_price, max_price) and store_name.
+
+    sort is relevance, price_asc, price_desc or name. Supports limit/cursor pagination; the total number
+    of matches is returned in the X-Total-Count header.
+    """
+    try:
+        limit, cursor = page_args(request.args)
+        min_price = price_arg(request.args, 'min_price')
+        max_price = price_arg(request.args, 'max_price')
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    sort = request.args.get('sort')
+    if sort and sort not in SORT_OPTIONS:
+        return jsonify({"error": f"sort must be one of {', '.join(SORT_OPTIONS)}"}), 400
+
+    try:
+        product_ids, total, next_cursor = product_search.search(
+            q=request.args.get('q'), min_price=min_price, max_price=max_price,
+            store_name=request.args.get('store_name'), sort=sort, limit=limit, cursor=cursor
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # The index only holds searchable fields; the page itself is read fresh, so stock is current
+    products_data = request_loader(database, 'products').load_many(product_ids)
+    result = [dict(products_data[product_id], product_id=product_id)
+              for product_id in product_ids if products_data[product_id]]
+
+    if not result:
         return jsonify({"error": "No products found"}), 404
-    return jsonify(products), 200
+
+    response = jsonify(result)
+    response.headers['X-Total-Count'] = str(total)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return response, 200
 
 @app.route('/api/products/id/<product_id>', methods=['GET'])
+@cached_response(catalog_cache)
 def get_product_by_id(product_id):
     """Retrieve a specific product by ID."""
-    ref = db.reference(f'products/{product_id}')
-    product = ref.get()
+    product = database.get(f'products/{product_id}')
     if not product:
         return jsonify({"error": "Product not found"}), 404
     return jsonify({product_id: product}), 200
 
 @app.route('/api/products/store/<store_name>', methods=['GET'])
+@cached_response(catalog_cache)
 def get_products_by_store(store_name):
     """Retrieve products from a specific store."""
-    ref = db.reference('products')
-    all_products = ref.get()
-    result = {pid: product for pid, product in all_products.items() if product['store_name'] == store_name}
+    # Only the products listed in the store index are read, not the whole catalog
+    result = get_store_products(database, store_name)
     if not result:
         return jsonify({"error": "No products found for this store"}), 404
     return jsonify(result), 200
@@ -98,64 +330,164 @@ def add_product_to_cart(user_id):
     if not product_id or not quantity:
         return jsonify({"error": "Product ID and quantity are required"}), 400
 
-    # Check if the user exists in the Firebase database
-    user_ref = db.reference(f'users/{user_id}')
-    user_data = user_ref.get()
+    if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity < 1:
+        return jsonify({"error": "Quantity must be a positive integer"}), 400
+
+    # The product ID becomes a path segment of the cart entry
+    if not is_valid_key(product_id):
+        return jsonify({"error": "Invalid product ID"}), 400
 
+    # Check the user and the product exist, at the same time
+    user_data, product_data = database.gather(
+        lambda: user_cache.get(user_id),
+        lambda: database.get(f'products/{product_id}')
+    )
     if not user_data:
         return jsonify({"error": "User not found"}), 404
+    if not product_data:
+        return jsonify({"error": f"Product {product_id} not found"}), 404
+
+    # Atomically add the quantity to this product's entry only, creating it if it isn't in the cart yet
+    existed = []
 
-    # Initialize the cart if it doesn't exist
-    cart_ref = db.reference(f'carts/{user_id}')
-    cart_data = cart_ref.get() or []
+    def increment(item):
+        existed[:] = [bool(item)]
+        return {'product_id': product_id, 'quantity': (item or {}).get('quantity', 0) + quantity}
 
-    # Check if the product already exists in the cart
-    existing_item = next((item for item in cart_data if item['product_id'] == product_id), None)
+    cart_item = database.transaction(cart_item_path(user_id, product_id), increment)
 
-    if existing_item:
-        # If product already exists, update the quantity
-        existing_item['quantity'] += quantity
+    if existed[0]:
         message = f"Product {product_id} quantity updated in cart."
     else:
-        # Add new product to cart
-        cart_data.append({
-            'product_id': product_id,
-            'quantity': quantity
-        })
         message = f"Product {product_id} added to cart."
 
-    # Save the updated cart back to the database
-    cart_ref.set(cart_data)
-    return jsonify({"message": message, "cart": cart_data}), 201
+    # Clients read the whole cart from the response, so it is still returned alongside the item written
+    cart_data = cart_items(database.get(f'carts/{user_id}'))
+    return jsonify({"message": message, "cart": cart_data, "item": cart_item}), 201
+
+@app.route('/api/cart/<user_id>/batch', methods=['POST'])
+def add_products_to_cart_batch(user_id):
+    """Add several products to the user's cart at once. Returns a result for every item sent."""
+    data = request.get_json()
+    items = data.get('items') if isinstance(data, dict) else data
+
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "A non-empty list of items is required"}), 400
+    if len(items) > MAX_BATCH_SIZE:
+        return jsonify({"error": f"At most {MAX_BATCH_SIZE} items can be added at once"}), 400
+
+    if not user_cache.get(user_id):
+        return jsonify({"error": "User not found"}), 404
+
+    # Validate every item and total the quantities of repeated products
+    results = []
+    quantities = {}
+    for index, item in enumerate(items):
+        product_id = item.get('product_id') if isinstance(item, dict) else None
+        quantity = item.get('quantity') if isinstance(item, dict) else None
+        if not is_valid_key(product_id) or not isinstance(quantity, int) or isinstance(quantity, bool) \
+                or quantity < 1:
+            results.append({"index": index, "status": "invalid",
+                            "error": "A valid product ID and a positive integer quantity are required"})
+            continue
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+        results.append({"index": index, "status": "added", "product_id": product_id})
+
+    # Only products that exist go into the cart; they are all read in one batch
+    products_data = request_loader(database, 'products').load_many(quantities)
+    for result in results:
+        if result['status'] == 'added' and not products_data[result['product_id']]:
+            result.update(status='not_found', error=f"Product {result['product_id']} not found")
+    quantities = {product_id: quantity for product_id, quantity in quantities.items() if products_data[product_id]}
+
+    # Each chunk is one increment() call: quantity increments plus the product_id of new entries. The local
+    # backends apply it as one locked write; on Firebase it is a transaction per item and then one update.
+    failed = set()
+    for chunk in chunked(list(quantities.items()), BATCH_WRITE_CHUNK):
+        try:
+            database.increment(
+                {f'{cart_item_path(user_id, product_id)}/quantity': quantity for product_id, quantity in chunk},
+                {f'{cart_item_path(user_id, product_id)}/product_id': product_id for product_id, _ in chunk}
+            )
+        except Exception:
+            app.logger.exception("Batch cart write failed")
+            failed.update(product_id for product_id, _ in chunk)
+
+    for result in results:
+        if result.get('product_id') in failed:
+            result['status'] = 'failed'
+
+    return jsonify({"message": "Cart updated", "results": results}), 200
+
+@app.route('/api/cart/<user_id>/items/<product_id>', methods=['PUT'])
+def update_cart_item(user_id, product_id):
+    """Set the quantity of a product in the user's cart. A quantity of 0 removes it."""
+    data = request.get_json()
+    quantity = data.get('quantity')
+
+    if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity < 0:
+        return jsonify({"error": "Quantity must be a non-negative integer"}), 400
+
+    if not is_valid_key(product_id):
+        return jsonify({"error": "Invalid product ID"}), 400
+
+    # The cart is read with the user so the product's legacy entries can be replaced in the same write
+    user_data, cart_data = database.gather(
+        lambda: user_cache.get(user_id),
+        lambda: database.get(f'carts/{user_id}')
+    )
+    if not user_data:
+        return jsonify({"error": "User not found"}), 404
+
+    updates = {f'carts/{user_id}/{key}': None for key in legacy_item_keys(cart_data, product_id)}
+    if quantity == 0:
+        updates[cart_item_path(user_id, product_id)] = None
+        database.update('', updates)
+        return jsonify({"message": f"Product {product_id} removed from cart."}), 200
+
+    cart_item = {'product_id': product_id, 'quantity': quantity}
+    updates[cart_item_path(user_id, product_id)] = cart_item
+    database.update('', updates)
+    return jsonify({"message": f"Product {product_id} quantity updated in cart.", "item": cart_item}), 200
 
 @app.route('/api/cart/<user_id>', methods=['DELETE'])
 def remove_from_cart(user_id):
     """Remove an item from the user's cart."""
     data = request.get_json()
-    item_id = data.get('item_id')
+    product_id = data.get('product_id') or data.get('item_id')  # item_id is the older name of the field
 
-    if user_id not in carts:
-        return jsonify({"error": "Cart not found"}), 404
+    if not product_id:
+        return jsonify({"error": "Product ID is required"}), 400
+
+    if not is_valid_key(product_id):
+        return jsonify({"error": "Invalid product ID"}), 400
 
-    cart = carts[user_id]
-    cart = [item for item in cart if item['item_id'] != item_id]
+    # The product may also be held by legacy entries (see legacy_item_keys), which are removed with it
+    cart_data = database.get(f'carts/{user_id}')
+    keyed = isinstance(cart_data, dict) and bool(cart_data.get(product_id))
+    legacy_keys = legacy_item_keys(cart_data, product_id)
+    if not keyed and not legacy_keys:
+        return jsonify({"error": "Item not found in cart"}), 404
 
-    carts[user_id] = cart
+    updates = {f'carts/{user_id}/{key}': None for key in legacy_keys}
+    updates[cart_item_path(user_id, product_id)] = None
+    database.update('', updates)
     return jsonify({"message": "Item removed from cart successfully"}), 200
 
 @app.route('/api/cart/<user_id>', methods=['GET'])
 def get_cart(user_id):
     """Get the cart details for a user."""
-    # Check if the user exists in the Firebase database
-    user_ref = db.reference(f'users/{user_id}')
-    user_data = user_ref.get()
+    # Look up the user and fetch their cart at the same time
+    user_data, cart_data = database.gather(
+        lambda: user_cache.get(user_id),
+        lambda: database.get(f'carts/{user_id}')
+    )
 
+    # Check if the user exists in the database
     if not user_data:
         return jsonify({"error": "User not found"}), 404
 
-    # Fetch the cart data for the user from Firebase
-    cart_ref = db.reference(f'carts/{user_id}')
-    cart_data = cart_ref.get()
+    cart_data = cart_items(cart_data)
 
     if not cart_data:
         return jsonify({"error": "Cart not found"}), 404
@@ -163,30 +495,29 @@ def get_cart(user_id):
     return jsonify({"cart": cart_data}), 200
 
 @app.route('/api/order/<user_id>', methods=['POST'])
+@idempotent(idempotency_store)
 def create_order(user_id):
     """Create an order for the user."""
-    # Fetch the user from the Firebase database
-    user_ref = db.reference(f'users/{user_id}')
-    user_data = user_ref.get()
+    # Fetch the user and their cart from the database together
+    records = database.get_many([f'users/{user_id}', f'carts/{user_id}'])
+    user_data = records[f'users/{user_id}']
+    cart_data = cart_items(records[f'carts/{user_id}'])
 
     if not user_data:
         return jsonify({"error": "User not found"}), 404
 
-    # Fetch the user's cart from the database
-    cart_ref = db.reference(f'carts/{user_id}')
-    cart_data = cart_ref.get()
-
     if not cart_data:
         return jsonify({"error": "Cart is empty"}), 400
 
-    # Check product availability and adjust stock
+    # Total the quantity per product so every stock value is checked once
+    quantities = {}
     for item in cart_data:
-        product_id = item['product_id']
-        quantity_in_cart = item['quantity']
+        quantities[item['product_id']] = quantities.get(item['product_id'], 0) + item['quantity']
 
-        # Fetch the product details from the database
-        product_ref = db.reference(f'products/{product_id}')
-        product_data = product_ref.get()
+    # Validate every item before any stock is touched
+    products_data = request_loader(database, 'products').load_many(quantities)
+    for product_id, quantity_in_cart in quantities.items():
+        product_data = products_data[product_id]
 
         if not product_data:
             return jsonify({"error": f"Product {product_id} not found"}), 404
@@ -197,52 +528,120 @@ def create_order(user_id):
         if available_stock < quantity_in_cart:
             return jsonify({"error": f"Not enough stock for product {product_id}. Available stock: {available_stock}"}), 400
 
-        # Update the product stock in the database
-        new_stock = available_stock - quantity_in_cart
-        product_ref.update({'stock': new_stock})
-
     # Create an order
     order_id = str(uuid.uuid4())  # Generate unique order ID
+    timestamp = int(time.time() * 1000)  # Creation time in milliseconds
+    index_key = generate_push_id(timestamp)  # The order's key in the user's order index
     order_details = {
         'order_id': order_id,
         'user_id': user_id,
         'user_type': user_data['user_type'],
-        'items': cart_data,  # Copy the cart items
-        'status': 'pending'  # Initial order status
+        # Copy the cart items with the price they were checked out at
+        'items': [dict(item, price=products_data[item['product_id']].get('price', 0)) for item in cart_data],
+        'status': 'pending',  # Initial order status
+        'timestamp': timestamp,
+        'user_index_key': index_key  # Lets the order be archived without searching the index
     }
 
-    # Store the order in the database
-    order_ref = db.reference(f'orders/{order_id}')
-    order_ref.set(order_details)
-
-    # Clear the user's cart in the database
-    cart_ref.delete()
+    # Reserve the stock of every item, store the order with its user index entry and clear the cart in
+    # one atomic step. Stock is re-checked there, so concurrent checkouts cannot oversell.
+    try:
+        database.reserve(
+            {f'products/{product_id}/stock': quantity for product_id, quantity in quantities.items()},
+            {
+                f'orders/{order_id}': order_details,
+                user_orders_path(user_id, index_key): order_id,
+                f'carts/{user_id}': None
+            }
+        )
+    except InsufficientValueError as e:
+        product_id = split_path(e.path)[1]
+        return jsonify({"error": f"Not enough stock for product {product_id}. Available stock: {e.available}"}), 400
+    finally:
+        # Stock may have changed even when the reservation failed part way
+        catalog_cache.bump()
 
     return jsonify({"message": "Order placed successfully", "order_id": order_id}), 201
 
 @app.route('/api/order/<user_id>', methods=['GET'])
 def get_user_orders(user_id):
-    """Get the orders placed by the user."""
-    # Fetch the user from the Firebase database
-    user_ref = db.reference(f'users/{user_id}')
-    user_data = user_ref.get()
+    """Get the user's current orders, newest first. Supports limit/cursor pagination; without either, every
+    current order is returned.
+
+    Delivered and rejected orders are archived; they are listed by get_user_order_history.
+    """
+    try:
+        limit, cursor = page_args(request.args, default_limit=None)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Fetch the user and the requested page of the user's order index at the same time
+    user_data, (page, next_cursor) = database.gather(
+        lambda: database.get(f'users/{user_id}'),
+        lambda: newest_first_page(database, user_orders_path(user_id), limit, cursor)
+    )
 
     if not user_data:
         return jsonify({"error": "User not found"}), 404
 
-    # Fetch all orders from the database
-    orders_ref = db.reference('orders')
-    all_orders = orders_ref.get()
-
-    # Filter orders for the specific user
-    user_orders = [
-        order for order in all_orders.values() if order['user_id'] == user_id
-    ] if all_orders else []
+    # Then read only the orders on that page
+    orders = database.get_many(f'orders/{order_id}' for _, order_id in page)
+    user_orders = [orders[f'orders/{order_id}'] for _, order_id in page if orders[f'orders/{order_id}']]
 
     if not user_orders:
         return jsonify({"message": "No orders found for this user"}), 404
 
-    return jsonify(user_orders), 200
+    response = jsonify(user_orders)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return response, 200
+
+@app.route('/api/order/<user_id>/history', methods=['GET'])
+def get_user_order_history(user_id):
+    """Get the user's archived (delivered and rejected) orders, newest first. Supports limit/cursor pagination."""
+    try:
+        limit, cursor = page_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Fetch the user and one page of the user's archive index at the same time
+    user_data, (page, next_cursor) = database.gather(
+        lambda: database.get(f'users/{user_id}'),
+        lambda: newest_first_page(database, archived_user_orders_path(user_id), limit, cursor)
+    )
+
+    if not user_data:
+        return jsonify({"error": "User not found"}), 404
+
+    # Then read only the archived orders on that page
+    history = archived_orders(database, page)
+
+    if not history:
+        return jsonify({"message": "No archived orders found for this user"}), 404
+
+    response = jsonify(history)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return response, 200
+
+@app.route('/api/orders/archive/<date>', methods=['GET'])
+def get_archived_orders_by_date(date):
+    """Get the archived orders placed on a date (YYYY-MM-DD, UTC) in key order. Supports limit/cursor pagination."""
+    if not valid_partition(date):
+        return jsonify({"error": "date must be formatted as YYYY-MM-DD"}), 400
+    try:
+        limit, cursor = page_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    page, next_cursor = key_order_page(database, archive_partition_path(date), limit, cursor)
+    if not page:
+        return jsonify({"message": "No archived orders found for this date"}), 404
+
+    response = jsonify([order for _, order in page])
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return response, 200
 
 # ---------------------- Store Owner APIs ----------------------
 
@@ -253,53 +652,174 @@ def add_product():
     if not data:
         return jsonify({"error": "Request body is empty"}), 400
 
-    product_name = data.get('name')
-    product_description = data.get('description')
-    product_price = data.get('price')
-    product_image_url = data.get('image_url')
     store_name = data.get('store_name')
     quantity_to_add = data.get('stock', 1)  # Assuming the quantity to add is passed as stock
 
-    if not all([product_name, product_description, product_price, product_image_url, store_name]):
+    if not has_required_product_fields(data):
         return jsonify({"error": "Missing required fields"}), 400
 
+    if not is_valid_stock(quantity_to_add):
+        return jsonify({"error": "Stock must be a non-negative integer"}), 400
+
+    # Check if product already exists, matching on name, description, price, image_url and store_name,
+    # with a single keyed lookup of its fingerprint
+    fingerprint = product_fingerprint(data)
+    existing_product_id = database.get(fingerprint_path(fingerprint))
+
+    # Update the stock/quantity of the existing product by adding the new stock
+    if existing_product_id and add_stock(existing_product_id, quantity_to_add):
+        return jsonify({"message": "Product quantity updated", "product_id": existing_product_id}), 200
+
+    # If product does not exist, add it as a new product and index it under its store in one write
+    product_id = database.push('products')
+    updates = {f'products/{product_id}': data}
+    updates.update(store_index_updates(product_id, None, store_name))
+    database.update('', updates)
+    product_search.upsert(product_id, data)
+    catalog_cache.bump()
+
+    # Claim the fingerprint. If a concurrent request added the same product first, merge into that one.
+    # A claim left behind by a product that has since been deleted is taken over, keeping the new product.
+    stale_owner_id = None
+    while True:
+        owner_id = database.transaction(
+            fingerprint_path(fingerprint),
+            lambda current, stale=stale_owner_id: product_id if not current or current == stale else current
+        )
+        if owner_id == product_id:
+            break
+        if add_stock(owner_id, quantity_to_add):
+            updates = {f'products/{product_id}': None}
+            updates.update(store_index_updates(product_id, store_name, None))
+            database.update('', updates)
+            product_search.remove(product_id)
+            catalog_cache.bump()
+            return jsonify({"message": "Product quantity updated", "product_id": owner_id}), 200
+        stale_owner_id = owner_id
+
+    return jsonify({"message": "Product added successfully", "product_id": product_id}), 201
+
+@app.route('/api/products/batch', methods=['POST'])
+def add_products_batch():
+    """Add many products at once, e.g. when onboarding a store's catalog.
+
+    Products matching an existing product (or an earlier one in the batch) have their stock added to it.
+    Returns a result for every item in the order they were sent.
+    """
+    data = request.get_json()
+    items = data.get('products') if isinstance(data, dict) else data
+
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "A non-empty list of products is required"}), 400
+    if len(items) > MAX_BATCH_SIZE:
+        return jsonify({"error": f"At most {MAX_BATCH_SIZE} products can be added at once"}), 400
+
+    # Validate every item and merge duplicates within the batch by fingerprint
+    results = [None] * len(items)
+    batch = {}  # fingerprint -> {'data': first item, 'stock': total stock to add, 'indexes': item positions}
+    for index, item in enumerate(items):
+        if not has_required_product_fields(item):
+            results[index] = {"index": index, "status": "invalid", "error": "Missing required fields"}
+            continue
+        if not is_valid_stock(item.get('stock', 1)):
+            results[index] = {"index": index, "status": "invalid", "error": "Stock must be a non-negative integer"}
+            continue
+        entry = batch.setdefault(product_fingerprint(item), {'data': item, 'stock': 0, 'indexes': []})
+        entry['stock'] += item.get('stock', 1)
+        entry['indexes'].append(index)
+
+    # One batched lookup tells which products already exist, and a second that their owners were not deleted since.
+    # A fingerprint whose owner is gone is stale: the product is created again and takes the fingerprint over.
+    owners = database.get_many(fingerprint_path(fingerprint) for fingerprint in batch)
+    owner_products = request_loader(database, 'products').load_many(owners.values())
+    owners = {path: owner if owner_products.get(owner) else None for path, owner in owners.items()}
+
+    # Commit in chunks, each as a single multi-path write with atomic stock increments
+    for chunk in chunked(list(batch.items()), BATCH_WRITE_CHUNK):
+        stock_deltas = {}
+        updates = {}
+        statuses = []
+        for fingerprint, entry in chunk:
+            product_id = owners[fingerprint_path(fingerprint)]
+            if product_id:
+                stock_deltas[f'products/{product_id}/stock'] = entry['stock']
+                statuses.append((entry, product_id, 'updated'))
+            else:
+                product_id = database.push('products')
+                updates[f'products/{product_id}'] = dict(entry['data'], stock=entry['stock'])
+                updates.update(store_index_updates(product_id, None, entry['data']['store_name']))
+                updates[fingerprint_path(fingerprint)] = product_id
+                statuses.append((entry, product_id, 'created'))
+
+        try:
+            database.increment(stock_deltas, updates)
+            for _, product_id, status in statuses:
+                if status == 'created':
+                    product_search.upsert(product_id, updates[f'products/{product_id}'])
+        except Exception as e:
+            app.logger.exception("Batch product write failed")
+            statuses = [(entry, None, 'failed') for entry, _, _ in statuses]
+            error = str(e)
+
+        for entry, product_id, status in statuses:
+            for position, index in enumerate(entry['indexes']):
+                result = {"index": index, "status": status if position == 0 else 'merged'}
+                if product_id:
+                    result["product_id"] = product_id
+                if status == 'failed':
+                    result.update(status='failed', error=error)
+                results[index] = result
 
-    # Check if product already exists in the products database
-    ref = db.reference('products')
-    products = ref.get()
-
-    if products:  # Only iterate if products exist
-        for product_id, product in products.items():
-            # Check if product matches based on name, description, price, image_url, and store_name
-            if (product.get('name') == product_name and
-                    product.get('description') == product_description and
-                    product.get('price') == product_price and
-                    product.get('image_url') == product_image_url and
-                    product.get('store_name') == store_name):
-                # Update the stock/quantity of the existing product by adding the new stock
-                new_stock = product.get('stock', 0) + quantity_to_add
-                ref.child(product_id).update({'stock': new_stock})
-                return jsonify({"message": "Product quantity updated", "product_id": product_id}), 200
-
-    # If product does not exist, add it as a new product
-    product_ref = ref.push()
-    product_ref.set(data)
+    catalog_cache.bump()
 
-    return jsonify({"message": "Product added successfully", "product_id": product_ref.key}), 201
+    summary = {status: sum(1 for result in results if result['status'] == status)
+               for status in ('created', 'updated', 'merged', 'invalid', 'failed')}
+    return jsonify({"message": "Batch processed", "summary": summary, "results": results}), 200
 
 @app.route('/api/products/<product_id>', methods=['PUT'])
 def update_product(product_id):
     """Update an existing product."""
     data = request.get_json()
-    ref = db.reference(f'products/{product_id}')
-    ref.update(data)
+    updates = {f'products/{product_id}/{field}': value for field, value in data.items()}
+
+    # Indexed fields changed: the current product is needed to keep the indexes in sync
+    if any(field in data for field in FINGERPRINT_FIELDS):
+        product_data = database.get(f'products/{product_id}') or {}
+
+        # Move the product in the store index if its store changes
+        if 'store_name' in data:
+            updates.update(store_index_updates(product_id, product_data.get('store_name'), data['store_name']))
+
+        # Re-key the product's fingerprint, leaving fingerprints owned by other products alone
+        old_fingerprint = product_fingerprint(product_data)
+        new_fingerprint = product_fingerprint(dict(product_data, **data))
+        if old_fingerprint != new_fingerprint:
+            owners = database.get_many([fingerprint_path(old_fingerprint), fingerprint_path(new_fingerprint)])
+            if owners[fingerprint_path(old_fingerprint)] == product_id:
+                updates[fingerprint_path(old_fingerprint)] = None
+            if not owners[fingerprint_path(new_fingerprint)]:
+                updates[fingerprint_path(new_fingerprint)] = product_id
+
+    database.update('', updates)
+    if any(field in data for field in FINGERPRINT_FIELDS) and product_data:
+        product_search.upsert(product_id, dict(product_data, **data))
+    catalog_cache.bump()
     return jsonify({"message": "Product updated successfully"}), 200
 
 @app.route('/api/products/<product_id>', methods=['DELETE'])
 def delete_product(product_id):
     """Delete a product."""
-    ref = db.reference(f'products/{product_id}')
-    ref.delete()
+    product_data = database.get(f'products/{product_id}') or {}
+    updates = {f'products/{product_id}': None}
+    updates.update(store_index_updates(product_id, product_data.get('store_name'), None))
+
+    # Drop the product's fingerprint if it owns it
+    if product_data and database.get(fingerprint_path(product_fingerprint(product_data))) == product_id:
+        updates[fingerprint_path(product_fingerprint(product_data))] = None
+
+    database.update('', updates)
+    product_search.remove(product_id)
+    catalog_cache.bump()
     return jsonify({"message": "Product deleted successfully"}), 200
 
 @app.route('/api/order/<order_id>/review', methods=['POST'])
@@ -312,9 +832,11 @@ def review_order(order_id):
     if decision not in ['accept', 'reject']:
         return jsonify({"error": "Invalid decision. Choose 'accept' or 'reject'."}), 400
 
-    # Fetch the order from Firebase Realtime Database
-    ref = db.reference(f'orders/{order_id}')
-    order_data = ref.get()
+    # Fetch the order and the store owner's role at the same time
+    order_data, store_owner_type = database.gather(
+        lambda: database.get(f'orders/{order_id}'),
+        lambda: user_cache.user_type(store_owner_id)
+    )
 
     if order_data is None:
         return jsonify({"error": "Order not found"}), 404
@@ -323,17 +845,8 @@ def review_order(order_id):
     if order_data.get('status') != 'pending':
         return jsonify({"error": "Order already processed. Cannot review."}), 400
 
-    # Validate the store owner ID in the users data
-    users_ref = db.reference('users')
-    users = users_ref.get()
-
-    store_owner_valid = False
-    for user_id, user_data in users.items():
-        if user_id == store_owner_id and user_data.get('user_type') == 'store_owner':
-            store_owner_valid = True
-            break
-
-    if not store_owner_valid:
+    # Validate the store owner ID against that user's record only
+    if store_owner_type != 'store_owner':
         return jsonify({"error": "Invalid store owner. User not found or unauthorized."}), 403
 
     # Check the quantity of items in the order
@@ -344,24 +857,45 @@ def review_order(order_id):
 
     # Update the order status based on the decision
     new_status = 'accepted' if decision == 'accept' else 'rejected'
-    ref.update({'status': new_status})
+    updates = {f'orders/{order_id}/status': new_status}
 
     if new_status == 'accepted':
-        # Update the accepted order in the accepted_orders database with the same order_id
-        accepted_orders_ref = db.reference(f'accepted_orders/{order_id}')
+        # Snapshot item prices and the order total now, so riders never have to re-read the catalog
+        products_data = request_loader(database, 'products').load_many(
+            item.get('product_id') for item in order_data['items']
+        )
+        # Products deleted since checkout are priced from the order, so they cannot keep it pending
+        priced_items, total_price = price_items(order_data['items'], products_data, default_price=0)
 
+        # Update the accepted order in the accepted_orders database with the same order_id
         # Prepare the order details to be added to the accepted orders database
         accepted_order_data = {
             'order_id': order_id,
             'store_owner_id': store_owner_id,
-            'items': order_data['items'],  # Keep the order items
+            'items': priced_items,  # Keep the order items with their prices
             'total_quantity': total_quantity,
+            'total_price': total_price,
             'status': 'accepted',
-            'timestamp': order_data.get('timestamp')  # Optionally, you can include the timestamp
+            'timestamp': order_data.get('timestamp'),  # Optionally, you can include the timestamp
+            'dispatch_key': generate_push_id()  # Position in the ready-for-pickup view
         }
 
-        # Store or update the accepted order in the database
-        accepted_orders_ref.set(accepted_order_data)
+        # Store the accepted order and list it as ready for pickup
+        updates[f'accepted_orders/{order_id}'] = accepted_order_data
+        updates.update(ready_for_pickup_updates(accepted_order_data, listed=True))
+
+    # A rejected order is finished: move it straight to the archive. Orders that predate the stored index key
+    # are not archived here and are left for the compaction sweep.
+    archived = False
+    if new_status == 'rejected' and ARCHIVE_FINISHED_ORDERS:
+        archived = order_archiver.archive(order_id, dict(order_data, status=new_status)) is not None
+    if not archived:
+        database.update('', updates)
+    if new_status == 'rejected' and ARCHIVE_FINISHED_ORDERS:
+        order_archiver.maybe_compact()
+
+    if new_status == 'accepted':
+        events.publish(DISPATCH_TOPIC, ORDER_READY, dispatch_summary(accepted_order_data))
 
     return jsonify({
         "message": f"Order {new_status} successfully. Total items: {total_quantity}",
@@ -372,128 +906,145 @@ def review_order(order_id):
 
 @app.route('/api/orders/available_for_riders', methods=['GET'])
 def get_available_orders_for_riders():
-    """Retrieve all accepted orders that can be delivered by any rider."""
-    available_orders = []
-
-    # Fetch all accepted orders from Firebase
-    accepted_orders_ref = db.reference('accepted_orders')
-    accepted_orders_data = accepted_orders_ref.get()
-
-    if not accepted_orders_data:
+    """Retrieve accepted orders that can be delivered by any rider, oldest first.
+
+    Supports limit/cursor pagination (without either, every available order is returned) and an optional
+    store_owner_id filter.
+    """
+    try:
+        limit, cursor = page_args(request.args, default_limit=None)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # A single read of the ready-for-pickup view; totals were computed when the store accepted the order
+    view_path = ready_for_pickup_path(request.args.get('store_owner_id'))
+    page, next_cursor = key_order_page(database, view_path, limit, cursor)
+    available_orders = [summary for _, summary in page]
+
+    if not available_orders:
         return jsonify({"message": "No accepted orders available for delivery."}), 404
 
-    # Fetch all products from the products node
-    products_ref = db.reference('products')
-    products_data = products_ref.get()
-
-    if not products_data:
-        return jsonify({"error": "No products found."}), 404
-
-    # Iterate through accepted orders and prepare the response
-    for order_id, order_details in accepted_orders_data.items():
-        # Initialize total price
-        total_price = 0
-
-        # Ensure the items list exists and has the necessary fields
-        if 'items' in order_details:
-            for item in order_details['items']:
-                product_id = item.get('product_id')
-
-                # Check if product_id exists in the products node
-                product = products_data.get(product_id)
-                if product:
-                    price = product.get('price', 0)  # Default to 0 if price is missing
-                    quantity = item.get('quantity', 0)  # Default to 0 if quantity is missing
-                    total_price += price * quantity
-                else:
-                    # Handle case where product is not found in products data
-                    return jsonify({"error": f"Product with ID {product_id} not found."}), 404
-
-        available_orders.append({
-            "order_id": order_id,
-            "store_owner_id": order_details.get('store_owner_id'),
-            "items": order_details.get('items'),
-            "total_price": total_price,
-            "status": order_details.get('status')
-        })
-
-    return jsonify(available_orders), 200
+    response = jsonify(available_orders)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return response, 200
+
+@app.route('/api/orders/available_for_riders/stream', methods=['GET'])
+def stream_available_orders_for_riders():
+    """Server-sent events: the current dispatchable orders once, then only the changes.
+
+    The first event is a 'snapshot' with the full list; after that come order_ready, order_claimed and
+    order_delivered events. A new snapshot is sent if the client falls too far behind.
+    Supports an optional store_owner_id filter.
+    """
+    store_owner_id = request.args.get('store_owner_id')
+    view_path = ready_for_pickup_path(store_owner_id)
+
+    def event_stream():
+        # Subscribe before reading the snapshot so no change between the two is missed
+        with events.subscribe(DISPATCH_TOPIC) as subscription:
+            yield format_sse('snapshot', list(database.query(view_path).values()))
+            while True:
+                event = subscription.get(timeout=SSE_KEEPALIVE_SECONDS)
+                if event is None:
+                    yield ': keep-alive\n\n'
+                elif event['type'] == RESYNC:
+                    yield format_sse('snapshot', list(database.query(view_path).values()), event['id'])
+                elif not store_owner_id or event['data'].get('store_owner_id') == store_owner_id:
+                    yield format_sse(event['type'], event['data'], event['id'])
+
+    return Response(event_stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # Stop proxies from buffering the stream
+    })
 
 @app.route('/api/orders/<order_id>/accept', methods=['POST'])
+@idempotent(idempotency_store)
 def accept_order_for_delivery(order_id):
     """Rider accepts an order for delivery and updates their profile."""
     data = request.get_json()
     rider_id = data.get('rider_id')
 
-    # Fetch the rider from the users node to validate the rider_id
-    users_ref = db.reference('users')
-    users = users_ref.get()
-
-    rider_valid = False
-    for user_id, user_data in users.items():
-        if user_id == rider_id and user_data.get('user_type') == 'rider':
-            rider_valid = True
-            break
+    # Look up the rider's role and fetch the order from the accepted_orders node at the same time
+    rider_type, order = database.gather(
+        lambda: user_cache.user_type(rider_id),
+        lambda: database.get(f'accepted_orders/{order_id}')
+    )
 
-    if not rider_valid:
+    # Validate the rider_id against that user's record only
+    if rider_type != 'rider':
         return jsonify({"error": "Invalid rider ID. User not found or unauthorized."}), 403
 
-    # Fetch the order from the accepted_orders node
-    accepted_orders_ref = db.reference(f'accepted_orders/{order_id}')
-    order = accepted_orders_ref.get()
-
     if not order:
         return jsonify({"error": "Order not found in accepted orders."}), 404
 
     if order['status'] != 'accepted':
         return jsonify({"error": "Order is not available for delivery."}), 400
 
-    # Assign the order to the rider and update the order status to 'on the way'
-    order['rider_id'] = rider_id
-    order['status'] = 'on the way'  # Change the status to 'on the way'
-
-    # Update the order status in the accepted_orders node
-    accepted_orders_ref.update(order)
-
-    # Update the order status in the main orders node as well
-    orders_ref = db.reference(f'orders/{order_id}')
-    orders_ref.update({'status': 'on the way', 'rider_id': rider_id})
-
-    # Fetch the rider's orders from the 'users' node
-    rider_orders_ref = db.reference(f'users/{rider_id}/assigned_orders')
-    rider_orders = rider_orders_ref.get()
-
-    if rider_orders is None:
-        rider_orders = []
-
-    rider_orders.append(order_id)
+    # Claim the order: only one rider's transaction can move its status from 'accepted' to 'on the way'
+    try:
+        database.transaction(f'accepted_orders/{order_id}/status', claim_status)
+    except OrderNotAvailableError:
+        return jsonify({"error": "Order is not available for delivery."}), 400
 
-    # Update the rider's assigned orders
-    rider_orders_ref.set(rider_orders)
+    # Assign the order to the rider and update the main orders node, taking it off the ready-for-pickup view
+    # and adding it to the rider's assigned orders in the same write
+    updates = {
+        f'accepted_orders/{order_id}/rider_id': rider_id,
+        f'orders/{order_id}/rider_id': rider_id,
+        f'orders/{order_id}/status': 'on the way',
+        assigned_order_path(rider_id, order_id): 1
+    }
+    updates.update(ready_for_pickup_updates(order, listed=False))
+    try:
+        database.update('', updates)
+    except Exception:
+        # Release the claim so the order can still be delivered by someone
+        database.set(f'accepted_orders/{order_id}/status', 'accepted')
+        raise
+    user_cache.invalidate(rider_id)
+    events.publish(DISPATCH_TOPIC, ORDER_CLAIMED, {
+        'order_id': order_id, 'store_owner_id': order.get('store_owner_id'), 'rider_id': rider_id
+    })
 
     return jsonify({"message": "Order accepted for delivery", "order_id": order_id}), 200
 
 @app.route('/api/rider/<rider_id>/orders', methods=['GET'])
 def get_rider_orders(rider_id):
-    """Get all orders assigned to the rider."""
-    # Fetch the users data to validate the rider_id
-    users_ref = db.reference('users')
-    users = users_ref.get()
-
-    rider_profile = None
-    for user_data in users.values():
-        if user_data.get('user_id') == rider_id and user_data.get('user_type') == 'rider':
-            rider_profile = user_data
-            break
-
-    if not rider_profile:
+    """Get the orders assigned to the rider. Supports limit/cursor pagination; without either, every assigned
+    order is returned as before."""
+    try:
+        limit, cursor = page_args(request.args, default_limit=None)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    def read_assigned():
+        if limit is None:
+            assigned = database.get(assigned_order_path(rider_id))
+            entries = enumerate(assigned) if isinstance(assigned, list) else (assigned or {}).items()
+            return list(entries), None
+        return key_order_page(database, assigned_order_path(rider_id), limit, cursor)
+
+    # The assigned orders change with every delivery, so they are always read fresh, alongside the role check
+    rider_type, (page, next_cursor) = database.gather(lambda: user_cache.user_type(rider_id), read_assigned)
+
+    # Validate the rider_id against that user's record only
+    if rider_type != 'rider':
         return jsonify({"error": "Rider not found or unauthorized."}), 404
 
-    # Assuming the rider's assigned orders are stored in a structure like this in the profile
+    assigned_orders = assigned_order_ids(page)
+
+    # Fetch every assigned order in one batch, then every distinct product they contain in another
+    orders_data = request_loader(database, 'orders').load_many(assigned_orders)
+    products_data = request_loader(database, 'products').load_many(
+        item.get('product_id')
+        for order in orders_data.values() if order
+        for item in order.get('items', [])
+    )
+
     rider_orders = []
-    for order_id in rider_profile.get('assigned_orders', []):
-        order_ref = db.reference(f'orders/{order_id}')
-        order = order_ref.get()
+    for order_id in assigned_orders:
+        order = orders_data.get(order_id)
         if order:
             total_price = 0
             order_items = []
@@ -502,8 +1053,7 @@ def get_rider_orders(rider_id):
             for item in order.get('items', []):
                 product_id = item.get('product_id')
                 if product_id:
-                    product_ref = db.reference(f'products/{product_id}')
-                    product = product_ref.get()
+                    product = products_data.get(product_id)
 
                     # If product exists, calculate price
                     if product:
@@ -527,36 +1077,67 @@ def get_rider_orders(rider_id):
     if not rider_orders:
         return jsonify({"message": "No orders assigned to the rider."}), 404
 
-    return jsonify(rider_orders), 200
+    response = jsonify(rider_orders)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return response, 200
+
+@app.route('/api/rider/<rider_id>/completed', methods=['GET'])
+def get_rider_completed_orders(rider_id):
+    """Get the orders the rider has delivered, newest first. Supports limit/cursor pagination.
+
+    The number of orders delivered is returned in the X-Total-Count header.
+    """
+    try:
+        limit, cursor = page_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Check the role while reading the delivery count and one page of the history
+    rider_type, completed_count, (page, next_cursor) = database.gather(
+        lambda: user_cache.user_type(rider_id),
+        lambda: database.get(completed_count_path(rider_id)),
+        lambda: newest_first_page(database, completed_history_path(rider_id), limit, cursor)
+    )
+
+    # Validate the rider_id against that user's record only
+    if rider_type != 'rider':
+        return jsonify({"error": "Rider not found or unauthorized."}), 404
+
+    history = completed_orders(database, page)
+    if not history:
+        return jsonify({"message": "No orders delivered by the rider."}), 404
+
+    response = jsonify(history)
+    response.headers['X-Total-Count'] = str(completed_count or 0)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return response, 200
 
 @app.route('/api/orders/<order_id>/deliver', methods=['POST'])
+@idempotent(idempotency_store)
 def mark_order_as_delivered(order_id):
     """Mark the order as delivered by the rider."""
     data = request.get_json()
     rider_id = data.get('rider_id')
 
-    # Fetch the users data to validate the rider_id
-    users_ref = db.reference('users')
-    users = users_ref.get()
+    # Look up the rider's role while fetching the order and its accepted_orders copy
+    rider_type, records = database.gather(
+        lambda: user_cache.user_type(rider_id),
+        lambda: database.get_many([f'orders/{order_id}', f'accepted_orders/{order_id}'])
+    )
 
-    rider_profile = None
-    for user_data in users.values():
-        if user_data.get('user_id') == rider_id and user_data.get('user_type') == 'rider':
-            rider_profile = user_data
-            break
-
-    if not rider_profile:
+    # Validate the rider_id against that user's record only
+    if rider_type != 'rider':
         return jsonify({"error": "Rider not found or unauthorized."}), 404
 
-    # Fetch the order from the orders node
-    order_ref = db.reference(f'orders/{order_id}')
-    order = order_ref.get()
+    # The order from the orders node
+    order = records[f'orders/{order_id}']
     if not order:
         return jsonify({"error": "Order not found"}), 404
 
-    # Fetch the corresponding order from the accepted_orders node
-    accepted_order_ref = db.reference(f'accepted_orders/{order_id}')
-    accepted_order = accepted_order_ref.get()
+    # The corresponding order from the accepted_orders node
+    accepted_order = records[f'accepted_orders/{order_id}']
     if not accepted_order:
         return jsonify({"error": "Order not found in accepted orders"}), 404
 
@@ -568,22 +1149,142 @@ def mark_order_as_delivered(order_id):
     if order['status'] != 'on the way' or accepted_order['status'] != 'on the way':
         return jsonify({"error": "Order is not 'on the way'. Cannot mark as delivered."}), 400
 
-    # Update the status of both the orders and accepted_orders to 'delivered'
-    order_ref.update({'status': 'delivered'})
-    accepted_order_ref.update({'status': 'delivered'})
-
-    # Update the rider's order status to 'delivered' as well
-    rider_profile_ref = db.reference(f'users/{rider_id}')
-    if rider_profile_ref:
-        # Ensure that the order is in the rider's assigned orders
-        if order_id in rider_profile.get('assigned_orders', []):
-            rider_profile_ref.update({
-                'assigned_orders': [order for order in rider_profile.get('assigned_orders', []) if order != order_id],
-                'completed_orders': rider_profile.get('completed_orders', []) + [order_id]
-            })
+    # Update the status of both the orders and accepted_orders to 'delivered', making sure the order is
+    # no longer listed as ready for pickup and is moved from the rider's assigned orders to their history
+    updates = ready_for_pickup_updates(accepted_order, listed=False)
+    updates.update(delivery_updates(rider_id, order_id, partition_date(order.get('timestamp'))))
+    # Delivered orders leave the hot nodes in the same write, except those that predate the stored index key,
+    # which the compaction sweep archives later
+    archived = order_archiver.updates_for(
+        order_id, dict(order, status='delivered'), dict(accepted_order, status='delivered')
+    ) if ARCHIVE_FINISHED_ORDERS else None
+    if archived:
+        updates.update(archived[0])
+    else:
+        updates[f'orders/{order_id}/status'] = 'delivered'
+        updates[f'accepted_orders/{order_id}/status'] = 'delivered'
+
+    # Taking the order out of the rider's assigned orders succeeds only once, so a repeated or concurrent
+    # delivery writes nothing and is not counted twice
+    try:
+        database.reserve(delivery_decrements(rider_id, order_id), updates)
+    except InsufficientValueError:
+        # Until migrate-rider-orders has run, the order may still be a legacy list entry, which is taken
+        # once by its own transaction instead
+        legacy_key = take_legacy_assigned_order(database, rider_id, order_id)
+        if legacy_key is None:
+            return jsonify({"error": "Order is not among the rider's assigned orders. Cannot mark as delivered."}), 400
+        updates[assigned_order_path(rider_id, legacy_key)] = None
+        database.increment({completed_count_path(rider_id): 1}, updates)
+    user_cache.invalidate(rider_id)
+
+    if archived:
+        order_archiver.record(archived[1])
+    if ARCHIVE_FINISHED_ORDERS:
+        order_archiver.maybe_compact()
+    events.publish(DISPATCH_TOPIC, ORDER_DELIVERED, {
+        'order_id': order_id, 'store_owner_id': accepted_order.get('store_owner_id'), 'rider_id': rider_id
+    })
 
     return jsonify({"message": "Order marked as delivered", "order_id": order_id}), 200
 
+# ---------------------- Metrics APIs ----------------------
+
+@app.route('/api/metrics/user_cache', methods=['GET'])
+def get_user_cache_stats():
+    """Hit/miss counters of the user lookup cache."""
+    return jsonify(user_cache.stats()), 200
+
+@app.route('/api/metrics/catalog_cache', methods=['GET'])
+def get_catalog_cache_stats():
+    """Hit ratio and counters of the catalog response cache."""
+    return jsonify(catalog_cache.stats()), 200
+
+@app.route('/api/metrics/idempotency', methods=['GET'])
+def get_idempotency_stats():
+    """Executions, replays and coalesced duplicates of requests sent with an Idempotency-Key."""
+    return jsonify(idempotency_store.stats()), 200
+
+@app.route('/api/metrics/admission', methods=['GET'])
+def get_admission_stats():
+    """Requests admitted, rate limited and shed per priority class, and the current load."""
+    return jsonify(admission.stats()), 200
+
+@app.route('/api/metrics/product_replica', methods=['GET'])
+def get_product_replica_stats():
+    """Sync state, hit counters, staleness and lag of the in-process product replica."""
+    if product_replica is None:
+        return jsonify({"error": "Product replica is not enabled"}), 404
+    return jsonify(product_replica.stats()), 200
+
+@app.route('/api/metrics/order_archive', methods=['GET'])
+def get_order_archive_stats():
+    """Orders moved to the archive, bytes removed from the hot order nodes and the last compaction."""
+    return jsonify(order_archiver.stats()), 200
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Per-route request histograms and cache counters in the Prometheus text format."""
+    body = (request_metrics.render()
+            + render_gauges('user_cache', user_cache.stats(), 'User lookup cache statistic.')
+            + render_gauges('catalog_cache', catalog_cache.stats(), 'Catalog response cache statistic.')
+            + render_gauges('idempotency', idempotency_store.stats(), 'Idempotency key store statistic.')
+            + render_gauges('product_search', product_search.stats(), 'Product search index statistic.')
+            + render_gauges('admission', admission.stats(), 'Admission control statistic.')
+            + render_gauges('order_archive', order_archiver.stats(), 'Order archive statistic.'))
+    if product_replica is not None:
+        replica_stats = product_replica.stats()
+        replica_stats.update(synced=int(replica_stats['synced']), complete=int(replica_stats['complete']))
+        body += render_gauges('product_replica', replica_stats, 'Product replica statistic.')
+    return Response(body, content_type=PROMETHEUS_CONTENT_TYPE)
+
+# ---------------------- Maintenance Commands ----------------------
+
+@app.cli.command('rebuild-store-index')
+def rebuild_store_index_command():
+    """Rebuild the store -> product ids index from the existing products."""
+    indexed = rebuild_store_index(database)
+    print(f"Indexed {indexed} products by store.")
+
+@app.cli.command('rebuild-user-order-index')
+def rebuild_user_order_index_command():
+    """Build the user -> order ids index from the existing orders."""
+    indexed = rebuild_user_order_index(database)
+    print(f"Indexed {indexed} orders by user.")
+
+@app.cli.command('rebuild-product-fingerprints')
+def rebuild_product_fingerprints_command():
+    """Rebuild the fingerprint -> product id index used to de-duplicate new products."""
+    indexed = rebuild_product_fingerprints(database)
+    print(f"Indexed {indexed} product fingerprints.")
+
+@app.cli.command('migrate-carts')
+def migrate_carts_command():
+    """Convert list-shaped carts into carts keyed by product ID."""
+    migrated = migrate_carts(database)
+    print(f"Migrated {migrated} carts.")
+
+@app.cli.command('rebuild-dispatch-view')
+def rebuild_dispatch_view_command():
+    """Rebuild the ready-for-pickup view (with order totals) from the existing accepted orders."""
+    listed = rebuild_dispatch_view(database)
+    print(f"Listed {listed} orders as ready for pickup.")
+
+@app.cli.command('compact-orders')
+def compact_orders_command():
+    """Move every delivered and rejected order out of the hot order nodes into the archive."""
+    if not order_archiver.ready():
+        print("Run migrate-rider-orders first: the rider histories are dated from the orders being archived.")
+        raise SystemExit(1)
+    result = order_archiver.compact()
+    print(f"Archived {result['archived']} orders, removing {result['bytes_saved']} bytes from the hot nodes.")
+
+@app.cli.command('migrate-rider-orders')
+def migrate_rider_orders_command():
+    """Convert riders' list-shaped assigned and completed orders into keyed sets, a counter and a history."""
+    migrated = migrate_rider_orders(database)
+    print(f"Migrated {migrated} riders.")
+
 # ---------------------- Driver ----------------------
 
 if __name__ == '__main__':
@@ -0,0 +1,244 @@
+import json
+import time
+import threading
+import traceback
+from datetime import datetime, timezone
+
+from indexes import user_orders_path
+
+# Finished orders are moved out of the hot orders and accepted_orders nodes into a cold archive, partitioned by
+# the UTC date the order was placed: archive/orders/<YYYY-MM-DD>/<order_id> holds the order together with its
+# accepted_orders copy. Each user's entry moves from orders_by_user to archive/orders_by_user under the same
+# push key, so the history reads newest first like the live orders do.
+ARCHIVED_ORDERS = 'archive/orders'
+ARCHIVED_ORDERS_BY_USER = 'archive/orders_by_user'
+FINISHED_STATUSES = ('delivered', 'rejected')
+
+# Orders archived per multi-path update by the compaction job
+DEFAULT_BATCH_SIZE = 200
+DEFAULT_COMPACTION_SECONDS = 3600
+
+
+def partition_date(timestamp):
+    """The archive partition (UTC date, YYYY-MM-DD) of an order placed at timestamp (milliseconds)."""
+    return datetime.fromtimestamp((timestamp or 0) / 1000, tz=timezone.utc).strftime('%Y-%m-%d')
+
+
+def valid_partition(date):
+    """Whether date is a partition name (YYYY-MM-DD)."""
+    try:
+        return datetime.strptime(date, '%Y-%m-%d').strftime('%Y-%m-%d') == date
+    except ValueError:
+        return False
+
+
+def archive_partition_path(date, order_id=None):
+    """Path of one day's archived orders, or of one archived order."""
+    path = f'{ARCHIVED_ORDERS}/{date}'
+    return f'{path}/{order_id}' if order_id else path
+
+
+def archived_user_orders_path(user_id, index_key=None):
+    """Path of a user's entry in the archived user -> orders index."""
+    path = f'{ARCHIVED_ORDERS_BY_USER}/{user_id}'
+    return f'{path}/{index_key}' if index_key else path
+
+
+def payload_size(value):
+    """Bytes value takes up as compact JSON."""
+    return len(json.dumps(value, separators=(',', ':')).encode('utf-8'))
+
+
+def find_user_order_key(database, user_id, order_id):
+    """Key of an order's entry in the user's live order index, or None. Orders placed since the key was stored
+    on the order (user_index_key) do not need this lookup.
+
+    This is an orderByValue query, which needs the ".indexOn": ".value" rule on orders_by_user/$user_id
+    (see database.rules.json). Only compaction runs it, never a request.
+    """
+    entries = database.query(user_orders_path(user_id), order_by='$value', equal_to=order_id, limit_to_first=1)
+    return next(iter(entries), None)
+
+
+def archive_updates(order_id, order, accepted_order=None, index_key=None):
+    """Multi-path update entries that move a finished order out of the hot nodes and into the archive.
+
+    Returns the updates and the bytes they remove from the hot nodes.
+    """
+    date = partition_date(order.get('timestamp'))
+    record = dict(order, order_id=order_id, archived_at=int(time.time() * 1000))
+    if accepted_order:
+        record['accepted_order'] = accepted_order
+    updates = {
+        f'orders/{order_id}': None,
+        f'accepted_orders/{order_id}': None,
+        archive_partition_path(date, order_id): record
+    }
+    saved = payload_size(order) + (payload_size(accepted_order) if accepted_order else 0)
+
+    user_id = order.get('user_id')
+    if user_id and index_key:
+        updates[user_orders_path(user_id, index_key)] = None
+        updates[archived_user_orders_path(user_id, index_key)] = {'order_id': order_id, 'date': date}
+        saved += payload_size(order_id)
+    return updates, saved
+
+
+def archived_orders(database, entries):
+    """Read the archived orders of (key, {'order_id', 'date'}) index entries, in the same order."""
+    entries = [entry for _, entry in entries if isinstance(entry, dict)]
+    paths = [archive_partition_path(entry['date'], entry['order_id']) for entry in entries]
+    records = database.get_many(paths)
+    return [records[path] for path in paths if records[path]]
+
+
+class OrderArchiver:
+    """Moves delivered and rejected orders into the archive.
+
+    archive() moves a single order the moment it is finished. compact() sweeps the orders node for any
+    finished order that is still there (orders finished before archiving existed, or on other paths), a batch
+    at a time; maybe_compact() starts it in the background once the last sweep is older than interval.
+    ready, if given, is called before a background sweep; while it returns False the sweep is skipped (e.g.
+    until a data migration that must see the orders in place has run).
+    """
+
+    def __init__(self, database, batch_size=DEFAULT_BATCH_SIZE, interval=DEFAULT_COMPACTION_SECONDS,
+                 ready=None, clock=time.monotonic):
+        self._database = database
+        self._batch_size = batch_size
+        self._interval = interval
+        self._ready = ready
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._compacting = False
+        self._last_compaction = None
+        self.archived_on_finish = 0
+        self.archived_by_compaction = 0
+        self.bytes_saved = 0
+        self.compactions = 0
+        self.last_compaction_seconds = None
+        self.last_error = None
+        self.waiting = False  # Whether the last background sweep was skipped because ready() was False
+
+    def archive(self, order_id, order, accepted_order=None, extra_updates=None):
+        """Archive one finished order (with the status it finished in) in a single multi-path update,
+        together with extra_updates. Returns the bytes removed from the hot nodes, or None if the order is
+        left for compaction (see updates_for) and nothing was written."""
+        prepared = self.updates_for(order_id, order, accepted_order)
+        if prepared is None:
+            return None
+        updates, saved = prepared
+        updates.update(extra_updates or {})
+        self._database.update('', updates)
+        self.record(saved)
+        return saved
+
+    def updates_for(self, order_id, order, accepted_order=None):
+        """archive_updates() for one finished order, for callers that write them as part of their own step.
+        Call record() once they are written.
+
+        Returns None for orders placed before their index key was stored on them: finding the key takes a
+        query, which is left to compaction instead of running while a request is served.
+        """
+        if not order.get('user_index_key') and order.get('user_id'):
+            return None
+        return archive_updates(order_id, order, accepted_order, order.get('user_index_key'))
+
+    def record(self, saved):
+        """Count one order archived when it finished, which removed saved bytes from the hot nodes."""
+        with self._lock:
+            self.archived_on_finish += 1
+            self.bytes_saved += saved
+
+    def ready(self):
+        """Whether compaction may run (see the ready argument)."""
+        return self._ready is None or bool(self._ready())
+
+    def compact(self):
+        """Archive every finished order still in the orders node. Returns the orders archived and bytes saved.
+
+        Queries orders by status, which needs the ".indexOn": ["status"] rule on orders (see database.rules.json).
+        """
+        started = self._clock()
+        archived = saved = 0
+        for status in FINISHED_STATUSES:
+            while True:
+                batch = self._database.query('orders', order_by='status', equal_to=status,
+                                             limit_to_first=self._batch_size)
+                if not batch:
+                    break
+                batch_saved = self._archive_batch(batch)
+                archived += len(batch)
+                saved += batch_saved
+                with self._lock:
+                    self.archived_by_compaction += len(batch)
+                    self.bytes_saved += batch_saved
+        with self._lock:
+            self.compactions += 1
+            self.last_compaction_seconds = round(self._clock() - started, 3)
+        return {'archived': archived, 'bytes_saved': saved}
+
+    def _archive_batch(self, orders):
+        order_ids = list(orders)
+        accepted = self._database.get_many(f'accepted_orders/{order_id}' for order_id in order_ids)
+        # Orders placed before their index key was stored need one lookup each, run concurrently
+        missing = [order_id for order_id in order_ids
+                   if not orders[order_id].get('user_index_key') and orders[order_id].get('user_id')]
+        found = self._database.gather(*(
+            lambda order_id=order_id: find_user_order_key(self._database, orders[order_id]['user_id'], order_id)
+            for order_id in missing
+        ))
+        index_keys = dict(zip(missing, found))
+
+        updates = {}
+        saved = 0
+        for order_id, order in orders.items():
+            order_updates, order_saved = archive_updates(
+                order_id, order, accepted[f'accepted_orders/{order_id}'],
+                order.get('user_index_key') or index_keys.get(order_id)
+            )
+            updates.update(order_updates)
+            saved += order_saved
+        self._database.update('', updates)
+        return saved
+
+    def maybe_compact(self):
+        """Start a background compaction if none has run for interval seconds."""
+        if not self._interval:
+            return
+        with self._lock:
+            if self._compacting:
+                return
+            if self._last_compaction is not None and self._clock() - self._last_compaction < self._interval:
+                return
+            self._compacting = True
+            self._last_compaction = self._clock()
+        threading.Thread(target=self._compact_in_background, daemon=True).start()
+
+    def _compact_in_background(self):
+        try:
+            self.waiting = not self.ready()
+            if not self.waiting:
+                self.compact()
+            self.last_error = None
+        except Exception as e:
+            # The next sweep retries; orders that were already moved stay moved
+            self.last_error = str(e)
+            traceback.print_exc()
+        finally:
+            with self._lock:
+                self._compacting = False
+
+    def stats(self):
+        """Orders archived when finished and by compaction, bytes removed from the hot nodes, and the last sweep."""
+        with self._lock:
+            return {
+                'archived_on_finish': self.archived_on_finish,
+                'archived_by_compaction': self.archived_by_compaction,
+                'bytes_saved': self.bytes_saved,
+                'compactions': self.compactions,
+                'compacting': self._compacting,
+                'waiting': self.waiting,
+                'last_compaction_seconds': self.last_compaction_seconds,
+                'last_error': self.last_error,
+            }
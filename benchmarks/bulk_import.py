@@ -0,0 +1,68 @@
+"""Compare importing a catalog one POST /api/products at a time with POST /api/products/batch.
+
+Usage: python benchmarks/bulk_import.py [--backend memory|sqlite] [--products 2000] [--batch-size 500]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def make_products(count):
+    # Every tenth product repeats an earlier one, as happens when a store re-uploads part of its catalog
+    return [
+        {
+            'name': f'Product {index - index % 10 if index % 10 == 9 else index}',
+            'description': 'Benchmark product',
+            'price': 10 + index % 50,
+            'image_url': 'https://example.com/image.png',
+            'store_name': f'Store {index % 20}',
+            'stock': 5
+        }
+        for index in range(count)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backend', choices=['memory', 'sqlite'], default='memory')
+    parser.add_argument('--products', type=int, default=2000)
+    parser.add_argument('--batch-size', type=int, default=500)
+    args = parser.parse_args()
+
+    os.environ['STORAGE_BACKEND'] = args.backend
+    os.environ['ADMISSION_CONTROL'] = 'off'  # All requests come from one client
+    if args.backend == 'sqlite':
+        os.environ['SQLITE_PATH'] = os.path.join(tempfile.mkdtemp(), 'bulk.db')
+
+    from app import app, database
+
+    client = app.test_client()
+    products = make_products(args.products)
+
+    database.delete('')
+    started = time.perf_counter()
+    for product in products:
+        client.post('/api/products', json=product)
+    single_seconds = time.perf_counter() - started
+    single_count = len(database.get('products') or {})
+
+    database.delete('')
+    started = time.perf_counter()
+    for start in range(0, len(products), args.batch_size):
+        client.post('/api/products/batch', json={'products': products[start:start + args.batch_size]})
+    batch_seconds = time.perf_counter() - started
+    batch_count = len(database.get('products') or {})
+
+    print(f"backend={args.backend} products={args.products} batch_size={args.batch_size}")
+    print(f"single: {single_seconds:.3f}s ({args.products / single_seconds:.0f} items/s), {single_count} stored")
+    print(f"batch:  {batch_seconds:.3f}s ({args.products / batch_seconds:.0f} items/s), {batch_count} stored")
+    print(f"speedup: {single_seconds / batch_seconds:.1f}x")
+    return 0 if single_count == batch_count else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
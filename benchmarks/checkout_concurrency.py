@@ -0,0 +1,137 @@
+"""Run many parallel checkouts for the same scarce products against a local backend and check nothing is oversold.
+
+Usage: python benchmarks/checkout_concurrency.py [--backend memory|sqlite|cas] [--customers 200] [--stock 50]
+                                                 [--update-failures 0.2]
+The cas backend keeps data in memory but reserves stock the way Firebase does (see CompareAndSetStorage);
+--update-failures makes that fraction of its order writes fail, to check the stock taken is given back.
+Exits with status 1 if more units were sold than were in stock, or stock was lost to a failed checkout.
+"""
+import os
+import sys
+import time
+import random
+import logging
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import MemoryStorage, Storage
+
+
+class CompareAndSetStorage(MemoryStorage):
+    """Memory backend without multi-location writes, like Firebase: reserve() is the base Storage one, a
+    compare-and-set transaction per number run in parallel, then the update, giving the numbers back if it fails.
+
+    update_failure_rate is the fraction of multi-path updates that fail before writing anything.
+    """
+
+    reserve = Storage.reserve
+
+    def __init__(self, update_failure_rate=0.0, seed=1, concurrency=8):
+        super().__init__()
+        self.update_failure_rate = update_failure_rate
+        self.failed_updates = 0
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    def _map(self, fn, items):
+        return list(self._executor.map(fn, items))
+
+    def update(self, path, updates):
+        with self._rng_lock:
+            fail = self._rng.random() < self.update_failure_rate
+            self.failed_updates += fail
+        if fail:
+            raise ConnectionError("Simulated failed update")
+        super().update(path, updates)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backend', choices=['memory', 'sqlite', 'cas'], default='memory')
+    parser.add_argument('--customers', type=int, default=200)
+    parser.add_argument('--stock', type=int, default=50)
+    parser.add_argument('--workers', type=int, default=32)
+    parser.add_argument('--update-failures', type=float, default=0.0)
+    args = parser.parse_args()
+    if args.update_failures and args.backend != 'cas':
+        parser.error("--update-failures needs --backend cas")
+
+    os.environ['STORAGE_BACKEND'] = 'memory' if args.backend == 'cas' else args.backend
+    os.environ['ADMISSION_CONTROL'] = 'off'  # All requests come from one client
+    if args.backend == 'sqlite':
+        os.environ['SQLITE_PATH'] = os.path.join(tempfile.mkdtemp(), 'checkout.db')
+
+    import app as app_module
+    from app import app, database
+
+    storage = None
+    if args.backend == 'cas':
+        storage = app_module.database.storage = CompareAndSetStorage()
+    client = app.test_client()
+
+    # Two scarce products; every customer wants one unit of each
+    product_ids = []
+    for name in ('Shirt', 'Hat'):
+        response = client.post('/api/products', json={
+            'name': name, 'description': 'Benchmark product', 'price': 10,
+            'image_url': 'https://example.com/image.png', 'store_name': 'Benchmark Store', 'stock': args.stock
+        })
+        product_ids.append(response.get_json()['product_id'])
+
+    customer_ids = []
+    for _ in range(args.customers):
+        user_id = client.post('/api/users', json={'user_type': 'customer'}).get_json()['user_id']
+        for product_id in product_ids:
+            client.post(f'/api/cart/{user_id}/add_product', json={'product_id': product_id, 'quantity': 1})
+        customer_ids.append(user_id)
+
+    def checkout(user_id):
+        return app.test_client().post(f'/api/order/{user_id}').status_code
+
+    if storage is not None:
+        storage.update_failure_rate = args.update_failures
+        app.logger.setLevel(logging.CRITICAL)  # The simulated failures are expected; do not log each one
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        statuses = list(executor.map(checkout, customer_ids))
+    elapsed = time.perf_counter() - started
+    if storage is not None:
+        storage.update_failure_rate = 0
+
+    placed = statuses.count(201)
+    rejected = statuses.count(400)
+    failed = statuses.count(500)
+    remaining = [database.get(f'products/{product_id}/stock') for product_id in product_ids]
+    orders = database.get('orders') or {}
+
+    print(f"backend={args.backend} customers={args.customers} stock={args.stock} "
+          f"placed={placed} rejected={rejected} failed={failed} other={len(statuses) - placed - rejected - failed} "
+          f"remaining_stock={remaining} elapsed={elapsed:.3f}s")
+
+    # A failed checkout must give back all the stock it took, so the stock left always matches the orders placed
+    problems = []
+    if placed > args.stock:
+        problems.append(f"{placed} orders placed for a stock of {args.stock}")
+    if len(orders) != placed:
+        problems.append(f"{len(orders)} orders stored for {placed} placed")
+    if any(stock != args.stock - placed for stock in remaining):
+        problems.append(f"stock {remaining} does not match {placed} orders placed from {args.stock}")
+    if len(statuses) != placed + rejected + failed or (failed and not args.update_failures):
+        problems.append(f"unexpected statuses {sorted(set(statuses))}")
+    if args.update_failures and placed + rejected == len(statuses):
+        problems.append("no checkout hit a simulated failure; raise --update-failures or --customers")
+    if problems:
+        for problem in problems:
+            print(f"FAIL: {problem}")
+        return 1
+    print("OK: no overselling" + (", and failed checkouts gave their stock back" if failed else ""))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,122 @@
+"""Have many riders claim and deliver the same orders in parallel against a local backend and check that every
+order goes to exactly one rider and every delivery is counted once.
+
+Usage: python benchmarks/claim_concurrency.py [--backend memory|sqlite|cas] [--orders 50] [--riders 20]
+The cas backend takes deliveries the way Firebase does (see checkout_concurrency.CompareAndSetStorage).
+Exits with status 1 if an order was claimed or delivered twice, or a rider's assigned set, delivery count or
+history disagrees with the claims and deliveries that succeeded.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backend', choices=['memory', 'sqlite', 'cas'], default='memory')
+    parser.add_argument('--orders', type=int, default=50)
+    parser.add_argument('--riders', type=int, default=20)
+    parser.add_argument('--workers', type=int, default=32)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    os.environ['STORAGE_BACKEND'] = 'memory' if args.backend == 'cas' else args.backend
+    os.environ['ADMISSION_CONTROL'] = 'off'  # All requests come from one client
+    if args.backend == 'sqlite':
+        os.environ['SQLITE_PATH'] = os.path.join(tempfile.mkdtemp(), 'claims.db')
+
+    import app as app_module
+    from app import app, database
+    from riders import assigned_order_path, completed_count_path, completed_history_path
+
+    if args.backend == 'cas':
+        from checkout_concurrency import CompareAndSetStorage
+        app_module.database.storage = CompareAndSetStorage()
+
+    client = app.test_client()
+    rng = random.Random(args.seed)
+
+    def create_user(user_type):
+        return client.post('/api/users', json={'user_type': user_type}).get_json()['user_id']
+
+    store_owner_id = create_user('store_owner')
+    rider_ids = [create_user('rider') for _ in range(args.riders)]
+    product_id = client.post('/api/products', json={
+        'name': 'Parcel', 'description': 'Benchmark product', 'price': 10,
+        'image_url': 'https://example.com/image.png', 'store_name': 'Benchmark Store', 'stock': args.orders
+    }).get_json()['product_id']
+
+    # Orders accepted by the store and waiting for a rider
+    order_ids = []
+    for _ in range(args.orders):
+        user_id = create_user('customer')
+        client.post(f'/api/cart/{user_id}/add_product', json={'product_id': product_id, 'quantity': 1})
+        order_id = client.post(f'/api/order/{user_id}').get_json()['order_id']
+        client.post(f'/api/order/{order_id}/review', json={'store_owner_id': store_owner_id, 'decision': 'accept'})
+        order_ids.append(order_id)
+
+    def send(path, rider_id):
+        return app.test_client().post(path, json={'rider_id': rider_id}).status_code
+
+    # Every rider tries to claim every order
+    claims = [(order_id, rider_id) for order_id in order_ids for rider_id in rider_ids]
+    rng.shuffle(claims)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        statuses = list(executor.map(lambda claim: send(f'/api/orders/{claim[0]}/accept', claim[1]), claims))
+    claim_seconds = time.perf_counter() - started
+    won = {}
+    for (order_id, rider_id), status in zip(claims, statuses):
+        if status == 200:
+            won.setdefault(order_id, []).append(rider_id)
+
+    problems = []
+    if any(len(winners) != 1 for winners in won.values()) or len(won) != len(order_ids):
+        problems.append(f"{sum(len(winners) for winners in won.values())} successful claims for {len(order_ids)} orders")
+    for order_id, winners in won.items():
+        if database.get(f'orders/{order_id}/rider_id') != winners[0] \
+                or database.get(f'accepted_orders/{order_id}/rider_id') != winners[0]:
+            problems.append(f"order {order_id} is not assigned to the rider that claimed it")
+    for rider_id in rider_ids:
+        expected = {order_id for order_id, winners in won.items() if rider_id in winners}
+        if set(database.get(assigned_order_path(rider_id)) or {}) != expected:
+            problems.append(f"rider {rider_id} has the wrong assigned orders")
+
+    # Each winner delivers each of their orders twice at the same time
+    deliveries = [(order_id, winners[0]) for order_id, winners in won.items()] * 2
+    rng.shuffle(deliveries)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        statuses = list(executor.map(
+            lambda delivery: send(f'/api/orders/{delivery[0]}/deliver', delivery[1]), deliveries))
+    deliver_seconds = time.perf_counter() - started
+
+    if statuses.count(200) != len(won):
+        problems.append(f"{statuses.count(200)} successful deliveries for {len(won)} orders")
+    for rider_id in rider_ids:
+        expected = sum(1 for winners in won.values() if winners[0] == rider_id)
+        history = database.get(completed_history_path(rider_id)) or {}
+        if (database.get(completed_count_path(rider_id)) or 0) != expected or len(history) != expected:
+            problems.append(f"rider {rider_id} has the wrong delivery count or history")
+        if database.get(assigned_order_path(rider_id)):
+            problems.append(f"rider {rider_id} still has assigned orders")
+
+    print(f"backend={args.backend} orders={args.orders} riders={args.riders} claims={len(claims)} "
+          f"claimed={len(won)} claim_time={claim_seconds:.3f}s delivered={statuses.count(200)} "
+          f"deliver_time={deliver_seconds:.3f}s")
+    if problems:
+        for problem in problems[:20]:
+            print(f"FAIL: {problem}")
+        return 1
+    print("OK: every order claimed and delivered exactly once")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,165 @@
+"""Compare sequential and concurrent database reads within a request against a backend with network latency.
+
+The Realtime Database answers every call after an HTTPS round trip. This script wraps the memory backend so
+each call sleeps for --latency-ms, then serves the same requests twice from a pool of concurrent clients:
+  sequential  every call waits for the previous one, as on a plain sync WSGI worker
+  concurrent  independent calls (get_many, gather) are in flight together, like the Firebase backend
+Usage: python benchmarks/concurrent_reads.py [--latency-ms 20] [--requests 100] [--concurrency 8]
+Exits with status 1 if the concurrent mode is slower on any endpoint.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+os.environ['STORAGE_BACKEND'] = 'memory'
+os.environ['ADMISSION_CONTROL'] = 'off'  # All requests come from one client
+
+from storage import MemoryStorage, Storage  # noqa: E402
+
+
+class LatencyStorage(MemoryStorage):
+    """Memory backend where every call costs one simulated network round trip."""
+
+    def __init__(self, latency, concurrency=None):
+        super().__init__()
+        self.latency = latency
+        if concurrency:
+            self._executor = ThreadPoolExecutor(max_workers=concurrency)
+            self._gather_executor = ThreadPoolExecutor(max_workers=concurrency)
+        else:
+            self._executor = None
+
+    def _round_trip(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _map(self, fn, items):
+        if self._executor is None:
+            return list(map(fn, items))
+        return list(self._executor.map(fn, items))
+
+    def get(self, path):
+        self._round_trip()
+        return super().get(path)
+
+    # One round trip per path, like FirebaseStorage
+    get_many = Storage.get_many
+
+    def set(self, path, value):
+        self._round_trip()
+        super().set(path, value)
+
+    def update(self, path, values):
+        self._round_trip()
+        super().update(path, values)
+
+    def query(self, path, **kwargs):
+        self._round_trip()
+        return super().query(path, **kwargs)
+
+    def transaction(self, path, update_fn):
+        self._round_trip()
+        return super().transaction(path, update_fn)
+
+    def reserve(self, decrements, updates=None):
+        self._round_trip()
+        super().reserve(decrements, updates)
+
+
+def requests_for(ids, rng, count):
+    """(endpoint, method, url, json) for the handlers that issue independent reads."""
+    pending = list(ids['pending'])
+    on_the_way = list(ids['on_the_way'])
+    accepted = list(ids['accepted'])
+    plan = []
+    for _ in range(count):
+        plan.append(('get_cart', 'GET', f'/api/cart/{rng.choice(ids["shoppers"])}', None))
+        plan.append(('get_user_orders', 'GET', f'/api/order/{rng.choice(ids["customers"])}?limit=10', None))
+        plan.append(('get_rider_orders', 'GET', f'/api/rider/{rng.choice(ids["busy_riders"])}/orders?limit=10',
+                     None))
+        if pending:
+            plan.append(('review_order', 'POST', f'/api/order/{pending.pop()}/review',
+                         {'store_owner_id': rng.choice(ids['store_owners']), 'decision': 'reject'}))
+        if accepted:
+            plan.append(('accept_order_for_delivery', 'POST', f'/api/orders/{accepted.pop()}/accept',
+                         {'rider_id': rng.choice(ids['riders'])}))
+        if on_the_way:
+            order_id, rider_id = on_the_way.pop()
+            plan.append(('mark_order_as_delivered', 'POST', f'/api/orders/{order_id}/deliver',
+                         {'rider_id': rider_id}))
+    return plan
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--latency-ms', type=float, default=20.0)
+    parser.add_argument('--requests', type=int, default=100, help='requests per endpoint')
+    parser.add_argument('--concurrency', type=int, default=8, help='parallel clients')
+    parser.add_argument('--read-concurrency', type=int, default=16)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--products', type=int, default=1000)
+    parser.add_argument('--orders', type=int, default=5000)
+    args = parser.parse_args()
+
+    import app as app_module
+    from load_test import seed
+
+    results = {}
+    for mode in ('sequential', 'concurrent'):
+        storage = LatencyStorage(0, concurrency=args.read_concurrency if mode == 'concurrent' else None)
+        app_module.database.storage = storage
+        app_module.user_cache.clear()
+        ids = seed(app_module.database, argparse.Namespace(
+            users=args.users, products=args.products, orders=args.orders, stores=20, requests=args.requests
+        ), random.Random(1))
+        plan = requests_for(ids, random.Random(2), args.requests)
+        # User lookups are cached in production; start each mode from the same cold cache
+        app_module.user_cache.clear()
+        storage.latency = args.latency_ms / 1000
+
+        latencies = {}
+
+        def send(entry):
+            endpoint, method, url, body = entry
+            started = time.perf_counter()
+            response = app_module.app.test_client().open(url, method=method, json=body)
+            response.get_data()
+            elapsed = (time.perf_counter() - started) * 1000
+            if response.status_code >= 500:
+                raise RuntimeError(f"{method} {url} -> {response.status_code}")
+            return endpoint, elapsed
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            for endpoint, elapsed in executor.map(send, plan):
+                latencies.setdefault(endpoint, []).append(elapsed)
+        wall = time.perf_counter() - started
+        results[mode] = (latencies, len(plan) / wall)
+
+    print(f"simulated round trip {args.latency_ms:.0f}ms, {args.concurrency} parallel clients")
+    print(f"{'endpoint':28} {'sequential ms':>14} {'concurrent ms':>14} {'speedup':>8}")
+    slower = []
+    for endpoint in results['sequential'][0]:
+        before = statistics.median(results['sequential'][0][endpoint])
+        after = statistics.median(results['concurrent'][0][endpoint])
+        print(f"{endpoint:28} {before:14.1f} {after:14.1f} {before / after:7.2f}x")
+        if after > before * 1.1:
+            slower.append(endpoint)
+    print(f"throughput: sequential {results['sequential'][1]:.0f} req/s, "
+          f"concurrent {results['concurrent'][1]:.0f} req/s")
+    if slower:
+        print(f"FAIL: concurrent mode is slower for {', '.join(slower)}")
+        return 1
+    print("OK")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
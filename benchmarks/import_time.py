@@ -0,0 +1,95 @@
+"""Measure the cold-start cost of importing app.py and fail if it goes over budget.
+
+Every Vercel cold start imports app.py, so anything slow at module level is paid by real requests.
+Each run imports the app in a fresh interpreter under `python -X importtime`.
+
+Flask alone accounts for most of the time (about 155-225ms here) and varies with the machine, so the budget
+applies to what the import costs beyond Flask (about 50-60ms here); the total is reported for information.
+
+Usage: python benchmarks/import_time.py [--runs 5] [--budget-ms 100]
+Exits with status 1 if the median import time beyond Flask is over budget or a heavy module is imported at
+startup.
+"""
+import os
+import re
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that must only be imported on first use, never while the app starts
+DEFERRED_MODULES = ('firebase_admin', 'google.cloud', 'grpc', 'nltk')
+
+IMPORT_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|(\s+)(\S+)$')
+
+
+def measure_once():
+    """Import the app in a fresh interpreter.
+
+    Returns (app import microseconds, Flask's share of them, wall seconds, module names).
+    """
+    env = dict(os.environ, STORAGE_BACKEND=os.environ.get('STORAGE_BACKEND', 'firebase'))
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import app'],
+        cwd=ROOT, env=env, capture_output=True, text=True
+    )
+    wall = time.perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing app failed:\n{result.stderr}")
+
+    app_us = flask_us = None
+    modules = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if not match:
+            continue
+        modules.append(match.group(4))
+        if match.group(4) == 'app' and len(match.group(3)) == 1:
+            app_us = int(match.group(2))
+        elif match.group(4) == 'flask' and len(match.group(3)) == 3:
+            flask_us = int(match.group(2))
+    return app_us, flask_us or 0, wall, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=100.0)
+    args = parser.parse_args()
+
+    measure_once()  # Warm-up: compiles bytecode so every measured run is comparable
+
+    import_ms, own_ms, wall_ms, modules = [], [], [], []
+    for _ in range(args.runs):
+        app_us, flask_us, wall, modules = measure_once()
+        import_ms.append(app_us / 1000)
+        own_ms.append((app_us - flask_us) / 1000)
+        wall_ms.append(wall * 1000)
+
+    median_own = statistics.median(own_ms)
+    print(f"import app: median={statistics.median(import_ms):.1f}ms min={min(import_ms):.1f}ms "
+          f"max={max(import_ms):.1f}ms")
+    print(f"import app without flask: median={median_own:.1f}ms min={min(own_ms):.1f}ms max={max(own_ms):.1f}ms "
+          f"(budget {args.budget_ms:.0f}ms)")
+    print(f"interpreter start + import: median={statistics.median(wall_ms):.1f}ms")
+    print(f"modules imported: {len(modules)}")
+
+    failed = False
+    deferred = sorted({name for name in modules if name.startswith(DEFERRED_MODULES)})
+    if deferred:
+        print(f"FAIL: imported at startup: {', '.join(deferred[:10])}")
+        failed = True
+    if median_own > args.budget_ms:
+        print("FAIL: import time beyond Flask over budget")
+        failed = True
+    if not failed:
+        print("OK")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
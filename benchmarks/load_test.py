@@ -0,0 +1,393 @@
+"""Seed a local backend with a realistic data set and load-test every route of app.py.
+
+The memory and sqlite backends stand in for the Realtime Database. Each endpoint is driven by a pool of
+concurrent clients and reported with its throughput, p50/p95/p99 latency and DB calls per request
+(as counted by the metrics layer), so N+1 regressions show up as a jump in DB calls.
+
+Usage: python benchmarks/load_test.py [--backend memory|sqlite] [--users 10000] [--products 5000]
+                                      [--orders 50000] [--requests 200] [--concurrency 16]
+                                      [--output load_test.json] [--baseline previous.json]
+Results are written as JSON. With --baseline, the run is compared to an earlier result file and the script
+exits with status 1 if any endpoint makes more DB calls per request than before.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+from urllib.parse import urlencode
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DB_CALLS_HEADER = 'X-Benchmark-DB-Calls'
+SEED_CHUNK = 5000
+
+
+class Pool:
+    """IDs a write scenario consumes, each at most once (an order can only be reviewed once)."""
+
+    def __init__(self, items):
+        self._items = list(items)
+        self._lock = threading.Lock()
+
+    def take(self):
+        with self._lock:
+            return self._items.pop() if self._items else None
+
+    def __len__(self):
+        return len(self._items)
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def seed(database, args, rng):
+    """Write users, products, carts and orders in every lifecycle state, then build the derived indexes.
+
+    Returns the IDs the scenarios pick from.
+    """
+    from storage import generate_push_id
+    from archive import OrderArchiver, partition_date
+    from riders import assigned_order_path, completed_count_path, completed_history_path
+    from dispatch import price_items, rebuild_dispatch_view
+    from indexes import rebuild_product_fingerprints, rebuild_store_index, rebuild_user_order_index
+
+    storage = database.storage  # Seed below the metrics layer
+    writes = {}
+
+    def write(path, value):
+        writes[path] = value
+        if len(writes) >= SEED_CHUNK:
+            flush()
+
+    def flush():
+        if writes:
+            storage.update('', dict(writes))
+            writes.clear()
+
+    store_owners = [f'store-owner-{index}' for index in range(max(1, args.users // 100))]
+    riders = [f'rider-{index}' for index in range(max(1, args.users // 20))]
+    customers = [f'customer-{index}' for index in range(max(1, args.users - len(store_owners) - len(riders)))]
+    for user_type, user_ids in (('store_owner', store_owners), ('rider', riders), ('customer', customers)):
+        for user_id in user_ids:
+            write(f'users/{user_id}', {'user_id': user_id, 'user_type': user_type})
+
+    stores = [f'Store {index}' for index in range(args.stores)]
+    products = {}
+    for index in range(args.products):
+        product_id = generate_push_id()
+        products[product_id] = {
+            'product_id': product_id,
+            'name': f'Product {index}',
+            'description': f'Benchmark product number {index}',
+            'price': rng.randint(1, 500),
+            'image_url': f'https://example.com/products/{index}.png',
+            'store_name': rng.choice(stores),
+            'stock': 1_000_000  # Effectively unlimited so checkouts never run out during the run
+        }
+        write(f'products/{product_id}', products[product_id])
+    product_ids = list(products)
+
+    def random_items():
+        chosen = rng.sample(product_ids, min(len(product_ids), rng.randint(1, 4)))
+        return [{'product_id': product_id, 'quantity': rng.randint(1, 3)} for product_id in chosen]
+
+    # Carts for the customers that will check out, plus some idle ones
+    shoppers = rng.sample(customers, min(len(customers), args.requests * 2))
+    cart_entries = []
+    for user_id in shoppers:
+        for item in random_items():
+            write(f'carts/{user_id}/{item["product_id"]}', item)
+            cart_entries.append((user_id, item['product_id']))
+
+    # Orders spread over the last 90 days in every lifecycle state
+    now = int(time.time() * 1000)
+    pending, accepted, on_the_way = [], [], []
+    completed = {}
+    for _ in range(args.orders):
+        order_id = generate_push_id()
+        timestamp = now - rng.randint(0, 90 * 24 * 3600 * 1000)
+        user_id = rng.choice(customers)
+        items = random_items()
+        status = rng.choices(['pending', 'accepted', 'on the way', 'delivered', 'rejected'], [2, 2, 1, 4, 1])[0]
+        order = {'order_id': order_id, 'user_id': user_id, 'user_type': 'customer', 'items': items,
+                 'status': status, 'timestamp': timestamp, 'user_index_key': generate_push_id(timestamp)}
+        if status in ('accepted', 'on the way', 'delivered'):
+            priced_items, total_price = price_items(items, products)
+            accepted_order = {
+                'order_id': order_id,
+                'store_owner_id': rng.choice(store_owners),
+                'items': priced_items,
+                'total_quantity': sum(item['quantity'] for item in items),
+                'total_price': total_price,
+                'status': status,
+                'timestamp': timestamp,
+                'dispatch_key': generate_push_id(timestamp)
+            }
+            if status != 'accepted':
+                rider_id = rng.choice(riders)
+                order['rider_id'] = accepted_order['rider_id'] = rider_id
+                if status == 'on the way':
+                    write(assigned_order_path(rider_id, order_id), 1)
+                else:
+                    write(completed_history_path(rider_id, generate_push_id(timestamp)),
+                          {'order_id': order_id, 'date': partition_date(timestamp)})
+                    completed[rider_id] = completed.get(rider_id, 0) + 1
+            write(f'accepted_orders/{order_id}', accepted_order)
+        write(f'orders/{order_id}', order)
+        {'pending': pending, 'accepted': accepted}.get(status, []).append(order_id)
+        if status == 'on the way':
+            on_the_way.append((order_id, order['rider_id']))
+
+    for rider_id, count in completed.items():
+        write(completed_count_path(rider_id), count)
+    flush()
+
+    rebuild_store_index(storage)
+    rebuild_user_order_index(storage)
+    rebuild_product_fingerprints(storage)
+    rebuild_dispatch_view(storage)
+    OrderArchiver(storage).compact()  # Finished orders live in the archive, as they do once the app has run
+
+    return {
+        'customers': customers, 'riders': riders, 'store_owners': store_owners, 'stores': stores,
+        'product_ids': product_ids, 'shoppers': shoppers, 'cart_entries': cart_entries, 'pending': pending,
+        'accepted': accepted, 'on_the_way': on_the_way,
+        'busy_riders': sorted({rider_id for _, rider_id in on_the_way}), 'delivering_riders': list(completed)
+    }
+
+
+def scenarios(ids, args, rng):
+    """(name, method, url rule, request count, request factory). A factory returns (url, json) or None when
+    its pool of IDs is used up."""
+    from archive import partition_date
+    full_exports = max(1, args.requests // 20)
+    # Half of the seeded carts are checked out, items are removed from the other half
+    half = len(ids['shoppers']) // 2
+    shoppers = Pool(ids['shoppers'][:half])
+    idle_shoppers = set(ids['shoppers'][half:])
+    cart_entries = Pool(entry for entry in ids['cart_entries'] if entry[0] in idle_shoppers)
+    pending, accepted, on_the_way = Pool(ids['pending']), Pool(ids['accepted']), Pool(ids['on_the_way'])
+    new_product = iter(range(10 ** 9))
+
+    def product_body():
+        index = next(new_product)
+        return {'name': f'New product {index}', 'description': 'Created by the load test', 'price': 10,
+                'image_url': 'https://example.com/new.png', 'store_name': rng.choice(ids['stores']), 'stock': 5}
+
+    def take(pool, build):
+        item = pool.take()
+        return build(item) if item is not None else None
+
+    return [
+        ('create_user', 'POST', '/api/users', args.requests,
+         lambda: ('/api/users', {'user_type': 'customer'})),
+        ('get_all_users_page', 'GET', '/api/users?limit=50', args.requests,
+         lambda: ('/api/users?limit=50', None)),
+        ('get_all_users_export', 'GET', '/api/users', full_exports,
+         lambda: ('/api/users', None)),
+        ('get_all_products_page', 'GET', '/api/products?limit=50', args.requests,
+         lambda: ('/api/products?limit=50', None)),
+        ('get_all_products_export', 'GET', '/api/products', full_exports,
+         lambda: ('/api/products', None)),
+        ('search_products', 'GET', '/api/products/search', args.requests,
+         lambda: ('/api/products/search?' + urlencode({'q': f'product {rng.randint(0, 99)}',
+                                                       'max_price': rng.randint(50, 500)}), None)),
+        ('get_product_by_id', 'GET', '/api/products/id/<product_id>', args.requests,
+         lambda: (f'/api/products/id/{rng.choice(ids["product_ids"])}', None)),
+        ('get_products_by_store', 'GET', '/api/products/store/<store_name>', args.requests,
+         lambda: (f'/api/products/store/{rng.choice(ids["stores"])}', None)),
+        ('add_product', 'POST', '/api/products', args.requests,
+         lambda: ('/api/products', product_body())),
+        ('add_products_batch', 'POST', '/api/products/batch', max(1, args.requests // 10),
+         lambda: ('/api/products/batch', {'products': [product_body() for _ in range(50)]})),
+        ('update_product', 'PUT', '/api/products/<product_id>', args.requests,
+         lambda: (f'/api/products/{rng.choice(ids["product_ids"])}', {'price': rng.randint(1, 500)})),
+        ('add_product_to_cart', 'POST', '/api/cart/<user_id>/add_product', args.requests,
+         lambda: (f'/api/cart/{rng.choice(ids["customers"])}/add_product',
+                  {'product_id': rng.choice(ids['product_ids']), 'quantity': 1})),
+        ('add_products_to_cart_batch', 'POST', '/api/cart/<user_id>/batch', args.requests,
+         lambda: (f'/api/cart/{rng.choice(ids["customers"])}/batch',
+                  {'items': [{'product_id': rng.choice(ids['product_ids']), 'quantity': 1} for _ in range(5)]})),
+        ('update_cart_item', 'PUT', '/api/cart/<user_id>/items/<product_id>', args.requests,
+         lambda: (f'/api/cart/{rng.choice(ids["customers"])}/items/{rng.choice(ids["product_ids"])}',
+                  {'quantity': 2})),
+        ('get_cart', 'GET', '/api/cart/<user_id>', args.requests,
+         lambda: (f'/api/cart/{rng.choice(ids["shoppers"])}', None)),
+        ('create_order', 'POST', '/api/order/<user_id>', args.requests,
+         lambda: take(shoppers, lambda user_id: (f'/api/order/{user_id}', None))),
+        ('remove_from_cart', 'DELETE', '/api/cart/<user_id>', args.requests,
+         lambda: take(cart_entries, lambda entry: (f'/api/cart/{entry[0]}', {'product_id': entry[1]}))),
+        ('get_user_orders', 'GET', '/api/order/<user_id>', args.requests,
+         lambda: (f'/api/order/{rng.choice(ids["customers"])}', None)),
+        ('get_user_order_history', 'GET', '/api/order/<user_id>/history', args.requests,
+         lambda: (f'/api/order/{rng.choice(ids["customers"])}/history', None)),
+        ('get_archived_orders_by_date', 'GET', '/api/orders/archive/<date>', args.requests,
+         lambda: (f'/api/orders/archive/{partition_date(time.time() * 1000 - rng.randint(0, 89) * 86400000)}',
+                  None)),
+        ('review_order', 'POST', '/api/order/<order_id>/review', args.requests,
+         lambda: take(pending, lambda order_id: (f'/api/order/{order_id}/review', {
+             'store_owner_id': rng.choice(ids['store_owners']), 'decision': rng.choice(['accept', 'reject'])}))),
+        ('get_available_orders_for_riders', 'GET', '/api/orders/available_for_riders', args.requests,
+         lambda: ('/api/orders/available_for_riders?limit=20', None)),
+        ('accept_order_for_delivery', 'POST', '/api/orders/<order_id>/accept', args.requests,
+         lambda: take(accepted, lambda order_id: (f'/api/orders/{order_id}/accept',
+                                                  {'rider_id': rng.choice(ids['riders'])}))),
+        ('get_rider_orders', 'GET', '/api/rider/<rider_id>/orders', args.requests,
+         lambda: (f'/api/rider/{rng.choice(ids["busy_riders"] or ids["riders"])}/orders', None)),
+        ('get_rider_completed_orders', 'GET', '/api/rider/<rider_id>/completed', args.requests,
+         lambda: (f'/api/rider/{rng.choice(ids["delivering_riders"] or ids["riders"])}/completed', None)),
+        ('mark_order_as_delivered', 'POST', '/api/orders/<order_id>/deliver', args.requests,
+         lambda: take(on_the_way, lambda item: (f'/api/orders/{item[0]}/deliver', {'rider_id': item[1]}))),
+        ('delete_product', 'DELETE', '/api/products/<product_id>', args.requests,
+         lambda: (f'/api/products/{ids["product_ids"].pop()}', None)),
+        ('get_user_cache_stats', 'GET', '/api/metrics/user_cache', args.requests,
+         lambda: ('/api/metrics/user_cache', None)),
+        ('get_catalog_cache_stats', 'GET', '/api/metrics/catalog_cache', args.requests,
+         lambda: ('/api/metrics/catalog_cache', None)),
+        ('get_idempotency_stats', 'GET', '/api/metrics/idempotency', args.requests,
+         lambda: ('/api/metrics/idempotency', None)),
+        ('get_admission_stats', 'GET', '/api/metrics/admission', args.requests,
+         lambda: ('/api/metrics/admission', None)),
+        ('get_product_replica_stats', 'GET', '/api/metrics/product_replica', args.requests,
+         lambda: ('/api/metrics/product_replica', None)),
+        ('get_order_archive_stats', 'GET', '/api/metrics/order_archive', args.requests,
+         lambda: ('/api/metrics/order_archive', None)),
+        ('get_metrics', 'GET', '/metrics', args.requests,
+         lambda: ('/metrics', None)),
+    ]
+
+
+def run_scenario(app, method, count, factory, concurrency):
+    """Send count requests from concurrency parallel clients. Returns the endpoint's summary."""
+    lock = threading.Lock()
+    requests = [factory() for _ in range(count)]
+    requests = [request for request in requests if request is not None]
+    latencies, db_calls, statuses = [], [], {}
+
+    def send(request):
+        url, body = request
+        client = app.test_client()
+        started = time.perf_counter()
+        response = client.open(url, method=method, json=body)
+        response.get_data()  # Streamed exports are only done once the body is consumed
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed * 1000)
+            db_calls.append(int(response.headers.get(DB_CALLS_HEADER, 0)))
+            statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(send, requests))
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requests': len(requests),
+        'statuses': statuses,
+        'server_errors': sum(count for status, count in statuses.items() if status.startswith('5')),
+        'throughput_rps': round(len(requests) / wall, 1) if wall else 0.0,
+        'mean_ms': round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'db_calls_mean': round(sum(db_calls) / len(db_calls), 2) if db_calls else 0.0,
+        'db_calls_max': max(db_calls, default=0),
+    }
+
+
+def compare(results, baseline_path):
+    """Print the change against an earlier run. Returns the endpoints that now make more DB calls."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)['endpoints']
+    regressions = []
+    print(f"\nCompared with {baseline_path}:")
+    for name, result in results.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        print(f"  {name:34} p95 {before['p95_ms']:9.2f} -> {result['p95_ms']:9.2f}ms   "
+              f"db calls {before['db_calls_mean']:6.2f} -> {result['db_calls_mean']:6.2f}")
+        if result['db_calls_mean'] > before['db_calls_mean'] + 0.01:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backend', choices=['memory', 'sqlite'], default='memory')
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--products', type=int, default=5000)
+    parser.add_argument('--orders', type=int, default=50000)
+    parser.add_argument('--stores', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=200, help='requests per endpoint')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default='load_test.json')
+    parser.add_argument('--baseline', help='earlier result file to compare against')
+    args = parser.parse_args()
+
+    os.environ['STORAGE_BACKEND'] = args.backend
+    os.environ['ADMISSION_CONTROL'] = 'off'  # All requests come from one client
+    if args.backend == 'sqlite':
+        os.environ['SQLITE_PATH'] = os.path.join(tempfile.mkdtemp(), 'load_test.db')
+
+    from flask import g
+    from app import app, database
+
+    @app.after_request
+    def report_db_calls(response):
+        # Registered last, so it runs before the metrics hook finishes the trace
+        trace = g.get('request_trace')
+        if trace is not None:
+            response.headers[DB_CALLS_HEADER] = str(trace.db_calls)
+        return response
+
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
+    ids = seed(database, args, rng)
+    seed_seconds = time.perf_counter() - started
+    print(f"Seeded {args.users} users, {args.products} products and {args.orders} orders "
+          f"into {args.backend} in {seed_seconds:.1f}s")
+
+    results = {}
+    print(f"{'endpoint':34} {'reqs':>6} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'db calls':>9}")
+    for name, method, route, count, factory in scenarios(ids, args, rng):
+        result = dict(run_scenario(app, method, count, factory, args.concurrency), method=method, route=route)
+        results[name] = result
+        print(f"{name:34} {result['requests']:6} {result['throughput_rps']:9.1f} {result['p50_ms']:9.2f} "
+              f"{result['p95_ms']:9.2f} {result['p99_ms']:9.2f} {result['db_calls_mean']:9.2f}")
+
+    with open(args.output, 'w') as f:
+        json.dump({
+            'config': {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')},
+            'seed_seconds': round(seed_seconds, 3),
+            # The SSE stream never completes, so it is not part of the request/response load
+            'skipped': ['/api/orders/available_for_riders/stream'],
+            'endpoints': results
+        }, f, indent=2, sort_keys=True)
+    print(f"Results written to {args.output}")
+
+    failed = [name for name, result in results.items() if result['server_errors']]
+    if failed:
+        print(f"FAIL: server errors from {', '.join(failed)}")
+    if args.baseline:
+        regressions = compare(results, args.baseline)
+        if regressions:
+            print(f"FAIL: more DB calls per request than the baseline: {', '.join(regressions)}")
+            failed += regressions
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,115 @@
+"""Build the product search index over a large synthetic catalog and measure query latency.
+
+Usage: python benchmarks/product_search.py [--products 100000] [--queries 500] [--budget-ms 50]
+Exits with status 1 if the p95 latency of GET /api/products/search goes over budget.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+ADJECTIVES = ['red', 'blue', 'green', 'black', 'white', 'linen', 'cotton', 'wool', 'silk', 'denim', 'leather',
+              'striped', 'vintage', 'slim', 'oversized', 'summer', 'winter', 'classic', 'casual', 'formal']
+NOUNS = ['shirt', 'dress', 'jacket', 'scarf', 'hat', 'skirt', 'jeans', 'sweater', 'coat', 'blouse', 'shorts',
+         'trousers', 'hoodie', 'cardigan', 'sandals', 'boots', 'sneakers', 'belt', 'bag', 'socks']
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--products', type=int, default=100000)
+    parser.add_argument('--stores', type=int, default=200)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--budget-ms', type=float, default=50.0)
+    args = parser.parse_args()
+
+    os.environ['STORAGE_BACKEND'] = 'memory'
+    os.environ['ADMISSION_CONTROL'] = 'off'  # All requests come from one client
+    os.environ['CATALOG_CACHE_SIZE'] = '0'  # Measure the index, not the response cache
+
+    from storage import generate_push_id
+    from app import app, database, product_search
+
+    rng = random.Random(1)
+    stores = [f'Store {index}' for index in range(args.stores)]
+    writes = {}
+    for index in range(args.products):
+        name = f'{rng.choice(ADJECTIVES)} {rng.choice(ADJECTIVES)} {rng.choice(NOUNS)}'.title()
+        writes[f'products/{generate_push_id()}'] = {
+            'name': name, 'description': f'{name} number {index} in {rng.choice(ADJECTIVES)} fabric',
+            'price': round(rng.uniform(1, 500), 2), 'image_url': f'https://example.com/{index}.png',
+            'store_name': rng.choice(stores), 'stock': rng.randint(0, 100)
+        }
+    database.update('', writes)
+
+    started = time.perf_counter()
+    product_search.ensure_loaded()
+    build_seconds = time.perf_counter() - started
+    print(f"indexed {args.products} products in {build_seconds:.2f}s: {product_search.stats()}")
+
+    def random_query():
+        params = {}
+        kind = rng.random()
+        if kind < 0.6:
+            words = rng.sample(ADJECTIVES, rng.randint(0, 1)) + [rng.choice(NOUNS)]
+            params['q'] = ' '.join(words)
+            if rng.random() < 0.3:
+                params['q'] = params['q'][:-2]  # Typed-ahead prefix
+        if kind > 0.4 or rng.random() < 0.3:
+            low = rng.uniform(1, 400)
+            params['min_price'] = round(low, 2)
+            params['max_price'] = round(low + rng.uniform(5, 100), 2)
+        if rng.random() < 0.3:
+            params['store_name'] = rng.choice(stores)
+        if rng.random() < 0.5:
+            params['sort'] = rng.choice(['relevance', 'price_asc', 'price_desc', 'name'])
+        return params
+
+    client = app.test_client()
+    latencies = []
+    matches = 0
+    for _ in range(args.queries):
+        params = random_query()
+        started = time.perf_counter()
+        response = client.get('/api/products/search', query_string=params)
+        latencies.append((time.perf_counter() - started) * 1000)
+        if response.status_code == 200:
+            matches += int(response.headers['X-Total-Count'])
+        elif response.status_code != 404:
+            print(f"FAIL: {params} -> {response.status_code} {response.get_json()}")
+            return 1
+
+    # Incremental updates on the write path
+    started = time.perf_counter()
+    for index in range(200):
+        client.post('/api/products', json={
+            'name': f'New Arrival {index}', 'description': 'Fresh stock', 'price': 42, 'image_url': 'u',
+            'store_name': 'Store 0'
+        })
+    write_ms = (time.perf_counter() - started) * 1000 / 200
+    found = client.get('/api/products/search', query_string={'q': 'new arrival', 'limit': 100})
+    if len(found.get_json()) != 100:
+        print("FAIL: new products missing from search results")
+        return 1
+
+    latencies.sort()
+    p95 = percentile(latencies, 0.95)
+    print(f"{args.queries} queries, {matches / args.queries:.0f} matches on average")
+    print(f"latency: p50={percentile(latencies, 0.50):.2f}ms p95={p95:.2f}ms p99={percentile(latencies, 0.99):.2f}ms "
+          f"max={latencies[-1]:.2f}ms (budget p95 {args.budget_ms:.0f}ms)")
+    print(f"add_product with index update: {write_ms:.2f}ms per product")
+    if p95 > args.budget_ms:
+        print("FAIL: search p95 over budget")
+        return 1
+    print("OK")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
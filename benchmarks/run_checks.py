@@ -0,0 +1,39 @@
+"""Run the concurrency checks (no overselling, failed checkouts give their stock back, every order claimed and
+delivered once) against every local backend. CI runs this after the unit tests in tests/.
+
+Usage: python benchmarks/run_checks.py
+Exits with status 1 if any check fails.
+"""
+import os
+import sys
+import subprocess
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+
+CHECKS = [
+    ['checkout_concurrency.py', '--backend', 'memory'],
+    ['checkout_concurrency.py', '--backend', 'sqlite'],
+    ['checkout_concurrency.py', '--backend', 'cas'],
+    ['checkout_concurrency.py', '--backend', 'cas', '--update-failures', '0.2'],
+    ['claim_concurrency.py', '--backend', 'memory'],
+    ['claim_concurrency.py', '--backend', 'sqlite'],
+    ['claim_concurrency.py', '--backend', 'cas'],
+]
+
+
+def main():
+    failed = []
+    for check in CHECKS:
+        print(f"$ {' '.join(check)}", flush=True)
+        # Each check imports the app with its own backend settings, so it needs a fresh process
+        if subprocess.run([sys.executable, os.path.join(BENCHMARKS, check[0])] + check[1:]).returncode:
+            failed.append(' '.join(check))
+    if failed:
+        print(f"FAIL: {len(failed)} of {len(CHECKS)} checks failed: {'; '.join(failed)}")
+        return 1
+    print(f"OK: all {len(CHECKS)} checks passed")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
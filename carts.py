@@ -0,0 +1,63 @@
+# Carts are stored as carts/<user_id>/<product_id> -> {'product_id', 'quantity'}, so every cart
+# operation writes a single child (plus, until migrate-carts has run, the product's legacy entries) no matter
+# how big the cart is.
+
+
+def cart_item_path(user_id, product_id):
+    """Path of one product's entry in a user's cart."""
+    return f'carts/{user_id}/{product_id}'
+
+
+def legacy_cart_keys(cart_data):
+    """Keys of the entries of a cart written before the migration: list positions. Items added since then turn
+    the list into a dict that mixes positions with product IDs, which are push IDs and never all digits."""
+    if isinstance(cart_data, list):
+        return [str(index) for index, item in enumerate(cart_data) if item]
+    return [key for key in (cart_data or {}) if key.isdigit()]
+
+
+def legacy_item_keys(cart_data, product_id):
+    """Keys of the legacy entries of a cart (see legacy_cart_keys) that hold product_id. Setting or removing the
+    product deletes them in the same write, so they cannot add to or outlive the keyed entry."""
+    entries = {str(index): item for index, item in enumerate(cart_data)} if isinstance(cart_data, list) \
+        else cart_data or {}
+    return [key for key in legacy_cart_keys(cart_data) if (entries[key] or {}).get('product_id') == product_id]
+
+
+def cart_items(cart_data):
+    """List the items of a cart, one per product. Also accepts carts with legacy entries that predate the
+    migration, whose quantities are added to the keyed entry of the same product."""
+    if not cart_data:
+        return []
+    items = [item for item in (cart_data if isinstance(cart_data, list) else cart_data.values()) if item]
+    if not legacy_cart_keys(cart_data):
+        return items
+    merged = {}
+    for item in items:
+        product_id = item.get('product_id')
+        if not product_id:
+            continue
+        # The old add path merged repeated products, but total them in case older data has duplicates
+        quantity = merged.get(product_id, {}).get('quantity', 0) + item.get('quantity', 0)
+        merged[product_id] = {'product_id': product_id, 'quantity': quantity}
+    return list(merged.values())
+
+
+def migrate_carts(database):
+    """Move the legacy entries of every cart onto the entries keyed by product ID, whatever shape the cart has
+    taken since. Returns the number of carts converted."""
+    carts = database.get('carts') or {}
+    updates = {}
+    migrated = 0
+    for user_id, cart_data in carts.items():
+        legacy_keys = legacy_cart_keys(cart_data)
+        if not legacy_keys:
+            continue
+        for key in legacy_keys:
+            updates[f'carts/{user_id}/{key}'] = None
+        for item in cart_items(cart_data):
+            updates[cart_item_path(user_id, item['product_id'])] = item
+        migrated += 1
+    if updates:
+        database.update('', updates)
+    return migrated
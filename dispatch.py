@@ -0,0 +1,102 @@
+from storage import generate_push_id, split_path
+
+# Orders accepted by a store and waiting for a rider, keyed by push keys so the oldest come first.
+# The same summaries are partitioned by store owner so a filtered read is also a single read.
+READY_FOR_PICKUP = 'dispatch/ready'
+READY_FOR_PICKUP_BY_STORE = 'dispatch/ready_by_store'
+
+
+def price_items(items, products, default_price=None):
+    """Snapshot each item's current price. Returns the priced items and the order total.
+
+    An item whose product no longer exists keeps the price it was checked out at. If it has none (orders
+    placed before prices were recorded at checkout), it gets default_price, or KeyError is raised with the
+    product ID when that is None.
+    """
+    priced_items = []
+    total_price = 0
+    for item in items:
+        product = products.get(item.get('product_id'))
+        if product:
+            price = product.get('price', 0)  # Default to 0 if price is missing
+        elif item.get('price') is not None:
+            price = item['price']
+        elif default_price is not None:
+            price = default_price
+        else:
+            raise KeyError(item.get('product_id'))
+        quantity = item.get('quantity', 0)  # Default to 0 if quantity is missing
+        priced_items.append(dict(item, price=price))
+        total_price += price * quantity
+    return priced_items, total_price
+
+
+def dispatch_summary(accepted_order):
+    """The part of an accepted order riders see in the dispatch view."""
+    return {
+        'order_id': accepted_order['order_id'],
+        'store_owner_id': accepted_order.get('store_owner_id'),
+        'items': accepted_order.get('items'),
+        'total_price': accepted_order.get('total_price', 0),
+        'status': accepted_order.get('status')
+    }
+
+
+def ready_for_pickup_path(store_owner_id=None):
+    """Path of the whole ready-for-pickup view, or of one store's partition of it."""
+    if store_owner_id:
+        return f'{READY_FOR_PICKUP_BY_STORE}/{store_owner_id}'
+    return READY_FOR_PICKUP
+
+
+def ready_for_pickup_updates(accepted_order, listed):
+    """Multi-path update entries that add an accepted order to the view (listed=True) or remove it."""
+    dispatch_key = accepted_order.get('dispatch_key')
+    if not dispatch_key:
+        return {}
+    summary = dispatch_summary(accepted_order) if listed else None
+    updates = {f'{READY_FOR_PICKUP}/{dispatch_key}': summary}
+    if accepted_order.get('store_owner_id'):
+        updates[f'{ready_for_pickup_path(accepted_order["store_owner_id"])}/{dispatch_key}'] = summary
+    return updates
+
+
+def rebuild_dispatch_view(database):
+    """Rebuild the ready-for-pickup view from accepted_orders, pricing orders accepted before totals were stored.
+
+    Returns the number of orders listed.
+    """
+    accepted_orders = database.get('accepted_orders') or {}
+    ready = {
+        order_id: accepted_order for order_id, accepted_order in accepted_orders.items()
+        if accepted_order.get('status') == 'accepted'
+    }
+
+    # Orders accepted before prices were snapshotted are priced once from the current catalog
+    unpriced = [accepted_order for accepted_order in ready.values() if 'total_price' not in accepted_order]
+    product_ids = {item.get('product_id') for order in unpriced for item in order.get('items', [])}
+    fetched = database.get_many(f'products/{product_id}' for product_id in product_ids if product_id)
+    products = {split_path(path)[1]: product for path, product in fetched.items()}
+
+    updates = {}
+    for order_id, accepted_order in ready.items():
+        accepted_order.setdefault('order_id', order_id)
+        if 'total_price' not in accepted_order:
+            try:
+                items, total_price = price_items(accepted_order.get('items', []), products)
+            except KeyError:
+                continue
+            accepted_order.update(items=items, total_price=total_price)
+            updates[f'accepted_orders/{order_id}/items'] = items
+            updates[f'accepted_orders/{order_id}/total_price'] = total_price
+        if not accepted_order.get('dispatch_key'):
+            accepted_order['dispatch_key'] = generate_push_id(accepted_order.get('timestamp') or 0)
+            updates[f'accepted_orders/{order_id}/dispatch_key'] = accepted_order['dispatch_key']
+        updates.update(ready_for_pickup_updates(accepted_order, listed=True))
+
+    # A multi-path update cannot also clear an ancestor of the paths it writes, so clear the view first
+    database.delete(READY_FOR_PICKUP)
+    database.delete(READY_FOR_PICKUP_BY_STORE)
+    if updates:
+        database.update('', updates)
+    return sum(1 for path in updates if path.startswith(READY_FOR_PICKUP + '/'))
@@ -0,0 +1,91 @@
+import json
+import queue
+import itertools
+import threading
+
+DEFAULT_QUEUE_SIZE = 1000
+SSE_KEEPALIVE_SECONDS = 15
+
+# Event types published on the dispatch topic
+ORDER_READY = 'order_ready'  # A store accepted an order; it can be claimed by riders
+ORDER_CLAIMED = 'order_claimed'  # A rider accepted the order for delivery
+ORDER_DELIVERED = 'order_delivered'  # The rider delivered the order
+RESYNC = 'resync'  # The subscriber fell behind and missed events; it must reload the full state
+
+
+class Subscription:
+    """A subscriber's bounded queue of events. Use as a context manager so it is always unsubscribed."""
+
+    def __init__(self, bus, topic, max_queue):
+        self._bus = bus
+        self.topic = topic
+        self._queue = queue.Queue(maxsize=max_queue)
+
+    def _deliver(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            # Rather than blocking publishers, drop the backlog and tell the subscriber to resync
+            with self._queue.mutex:
+                self._queue.queue.clear()
+            self._queue.put_nowait({'id': event['id'], 'type': RESYNC, 'data': None})
+
+    def get(self, timeout=None):
+        """Return the next event, or None if nothing arrived within timeout seconds."""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self._bus.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class EventBus:
+    """In-process publish/subscribe hub. Events only reach subscribers in the same process."""
+
+    def __init__(self, max_queue=DEFAULT_QUEUE_SIZE):
+        self._max_queue = max_queue
+        self._lock = threading.Lock()
+        self._subscribers = {}  # topic -> set of Subscription
+        self._ids = itertools.count(1)
+
+    def subscribe(self, topic):
+        """Start receiving the events published on topic from now on."""
+        subscription = Subscription(self, topic, self._max_queue)
+        with self._lock:
+            self._subscribers.setdefault(topic, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.get(subscription.topic, set()).discard(subscription)
+
+    def publish(self, topic, event_type, data):
+        """Send an event to every current subscriber of topic. Returns the event."""
+        with self._lock:
+            event = {'id': next(self._ids), 'type': event_type, 'data': data}
+            subscribers = list(self._subscribers.get(topic, ()))
+        for subscription in subscribers:
+            subscription._deliver(event)
+        return event
+
+    def subscriber_count(self, topic):
+        with self._lock:
+            return len(self._subscribers.get(topic, ()))
+
+
+def format_sse(event_type, data, event_id=None):
+    """Encode one server-sent event."""
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {event_type}')
+    lines.append(f'data: {json.dumps(data)}')
+    return '\n'.join(lines) + '\n\n'
@@ -0,0 +1,151 @@
+import time
+import hashlib
+import threading
+from functools import wraps
+from collections import OrderedDict
+
+from flask import Response, current_app, jsonify, request
+
+DEFAULT_MAX_ENTRIES = 10000
+DEFAULT_TTL_SECONDS = 3600.0
+DEFAULT_WAIT_SECONDS = 30.0
+
+IDEMPOTENCY_KEY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+
+# Outcomes of IdempotencyStore.acquire
+EXECUTE = 'execute'  # First request with this key: run the view
+REPLAY = 'replay'  # The stored response of an earlier request is returned
+CONFLICT = 'conflict'  # The key was already used with a different request body
+IN_PROGRESS = 'in_progress'  # A request with this key is still running after waiting for it
+
+
+class IdempotencyStore:
+    """Responses of completed requests by idempotency key, in a bounded LRU with a time-to-live.
+
+    Concurrent requests with the same key are coalesced: one executes and the others wait for its response.
+    The store is per process, so it only catches retries that reach the same worker.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL_SECONDS, wait_timeout=DEFAULT_WAIT_SECONDS,
+                 clock=time.monotonic):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._wait_timeout = wait_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, fingerprint, (status, headers, body))
+        self._in_flight = {}  # key -> (fingerprint, threading.Event)
+        self.executions = 0
+        self.replays = 0
+        self.coalesced = 0
+        self.conflicts = 0
+        self.evictions = 0
+
+    def acquire(self, key, fingerprint):
+        """Decide how to handle a request. Returns (outcome, stored response or None).
+
+        After EXECUTE the caller must call release(key, ...) once the response is known.
+        """
+        waited = False
+        deadline = self._clock() + self._wait_timeout
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry and entry[0] > self._clock():
+                    if entry[1] != fingerprint:
+                        self.conflicts += 1
+                        return CONFLICT, None
+                    self._entries.move_to_end(key)
+                    self.replays += 1
+                    return REPLAY, entry[2]
+                self._entries.pop(key, None)
+
+                flight = self._in_flight.get(key)
+                if flight is None:
+                    # Nothing stored (or the first attempt failed): this request executes
+                    self._in_flight[key] = (fingerprint, threading.Event())
+                    self.executions += 1
+                    return EXECUTE, None
+                if flight[0] != fingerprint:
+                    self.conflicts += 1
+                    return CONFLICT, None
+                if not waited:
+                    self.coalesced += 1
+                    waited = True
+                done = flight[1]
+
+            remaining = deadline - self._clock()
+            if remaining <= 0 or not done.wait(remaining):
+                return IN_PROGRESS, None
+
+    def release(self, key, response=None):
+        """Finish an executed request. response is (status, headers, body), or None to store nothing."""
+        with self._lock:
+            fingerprint, done = self._in_flight.pop(key)
+            if response is not None:
+                self._entries[key] = (self._clock() + self._ttl, fingerprint, response)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self._max_entries:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        # Wake up the duplicates; they replay the stored response or, if nothing was stored, one of them runs
+        done.set()
+
+    def stats(self):
+        """Return the counters and the current size of the store."""
+        with self._lock:
+            return {
+                'executions': self.executions,
+                'replays': self.replays,
+                'coalesced': self.coalesced,
+                'conflicts': self.conflicts,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'in_flight': len(self._in_flight),
+            }
+
+
+def idempotent(store):
+    """Honor an Idempotency-Key header on a POST view: the first response is stored and replayed to retries.
+
+    Keys are scoped to the route and its arguments and bound to the request body. Server errors are not
+    stored, so a retry after a 5xx runs the view again. Requests without the header are not affected.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            idempotency_key = request.headers.get(IDEMPOTENCY_KEY_HEADER)
+            if idempotency_key is None:
+                return view(*args, **kwargs)
+            if not idempotency_key or len(idempotency_key) > MAX_KEY_LENGTH:
+                return jsonify({"error": f"{IDEMPOTENCY_KEY_HEADER} must be 1 to {MAX_KEY_LENGTH} characters"}), 400
+
+            key = (request.endpoint, tuple(sorted(kwargs.items())), idempotency_key)
+            fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+
+            outcome, stored = store.acquire(key, fingerprint)
+            if outcome == REPLAY:
+                # Answer the retry without touching the database
+                status, headers, body = stored
+                response = Response(body, status=status, headers=headers)
+                response.headers[REPLAYED_HEADER] = 'true'
+                return response
+            if outcome == CONFLICT:
+                return jsonify({"error": f"{IDEMPOTENCY_KEY_HEADER} was already used for a different request"}), 422
+            if outcome == IN_PROGRESS:
+                response = jsonify({"error": f"A request with this {IDEMPOTENCY_KEY_HEADER} is still in progress"})
+                response.headers['Retry-After'] = '1'
+                return response, 409
+
+            result = None
+            try:
+                response = current_app.make_response(view(*args, **kwargs))
+                if response.status_code < 500 and not response.is_streamed:
+                    result = (response.status_code, [('Content-Type', response.content_type)], response.get_data())
+                return response
+            finally:
+                store.release(key, result)
+        return wrapper
+    return decorator
@@ -0,0 +1,118 @@
+import json
+import hashlib
+
+from storage import generate_push_id
+
+# Characters the Realtime Database does not allow in keys, plus '%' so encoding stays reversible
+FORBIDDEN_KEY_CHARS = set('.$#[]/%')
+
+PRODUCTS_BY_STORE = 'products_by_store'
+
+
+def encode_key(value):
+    """Encode an arbitrary string so it can be used as a database key."""
+    return ''.join(
+        f'%{ord(char):02X}' if char in FORBIDDEN_KEY_CHARS or ord(char) < 32 or ord(char) == 127 else char
+        for char in str(value)
+    )
+
+# ---------------------- Products by store ----------------------
+
+
+def store_index_path(store_name, product_id=None):
+    """Path of a store's entry in the store -> product ids index."""
+    path = f'{PRODUCTS_BY_STORE}/{encode_key(store_name)}'
+    return f'{path}/{product_id}' if product_id else path
+
+
+def store_index_updates(product_id, old_store_name, new_store_name):
+    """Multi-path update entries that move a product between stores in the index."""
+    updates = {}
+    if old_store_name and old_store_name != new_store_name:
+        updates[store_index_path(old_store_name, product_id)] = None
+    if new_store_name:
+        updates[store_index_path(new_store_name, product_id)] = True
+    return updates
+
+
+def get_store_products(database, store_name):
+    """Read only the products listed under store_name in the index."""
+    product_ids = database.get(store_index_path(store_name)) or {}
+    products = database.get_many(f'products/{product_id}' for product_id in product_ids)
+    return {
+        product_id: products[f'products/{product_id}']
+        for product_id in product_ids
+        if products[f'products/{product_id}']
+    }
+
+
+def rebuild_store_index(database):
+    """Rebuild the store -> product ids index from the products node. Returns the number of products indexed."""
+    all_products = database.get('products') or {}
+    index = {}
+    for product_id, product in all_products.items():
+        store_name = product.get('store_name')
+        if store_name:
+            index.setdefault(encode_key(store_name), {})[product_id] = True
+    database.set(PRODUCTS_BY_STORE, index)
+    return sum(len(product_ids) for product_ids in index.values())
+
+# ---------------------- Orders by user ----------------------
+
+ORDERS_BY_USER = 'orders_by_user'
+
+
+def user_orders_path(user_id, index_key=None):
+    """Path of a user's entry in the user -> order ids index. Index keys are push ids, so they sort by time."""
+    path = f'{ORDERS_BY_USER}/{user_id}'
+    return f'{path}/{index_key}' if index_key else path
+
+
+def rebuild_user_order_index(database):
+    """Build the user -> order ids index from the orders node. Returns the number of orders indexed."""
+    all_orders = database.get('orders') or {}
+    index = {}
+    for order_id, order in all_orders.items():
+        user_id = order.get('user_id')
+        if user_id:
+            # Keep the key stored on the order, which archiving relies on. Orders placed before timestamps
+            # were recorded sort as the oldest.
+            index_key = order.get('user_index_key') or generate_push_id(order.get('timestamp') or 0)
+            index.setdefault(user_id, {})[index_key] = order_id
+    database.set(ORDERS_BY_USER, index)
+    return sum(len(order_ids) for order_ids in index.values())
+
+# ---------------------- Product fingerprints ----------------------
+
+PRODUCT_FINGERPRINTS = 'product_fingerprints'
+
+# Two products with equal values for all of these fields are the same product
+FINGERPRINT_FIELDS = ('name', 'description', 'price', 'image_url', 'store_name')
+
+
+def product_fingerprint(product):
+    """Content hash of the fields that identify a product."""
+    values = []
+    for field in FINGERPRINT_FIELDS:
+        value = product.get(field)
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)  # 10 and 10.0 are the same price
+        values.append(value)
+    return hashlib.sha256(json.dumps(values, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+
+def fingerprint_path(fingerprint):
+    """Path of the product ID stored for a fingerprint."""
+    return f'{PRODUCT_FINGERPRINTS}/{fingerprint}'
+
+
+def rebuild_product_fingerprints(database):
+    """Rebuild the fingerprint -> product id index from the products node. Returns the number of fingerprints.
+
+    When existing products are duplicates of each other, the oldest one is indexed.
+    """
+    index = {}
+    for product_id, product in database.query('products').items():
+        index.setdefault(product_fingerprint(product), product_id)
+    database.set(PRODUCT_FINGERPRINTS, index)
+    return len(index)
@@ -0,0 +1,28 @@
+from flask import g
+
+
+class Loader:
+    """Load records of one node by ID, fetching each distinct ID once in a bulk read and memoizing the results."""
+
+    def __init__(self, database, node):
+        self._database = database
+        self._node = node
+        self._cache = {}
+
+    def load_many(self, ids):
+        """Return a dict mapping each ID to its record (None if missing). Unseen IDs are fetched in one batch."""
+        ids = [record_id for record_id in dict.fromkeys(ids) if record_id]
+        missing = [record_id for record_id in ids if record_id not in self._cache]
+        if missing:
+            records = self._database.get_many(f'{self._node}/{record_id}' for record_id in missing)
+            for record_id in missing:
+                self._cache[record_id] = records[f'{self._node}/{record_id}']
+        return {record_id: self._cache[record_id] for record_id in ids}
+
+
+def request_loader(database, node):
+    """Return the loader for node scoped to the current request, creating it on first use."""
+    loaders = g.setdefault('loaders', {})
+    if node not in loaders:
+        loaders[node] = Loader(database, node)
+    return loaders[node]
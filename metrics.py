@@ -0,0 +1,354 @@
+import json
+import time
+import random
+import threading
+
+from flask import g, has_request_context, request
+from flask.json.provider import DefaultJSONProvider
+
+# Histogram buckets (upper bounds) for durations, DB call counts and payload sizes
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+BYTES_BUCKETS = (0, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+# Per-request histograms: (name, help, buckets, how to read the value from a finished request, or None to skip it)
+REQUEST_HISTOGRAMS = (
+    ('http_request_duration_seconds', 'Total time spent in the application per request.', SECONDS_BUCKETS,
+     lambda trace: trace.total_seconds),
+    ('http_request_handler_seconds', 'Time spent in the view, excluding JSON serialization.', SECONDS_BUCKETS,
+     lambda trace: trace.total_seconds - trace.serialize_seconds),
+    ('http_request_serialize_seconds', 'Time spent serializing JSON responses.', SECONDS_BUCKETS,
+     lambda trace: trace.serialize_seconds),
+    ('http_request_db_seconds', 'Time spent waiting on the database.', SECONDS_BUCKETS,
+     lambda trace: trace.db_seconds),
+    ('http_request_db_calls', 'Database calls made per request.', COUNT_BUCKETS,
+     lambda trace: trace.db_calls),
+    ('http_request_db_read_bytes', 'JSON-encoded bytes read from the database per sampled request.', BYTES_BUCKETS,
+     lambda trace: trace.bytes_read if trace.measure_bytes else None),
+    ('http_request_db_written_bytes', 'JSON-encoded bytes written to the database per sampled request.',
+     BYTES_BUCKETS, lambda trace: trace.bytes_written if trace.measure_bytes else None),
+)
+
+# The slow-request log lists at most this many DB calls; the totals still count all of them
+MAX_TRACE_CALLS = 200
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def payload_size(value):
+    """Size in bytes of a value encoded as compact JSON, roughly what travels over the wire."""
+    if value is None:
+        return 0
+    return len(json.dumps(value, separators=(',', ':'), default=str).encode('utf-8'))
+
+
+class RequestTrace:
+    """What one request did: its DB calls with their timings and payload sizes, and its serialization time.
+
+    Payload sizes are only measured if measure_bytes is set: sizing a payload encodes it to JSON once more.
+    """
+
+    def __init__(self, measure_bytes=False):
+        self.measure_bytes = measure_bytes
+        self.started = time.perf_counter()
+        self.total_seconds = 0.0
+        self.serialize_seconds = 0.0
+        self.db_seconds = 0.0
+        self.db_calls = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.calls = []  # (operation, path, seconds, bytes read, bytes written)
+        self._lock = threading.Lock()
+
+    def record(self, operation, path, seconds, read=0, written=0):
+        # Calls run concurrently within a request add their times up, so db_seconds can exceed the wall time
+        with self._lock:
+            self.db_calls += 1
+            self.db_seconds += seconds
+            self.bytes_read += read
+            self.bytes_written += written
+            if len(self.calls) < MAX_TRACE_CALLS:
+                self.calls.append((operation, path, seconds, read, written))
+
+    def finish(self):
+        self.total_seconds = time.perf_counter() - self.started
+
+    def format_calls(self):
+        """One line per recorded DB call, for the slow-request log."""
+        sizes = ' read={}B written={}B' if self.measure_bytes else ''
+        lines = [f'  {operation} {path} {seconds * 1000:.1f}ms' + sizes.format(read, written)
+                 for operation, path, seconds, read, written in self.calls]
+        if self.db_calls > len(self.calls):
+            lines.append(f'  ... {self.db_calls - len(self.calls)} more calls')
+        return '\n'.join(lines)
+
+
+# Worker threads running part of a request (see InstrumentedStorage.gather) record into that request's trace
+_worker = threading.local()
+
+
+def current_trace():
+    """The trace of the request being handled, or None outside of an instrumented request."""
+    trace = getattr(_worker, 'trace', None)
+    if trace is not None:
+        return trace
+    if not has_request_context():
+        return None
+    return g.get('request_trace')
+
+
+class InstrumentedStorage:
+    """Wraps a Storage and records every call made during a request into that request's trace.
+
+    Outside a request (CLI commands, background work) calls go straight to the wrapped storage.
+    Compound operations such as reserve() count as one call even if the backend makes several round trips.
+    Payload sizes are only recorded for traces that measure bytes (see RequestTrace).
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    def __getattr__(self, name):
+        return getattr(self.storage, name)
+
+    def _timed(self, trace, operation, path, call, written=None, read_result=True):
+        started = time.perf_counter()
+        result = None
+        try:
+            result = call()
+            return result
+        finally:
+            measure = trace.measure_bytes
+            trace.record(operation, path, time.perf_counter() - started,
+                         read=payload_size(result) if measure and read_result else 0,
+                         written=payload_size(written) if measure else 0)
+
+    def get(self, path):
+        trace = current_trace()
+        if trace is None:
+            return self.storage.get(path)
+        return self._timed(trace, 'get', path, lambda: self.storage.get(path))
+
+    def get_many(self, paths):
+        trace = current_trace()
+        if trace is None:
+            return self.storage.get_many(paths)
+        paths = list(paths)
+        return self._timed(trace, 'get_many', f'[{len(paths)} paths]', lambda: self.storage.get_many(paths))
+
+    def set(self, path, value):
+        trace = current_trace()
+        if trace is None:
+            return self.storage.set(path, value)
+        return self._timed(trace, 'set', path, lambda: self.storage.set(path, value), written=value)
+
+    def update(self, path, values):
+        trace = current_trace()
+        if trace is None:
+            return self.storage.update(path, values)
+        return self._timed(trace, 'update', path or '/', lambda: self.storage.update(path, values), written=values)
+
+    def push(self, path, value=None):
+        trace = current_trace()
+        # Without a value every backend only generates the key locally, which is not a DB call
+        if trace is None or value is None:
+            return self.storage.push(path, value)
+        return self._timed(trace, 'push', path, lambda: self.storage.push(path, value), written=value,
+                           read_result=False)
+
+    def delete(self, path):
+        trace = current_trace()
+        if trace is None:
+            return self.storage.delete(path)
+        return self._timed(trace, 'delete', path, lambda: self.storage.delete(path))
+
+    def query(self, path, **kwargs):
+        trace = current_trace()
+        if trace is None:
+            return self.storage.query(path, **kwargs)
+        return self._timed(trace, 'query', path, lambda: self.storage.query(path, **kwargs))
+
+    def transaction(self, path, update_fn):
+        trace = current_trace()
+        if trace is None:
+            return self.storage.transaction(path, update_fn)
+        if not trace.measure_bytes:
+            return self._timed(trace, 'transaction', path, lambda: self.storage.transaction(path, update_fn))
+
+        # The update function sees what was read; it may run several times, so keep the last attempt
+        seen = {'read': 0}
+
+        def measured(current):
+            seen['read'] = payload_size(current)
+            return update_fn(current)
+
+        started = time.perf_counter()
+        result = None
+        try:
+            result = self.storage.transaction(path, measured)
+            return result
+        finally:
+            trace.record('transaction', path, time.perf_counter() - started,
+                         read=seen['read'], written=payload_size(result))
+
+    def reserve(self, decrements, updates=None):
+        trace = current_trace()
+        if trace is None:
+            return self.storage.reserve(decrements, updates)
+        return self._timed(trace, 'reserve', f'[{len(decrements)} paths]',
+                           lambda: self.storage.reserve(decrements, updates), written=updates, read_result=False)
+
+    def gather(self, *calls):
+        trace = current_trace()
+        if trace is None:
+            return self.storage.gather(*calls)
+
+        def traced(call):
+            def run():
+                # Only the calling thread has the request context, so hand the trace over explicitly
+                previous = getattr(_worker, 'trace', None)
+                _worker.trace = trace
+                try:
+                    return call()
+                finally:
+                    _worker.trace = previous
+            return run
+
+        return self.storage.gather(*(traced(call) for call in calls))
+
+    def increment(self, deltas, updates=None):
+        trace = current_trace()
+        if trace is None:
+            return self.storage.increment(deltas, updates)
+        return self._timed(trace, 'increment', f'[{len(deltas)} paths]',
+                           lambda: self.storage.increment(deltas, updates), written=updates, read_result=False)
+
+
+class InstrumentedJSONProvider(DefaultJSONProvider):
+    """Flask's JSON provider, adding the time spent in dumps() to the current request's trace."""
+
+    def dumps(self, obj, **kwargs):
+        trace = current_trace()
+        if trace is None:
+            return super().dumps(obj, **kwargs)
+        started = time.perf_counter()
+        try:
+            return super().dumps(obj, **kwargs)
+        finally:
+            trace.serialize_seconds += time.perf_counter() - started
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the shape Prometheus expects."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+
+
+class RouteMetrics:
+    """Per-route request counters and histograms built from finished request traces."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}  # (method, route) -> {histogram name: Histogram}
+        self._requests = {}  # (method, route, status) -> count
+
+    def observe(self, method, route, status, trace):
+        with self._lock:
+            key = (method, route)
+            histograms = self._histograms.get(key)
+            if histograms is None:
+                histograms = {name: Histogram(buckets) for name, _, buckets, _ in REQUEST_HISTOGRAMS}
+                self._histograms[key] = histograms
+            for name, _, _, value in REQUEST_HISTOGRAMS:
+                observed = value(trace)
+                if observed is not None:
+                    histograms[name].observe(observed)
+            status_key = (method, route, str(status))
+            self._requests[status_key] = self._requests.get(status_key, 0) + 1
+
+    def render(self):
+        """Prometheus text exposition of every route's counters and histograms."""
+        with self._lock:
+            lines = ['# HELP http_requests_total Requests handled, by route and status.',
+                     '# TYPE http_requests_total counter']
+            for (method, route, status), count in sorted(self._requests.items()):
+                lines.append(f'http_requests_total{_labels(method=method, route=route, status=status)} {count}')
+
+            for name, help_text, buckets, _ in REQUEST_HISTOGRAMS:
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} histogram')
+                for (method, route), histograms in sorted(self._histograms.items()):
+                    histogram = histograms[name]
+                    for bound, count in zip(buckets, histogram.counts):
+                        lines.append(f'{name}_bucket{_labels(method=method, route=route, le=_number(bound))} {count}')
+                    lines.append(f'{name}_bucket{_labels(method=method, route=route, le="+Inf")} {histogram.count}')
+                    lines.append(f'{name}_sum{_labels(method=method, route=route)} {_number(histogram.sum)}')
+                    lines.append(f'{name}_count{_labels(method=method, route=route)} {histogram.count}')
+            return '\n'.join(lines) + '\n'
+
+
+def render_gauges(prefix, stats, help_text):
+    """Prometheus text for a dict of numeric stats, one gauge per key (e.g. a cache's stats())."""
+    lines = []
+    for key, value in sorted(stats.items()):
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        lines.append(f'# HELP {prefix}_{key} {help_text}')
+        lines.append(f'# TYPE {prefix}_{key} gauge')
+        lines.append(f'{prefix}_{key} {_number(value)}')
+    return '\n'.join(lines) + '\n' if lines else ''
+
+
+def _labels(**labels):
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def instrument_app(app, route_metrics, slow_request_ms=None, byte_sample_rate=0.0):
+    """Trace every request of app into route_metrics. Requests slower than slow_request_ms are logged
+    with their DB call trace. The fraction byte_sample_rate of requests also measure their DB payload sizes.
+
+    Streamed responses are measured up to the point the view returns, not while the body is sent.
+    """
+    app.json = InstrumentedJSONProvider(app)
+
+    @app.before_request
+    def start_trace():
+        g.request_trace = RequestTrace(measure_bytes=byte_sample_rate > 0 and random.random() < byte_sample_rate)
+
+    @app.after_request
+    def finish_trace(response):
+        trace = g.pop('request_trace', None)
+        if trace is None:
+            return response
+        trace.finish()
+        # Label by URL rule, not the concrete path, so IDs don't create a series per user or product
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        route_metrics.observe(request.method, route, response.status_code, trace)
+
+        if slow_request_ms is not None and trace.total_seconds * 1000 >= slow_request_ms:
+            app.logger.warning(
+                'Slow request: %s %s -> %s in %.1fms (handler %.1fms, serialize %.1fms, %d DB calls%s)%s',
+                request.method, request.full_path.rstrip('?'), response.status_code, trace.total_seconds * 1000,
+                (trace.total_seconds - trace.serialize_seconds) * 1000, trace.serialize_seconds * 1000,
+                trace.db_calls,
+                f', {trace.bytes_read}B read, {trace.bytes_written}B written' if trace.measure_bytes else '',
+                '\n' + trace.format_calls() if trace.calls else ''
+            )
+        return response
@@ -0,0 +1,73 @@
+import json
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+# Children read per database query while streaming a full export
+EXPORT_CHUNK_SIZE = 500
+
+# Response header carrying the cursor of the next page; absent on the last page
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+
+
+def page_args(args, default_limit=DEFAULT_PAGE_SIZE):
+    """Read the limit and cursor query parameters. Raises ValueError on an invalid limit.
+
+    With default_limit=None, a request with neither a limit nor a cursor gets None (no paging), and one with
+    only a cursor gets DEFAULT_PAGE_SIZE. The list endpoints that predate pagination use this, so clients that
+    do not page still get every result.
+    """
+    cursor = args.get('cursor') or None
+    limit = args.get('limit', default_limit if default_limit is not None or not cursor else DEFAULT_PAGE_SIZE)
+    if limit is None:
+        return None, None
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        raise ValueError("limit must be an integer")
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    return limit, cursor
+
+
+def newest_first_page(database, path, limit, cursor=None):
+    """Read one page of a push-key ordered node, newest first.
+
+    Returns the (key, value) pairs of the page and the cursor of the next (older) page, or None. With limit
+    None, the page is the whole node.
+    """
+    children = database.query(path, end_at=cursor, limit_to_last=limit + 1 if limit is not None else None)
+    items = list(reversed(list(children.items())))
+    if limit is not None and len(items) > limit:
+        return items[:limit], items[limit][0]
+    return items, None
+
+
+def key_order_page(database, path, limit, cursor=None):
+    """Read one page of a node in key order (oldest first for push keys).
+
+    Returns the (key, value) pairs of the page and the cursor of the next page, or None. With limit None, the
+    page is the whole node.
+    """
+    children = database.query(path, start_at=cursor, limit_to_first=limit + 1 if limit is not None else None)
+    items = list(children.items())
+    if limit is not None and len(items) > limit:
+        return items[:limit], items[limit][0]
+    return items, None
+
+
+def iter_children(database, path, chunk_size=EXPORT_CHUNK_SIZE, cursor=None):
+    """Yield every (key, value) child of path in key order, reading chunk_size children at a time."""
+    while True:
+        page, cursor = key_order_page(database, path, chunk_size, cursor)
+        yield from page
+        if not cursor:
+            return
+
+
+def stream_json_object(items, prefix='', suffix=''):
+    """Write a JSON object from (key, value) pairs incrementally, one member at a time."""
+    yield prefix + '{'
+    for index, (key, value) in enumerate(items):
+        yield (',' if index else '') + json.dumps(key) + ':' + json.dumps(value, sort_keys=True, separators=(',', ':'))
+    yield '}' + suffix
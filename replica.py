@@ -0,0 +1,351 @@
+import copy
+import time
+import threading
+from collections import OrderedDict
+
+from storage import apply_query, join_path, split_path
+
+# Product ids written by this process and not yet seen on the change stream, kept for the lag metric.
+# A write that changes nothing produces no event, so entries are dropped after UNACKNOWLEDGED_TIMEOUT seconds.
+MAX_UNACKNOWLEDGED = 10000
+UNACKNOWLEDGED_TIMEOUT = 60.0
+
+
+class ProductReplica:
+    """In-process copy of the products node, loaded once and then kept current by the database's change
+    stream (Storage.listen, i.e. Reference.listen on Firebase).
+
+    Until the first snapshot has arrived, read() reports a miss and callers read the database directly.
+    With max_entries set, only that many products are held (least recently used are evicted), so the
+    replica no longer knows the whole catalog and misses fall back to the database too.
+    on_change is called after every applied change, e.g. to invalidate cached responses built from products.
+    """
+
+    def __init__(self, database, path='products', max_entries=None, on_change=None, clock=time.monotonic):
+        self._database = database
+        self.path = join_path(path)
+        self._prefix = split_path(path)
+        self._max_entries = max_entries
+        self._on_change = on_change
+        self._clock = clock
+        self._lock = threading.RLock()
+        self._products = OrderedDict()  # product_id -> product
+        self._complete = False  # Whether _products holds every product, so a miss means "does not exist"
+        self._listener = None
+        self._started_at = None
+        self.synced_at = None
+        self.last_event_at = None
+        self.sequence = 0  # Changes applied so far; read-through results are only kept if none arrived meanwhile
+        self._unacknowledged = OrderedDict()  # product_id -> when this process wrote it
+        self.events = 0
+        self.resyncs = 0
+        self.hits = 0
+        self.misses = 0
+        self.unsynced_reads = 0
+        self.evictions = 0
+        self.last_lag = None
+        self.max_lag = 0.0
+        self._lag_total = 0.0
+        self._lag_samples = 0
+        self.last_error = None
+
+    @property
+    def synced(self):
+        return self.synced_at is not None
+
+    def start(self):
+        """Subscribe to the change stream. The first event is the full snapshot of the node."""
+        self._started_at = self._clock()
+        try:
+            self._listener = self._database.listen(self.path, self._on_event)
+        except Exception as e:
+            # Reads keep going to the database
+            self.last_error = str(e)
+            raise
+
+    def close(self):
+        if self._listener is not None:
+            self._listener.close()
+            self._listener = None
+
+    # ---------------------- Change stream ----------------------
+
+    def _on_event(self, event):
+        segments = split_path(event.path)
+        with self._lock:
+            if event.event_type == 'patch':
+                for key, value in (event.data or {}).items():
+                    self._put(segments + split_path(key), value)
+            else:
+                self._put(segments, event.data)
+            self.sequence += 1
+            self.events += 1
+            self.last_event_at = self._clock()
+        if self._on_change is not None:
+            self._on_change()
+
+    def _put(self, segments, data):
+        # Caller must hold the lock
+        if not segments:
+            self._load(data)
+            return
+
+        product_id = segments[0]
+        self._acknowledge(product_id)
+        if len(segments) == 1:
+            if isinstance(data, dict):
+                self._store(product_id, data)
+            else:
+                self._products.pop(product_id, None)
+            return
+
+        product = self._products.get(product_id)
+        if product is None:
+            if not self._complete:
+                return  # Not held: reads of it go to the database, which has the change
+            product = {}
+        else:
+            product = copy.deepcopy(product)
+        node = product
+        for segment in segments[1:-1]:
+            child = node.get(segment)
+            if not isinstance(child, dict):
+                child = node[segment] = {}
+            node = child
+        if data is None:
+            node.pop(segments[-1], None)
+        else:
+            node[segments[-1]] = data
+        if product:
+            self._store(product_id, product)
+        else:
+            self._products.pop(product_id, None)
+
+    def _load(self, data):
+        # A full snapshot: the first event, and again whenever the stream reconnects
+        products = data if isinstance(data, dict) else {}
+        self._products = OrderedDict(
+            (product_id, product) for product_id, product in products.items() if isinstance(product, dict))
+        self._complete = True
+        self._evict()
+        now = self._clock()
+        if self.synced_at is None:
+            self.synced_at = now
+        else:
+            self.resyncs += 1
+        # Everything written before the snapshot is in it
+        for written_at in self._unacknowledged.values():
+            self._observe_lag(now - written_at)
+        self._unacknowledged.clear()
+
+    def _store(self, product_id, product):
+        # Caller must hold the lock
+        self._products[product_id] = product
+        self._products.move_to_end(product_id)
+        self._evict()
+
+    def _evict(self):
+        if self._max_entries is None:
+            return
+        while len(self._products) > self._max_entries:
+            self._products.popitem(last=False)
+            self._complete = False
+            self.evictions += 1
+
+    # ---------------------- Lag ----------------------
+
+    def note_write(self, product_id):
+        """Record that this process is about to write a product, to time how long the change takes to
+        come back on the stream."""
+        with self._lock:
+            now = self._clock()
+            self._expire_unacknowledged(now)
+            if product_id not in self._unacknowledged:
+                self._unacknowledged[product_id] = now
+                if len(self._unacknowledged) > MAX_UNACKNOWLEDGED:
+                    self._unacknowledged.popitem(last=False)
+
+    def _expire_unacknowledged(self, now):
+        # Caller must hold the lock. Entries are in write order, so the oldest come first.
+        while self._unacknowledged and now - next(iter(self._unacknowledged.values())) > UNACKNOWLEDGED_TIMEOUT:
+            self._unacknowledged.popitem(last=False)
+
+    def _acknowledge(self, product_id):
+        written_at = self._unacknowledged.pop(product_id, None)
+        if written_at is not None:
+            self._observe_lag(self._clock() - written_at)
+
+    def _observe_lag(self, lag):
+        self.last_lag = lag
+        self.max_lag = max(self.max_lag, lag)
+        self._lag_total += lag
+        self._lag_samples += 1
+
+    # ---------------------- Reads ----------------------
+
+    def read(self, path):
+        """Return (True, value) if the value at path can be served from the replica, otherwise (False, None)."""
+        segments = split_path(path)
+        if segments[:len(self._prefix)] != self._prefix:
+            return False, None
+        segments = segments[len(self._prefix):]
+        with self._lock:
+            if self.synced_at is None:
+                self.unsynced_reads += 1
+                return False, None
+            if not segments:
+                if not self._complete:
+                    self.misses += 1
+                    return False, None
+                self.hits += 1
+                return True, copy.deepcopy(dict(self._products)) or None
+
+            product = self._products.get(segments[0])
+            if product is None:
+                if not self._complete:
+                    self.misses += 1
+                    return False, None
+                self.hits += 1
+                return True, None
+            self._products.move_to_end(segments[0])
+            self.hits += 1
+            node = product
+            for segment in segments[1:]:
+                if not isinstance(node, dict) or segment not in node:
+                    return True, None
+                node = node[segment]
+        return True, copy.deepcopy(node)
+
+    def query(self, **kwargs):
+        """Run a query over the whole node, or return None if the replica cannot answer it."""
+        with self._lock:
+            if self.synced_at is None:
+                self.unsynced_reads += 1
+                return None
+            if not self._complete:
+                self.misses += 1
+                return None
+            self.hits += 1
+            children = apply_query(self._products, **kwargs)
+        return copy.deepcopy(children)
+
+    def remember(self, path, value, sequence):
+        """Keep a product read from the database after a miss, unless a change arrived since the read
+        started (sequence is the value of self.sequence taken before reading)."""
+        segments = split_path(path)
+        if len(segments) != len(self._prefix) + 1 or segments[:-1] != self._prefix or not isinstance(value, dict):
+            return
+        with self._lock:
+            if self.synced_at is not None and self.sequence == sequence:
+                self._store(segments[-1], copy.deepcopy(value))
+
+    def stats(self):
+        """Size, sync state, hit counters, staleness and write-to-replica lag."""
+        with self._lock:
+            now = self._clock()
+            self._expire_unacknowledged(now)
+            oldest = next(iter(self._unacknowledged.values()), None)
+            return {
+                'synced': self.synced,
+                'complete': self._complete,
+                'products': len(self._products),
+                'max_entries': self._max_entries or 0,
+                'events': self.events,
+                'resyncs': self.resyncs,
+                'hits': self.hits,
+                'misses': self.misses,
+                'unsynced_reads': self.unsynced_reads,
+                'evictions': self.evictions,
+                'sync_seconds': (round(self.synced_at - self._started_at, 3)
+                                 if self.synced_at is not None and self._started_at is not None else None),
+                'seconds_since_last_event': (round(now - self.last_event_at, 3)
+                                             if self.last_event_at is not None else None),
+                # Writes of this process not yet seen on the stream; the oldest bounds how stale reads are
+                'unacknowledged_writes': len(self._unacknowledged),
+                'oldest_unacknowledged_seconds': round(now - oldest, 3) if oldest is not None else 0,
+                'lag_seconds_last': round(self.last_lag, 6) if self.last_lag is not None else None,
+                'lag_seconds_max': round(self.max_lag, 6),
+                'lag_seconds_avg': round(self._lag_total / self._lag_samples, 6) if self._lag_samples else None,
+                'last_error': self.last_error,
+            }
+
+
+class ReplicatedStorage:
+    """Wraps a Storage so reads under the replica's node are answered from memory once it has synced.
+
+    Everything else, and every read the replica cannot answer, goes to the wrapped storage. Writes always
+    go to the wrapped storage and reach the replica through the change stream.
+    """
+
+    def __init__(self, storage, replica):
+        self.storage = storage
+        self.replica = replica
+
+    def __getattr__(self, name):
+        return getattr(self.storage, name)
+
+    def get(self, path):
+        served, value = self.replica.read(path)
+        if served:
+            return value
+        sequence = self.replica.sequence
+        value = self.storage.get(path)
+        self.replica.remember(path, value, sequence)
+        return value
+
+    def get_many(self, paths):
+        values = {}
+        missing = []
+        for path in dict.fromkeys(paths):
+            served, value = self.replica.read(path)
+            if served:
+                values[path] = value
+            else:
+                missing.append(path)
+        if missing:
+            sequence = self.replica.sequence
+            fetched = self.storage.get_many(missing)
+            for path, value in fetched.items():
+                self.replica.remember(path, value, sequence)
+            values.update(fetched)
+        return values
+
+    def query(self, path, **kwargs):
+        if join_path(path) == self.replica.path:
+            children = self.replica.query(**kwargs)
+            if children is not None:
+                return children
+        return self.storage.query(path, **kwargs)
+
+    # Writes note the products they touch, for the lag metric
+
+    def _note(self, paths):
+        prefix = self.replica.path + '/'
+        for path in paths:
+            path = join_path(path)
+            if path.startswith(prefix):
+                self.replica.note_write(path[len(prefix):].split('/', 1)[0])
+
+    def set(self, path, value):
+        self._note([path])
+        return self.storage.set(path, value)
+
+    def update(self, path, values):
+        self._note(join_path(path, key) for key in values)
+        return self.storage.update(path, values)
+
+    def delete(self, path):
+        self._note([path])
+        return self.storage.delete(path)
+
+    def transaction(self, path, update_fn):
+        self._note([path])
+        return self.storage.transaction(path, update_fn)
+
+    def reserve(self, decrements, updates=None):
+        self._note(list(decrements) + list(updates or {}))
+        return self.storage.reserve(decrements, updates)
+
+    def increment(self, deltas, updates=None):
+        self._note(list(deltas) + list(updates or {}))
+        return self.storage.increment(deltas, updates)
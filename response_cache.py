@@ -0,0 +1,160 @@
+import time
+import hashlib
+import threading
+from functools import wraps
+from collections import OrderedDict
+
+from flask import Response, current_app, request
+
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_MAX_ENTRY_BYTES = 8 * 1024 * 1024
+DEFAULT_TTL_SECONDS = 10.0
+
+# Response headers replayed from the cache besides Content-Type
+CACHED_HEADERS = ('X-Next-Cursor', 'X-Total-Count')
+
+
+class ResponseCache:
+    """Serialized responses keyed by route and arguments, invalidated by bumping a version counter.
+
+    Writes to the cached data call bump(); entries stored under an older version are never served.
+    The version is per process, so the TTL bounds how stale another worker's writes can make an entry.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_entry_bytes=DEFAULT_MAX_ENTRY_BYTES,
+                 ttl=DEFAULT_TTL_SECONDS, clock=time.monotonic):
+        self._max_entries = max_entries
+        self._max_entry_bytes = max_entry_bytes
+        self._ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (version, expires_at, status, headers, body, etag)
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def bump(self):
+        """Invalidate every cached response."""
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+
+    def get(self, key):
+        """Return the fresh (status, headers, body, etag) cached for key, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] == self.version and entry[1] > self._clock():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[2:]
+            self._entries.pop(key, None)
+            self.misses += 1
+            return None
+
+    def fits(self, size):
+        """Whether a body of size bytes is small enough to cache."""
+        return size <= self._max_entry_bytes
+
+    def record_not_modified(self):
+        with self._lock:
+            self.not_modified += 1
+
+    def put(self, key, version, status, headers, body, etag):
+        """Store a response built while the data was at version. Stale or oversized responses are skipped."""
+        if not self.fits(len(body)):
+            return
+        with self._lock:
+            if version != self.version:
+                return
+            self._entries[key] = (version, self._clock() + self._ttl, status, headers, body, etag)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        """Return hit/miss counters, the hit ratio and the current size of the cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'not_modified': self.not_modified,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'size': len(self._entries),
+                'version': self.version,
+            }
+
+
+def strong_etag(body):
+    """Strong ETag derived from the exact response bytes."""
+    return hashlib.sha256(body).hexdigest()[:32]
+
+
+def _not_modified(cache, etag):
+    cache.record_not_modified()
+    response = Response(status=304)
+    response.set_etag(etag)
+    return response
+
+
+def cached_response(cache):
+    """Serve a GET view from cache, with strong ETags and If-None-Match -> 304 handling.
+
+    Only 200 and 404 responses are cached. Streamed responses are cached once fully sent, if small enough.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = (request.endpoint, tuple(sorted(kwargs.items())), tuple(sorted(request.args.items(multi=True))))
+
+            cached = cache.get(key)
+            if cached:
+                status, headers, body, etag = cached
+                # The client already has this exact representation: answer without touching the database
+                if request.if_none_match.contains(etag):
+                    return _not_modified(cache, etag)
+                response = Response(body, status=status, headers=headers)
+                response.set_etag(etag)
+                return response
+
+            version = cache.version
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code not in (200, 404):
+                return response
+            headers = [('Content-Type', response.content_type)]
+            headers += [(name, response.headers[name]) for name in CACHED_HEADERS if name in response.headers]
+
+            if response.is_streamed:
+                response.response = _tee_into_cache(cache, key, version, response.status_code, headers,
+                                                    response.response)
+                return response
+
+            body = response.get_data()
+            etag = strong_etag(body)
+            cache.put(key, version, response.status_code, headers, body, etag)
+            if request.if_none_match.contains(etag):
+                return _not_modified(cache, etag)
+            response.set_etag(etag)
+            return response
+        return wrapper
+    return decorator
+
+
+def _tee_into_cache(cache, key, version, status, headers, chunks):
+    # Pass the streamed body through while keeping a copy; cache it only if it stayed small enough
+    parts = []
+    size = 0
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        if parts is not None:
+            size += len(chunk)
+            if not cache.fits(size):
+                parts = None
+            else:
+                parts.append(chunk)
+        yield chunk
+    if parts is not None:
+        body = b''.join(parts)
+        cache.put(key, version, status, headers, body, strong_etag(body))
@@ -0,0 +1,173 @@
+import time
+
+from storage import generate_push_id
+from archive import archive_partition_path, partition_date
+
+# A rider's orders in progress are a keyed set, users/<rider_id>/assigned_orders/<order_id> -> 1, so claiming
+# or delivering an order writes one child instead of rewriting a list. Completed orders are a counter,
+# users/<rider_id>/completed_count, plus a history outside the user record,
+# completed_by_rider/<rider_id>/<push key> -> {'order_id', 'date'}, read newest first a page at a time.
+# date is the order's archive partition (see archive.py).
+COMPLETED_BY_RIDER = 'completed_by_rider'
+
+# Set by migrate_rider_orders. Archiving removes the orders the migration dates the history from, so the
+# compaction sweep waits for it.
+RIDER_ORDERS_MIGRATION = 'migrations/rider_orders'
+
+
+class OrderNotAvailableError(Exception):
+    """Raised inside a claim transaction when the order is no longer waiting for a rider."""
+
+
+def assigned_order_path(rider_id, order_id=None):
+    """Path of a rider's set of assigned orders, or of one order in it."""
+    path = f'users/{rider_id}/assigned_orders'
+    return f'{path}/{order_id}' if order_id else path
+
+
+def completed_count_path(rider_id):
+    """Path of the number of orders a rider has delivered."""
+    return f'users/{rider_id}/completed_count'
+
+
+def completed_history_path(rider_id, history_key=None):
+    """Path of a rider's delivery history, or of one entry in it. History keys are push ids, so they sort by time."""
+    path = f'{COMPLETED_BY_RIDER}/{rider_id}'
+    return f'{path}/{history_key}' if history_key else path
+
+
+def legacy_entries(node):
+    """(key, order_id) of the entries of an order list written before migrate_rider_orders: positions whose
+    value is the order ID. Keyed entries added since then turn the list into a dict, so both shapes are read."""
+    if isinstance(node, list):
+        items = enumerate(node)
+    elif isinstance(node, dict):
+        items = node.items()
+    else:
+        return []
+    return [(str(key), value) for key, value in items if isinstance(value, str) and value]
+
+
+def assigned_order_ids(entries):
+    """Order IDs of (key, value) entries of an assigned-orders node. Also accepts the legacy entries that
+    predate the migration, whose values are the order IDs."""
+    order_ids = []
+    for key, value in entries:
+        if isinstance(value, str):
+            order_ids.append(value)
+        elif value:
+            order_ids.append(key)
+    return order_ids
+
+
+def claim_status(current):
+    """Transaction function that moves an accepted order's status to 'on the way'. Only one rider can win it."""
+    if current != 'accepted':
+        raise OrderNotAvailableError()
+    return 'on the way'
+
+
+def delivery_decrements(rider_id, order_id):
+    """reserve() amounts that take the order out of the rider's assigned set and count it as completed.
+
+    The assigned entry can only be taken once, so a repeated or concurrent delivery raises InsufficientValueError.
+    """
+    return {assigned_order_path(rider_id, order_id): 1, completed_count_path(rider_id): -1}
+
+
+def take_legacy_assigned_order(database, rider_id, order_id):
+    """Take order_id out of the rider's assigned orders if it is still a legacy entry (see legacy_entries).
+
+    Returns the key of the entry, which the caller deletes with its delivery write, or None if there is
+    none. The entry is spent by a transaction, so only one concurrent caller gets it.
+    """
+    for key, value in legacy_entries(database.get(assigned_order_path(rider_id))):
+        if value != order_id:
+            continue
+
+        def take(current):
+            if current != order_id:
+                raise OrderNotAvailableError()
+            return 0  # Spent; a transaction cannot write None on Firebase
+
+        try:
+            database.transaction(assigned_order_path(rider_id, key), take)
+        except OrderNotAvailableError:
+            continue
+        return key
+    return None
+
+
+def delivery_updates(rider_id, order_id, date):
+    """Multi-path update entries that go with delivery_decrements: drop the spent assigned entry and record
+    the order in the rider's history."""
+    return {
+        assigned_order_path(rider_id, order_id): None,
+        completed_history_path(rider_id, generate_push_id()): {'order_id': order_id, 'date': date}
+    }
+
+
+def completed_orders(database, entries):
+    """Read the orders of (key, {'order_id', 'date'}) history entries, in the same order: from the archive, or
+    from orders while they are still there. Orders that cannot be found are listed by ID only."""
+    entries = [entry for _, entry in entries if isinstance(entry, dict) and entry.get('order_id')]
+    paths = {}
+    for entry in entries:
+        paths[entry['order_id']] = [f'orders/{entry["order_id"]}']
+        if entry.get('date'):
+            paths[entry['order_id']].insert(0, archive_partition_path(entry['date'], entry['order_id']))
+    records = database.get_many(path for order_paths in paths.values() for path in order_paths)
+    return [
+        next((records[path] for path in paths[entry['order_id']] if records[path]), {'order_id': entry['order_id']})
+        for entry in entries
+    ]
+
+
+def rider_orders_migrated(database):
+    """Whether migrate_rider_orders has run."""
+    return bool(database.get(RIDER_ORDERS_MIGRATION))
+
+
+def migrate_rider_orders(database):
+    """Convert the legacy entries of assigned_orders and completed_orders into the keyed set, the counter and
+    the history, whatever shape the node has taken since. Returns the number of riders converted.
+
+    Riders are found with an orderByChild('user_type') query, which needs the ".indexOn": ["user_type"] rule on
+    users (see database.rules.json).
+    """
+    users = database.query('users', order_by='user_type', equal_to='rider')
+    orders = database.get_many(
+        f'orders/{order_id}'
+        for user in users.values()
+        for _, order_id in legacy_entries(user.get('completed_orders'))
+    )
+    updates = {}
+    migrated = 0
+    for rider_id, user in users.items():
+        assigned = user.get('assigned_orders')
+        assigned = dict(enumerate(assigned)) if isinstance(assigned, list) else assigned or {}
+        # Order IDs are UUIDs, so an all-digit key is a list position: a legacy entry, or one a delivery spent
+        # (see take_legacy_assigned_order)
+        legacy_keys = [str(key) for key in assigned if str(key).isdigit()]
+        if not legacy_keys and user.get('completed_orders') is None:
+            continue
+        for key in legacy_keys:
+            updates[assigned_order_path(rider_id, key)] = None
+        for _, order_id in legacy_entries(assigned):
+            updates[assigned_order_path(rider_id, order_id)] = 1
+        if user.get('completed_orders') is not None:
+            completed = list(dict.fromkeys(order_id for _, order_id in legacy_entries(user['completed_orders'])))
+            for order_id in completed:
+                # Delivery times were not recorded, so the history is ordered by when the orders were placed.
+                # Orders already archived cannot be dated from here and are kept with their ID only.
+                order = orders.get(f'orders/{order_id}') or {}
+                entry = {'order_id': order_id}
+                if order.get('timestamp'):
+                    entry['date'] = partition_date(order['timestamp'])
+                updates[completed_history_path(rider_id, generate_push_id(order.get('timestamp') or 0))] = entry
+            updates[f'users/{rider_id}/completed_orders'] = None
+            updates[completed_count_path(rider_id)] = (user.get('completed_count') or 0) + len(completed)
+        migrated += 1
+    updates[RIDER_ORDERS_MIGRATION] = int(time.time() * 1000)
+    database.update('', updates)
+    return migrated
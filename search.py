@@ -0,0 +1,349 @@
+import re
+import json
+import math
+import time
+import base64
+import bisect
+import heapq
+import threading
+
+from pagination import iter_children
+
+# Fields matched by the q parameter; matches in the name rank above matches in the description only
+SEARCH_FIELDS = ('name', 'description')
+
+SORT_OPTIONS = ('relevance', 'price_asc', 'price_desc', 'name')
+
+# Other workers' product writes reach this process's index when it is rebuilt, at most this often
+DEFAULT_REFRESH_SECONDS = 300.0
+
+# Products read per query while building the index
+LOAD_CHUNK_SIZE = 5000
+
+TOKEN = re.compile(r'[a-z0-9]+')
+MISSING_PRICE = float('inf')  # Products without a usable price sort last and never match a price range
+
+
+def tokenize(text):
+    """Lowercase alphanumeric tokens of a text."""
+    return TOKEN.findall(str(text).lower()) if text else []
+
+
+def store_key(store_name):
+    return str(store_name).strip().lower() if store_name is not None else None
+
+
+def as_price(value):
+    """A product's price as a float, or None if it is not a number."""
+    if isinstance(value, bool):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def price_arg(args, name):
+    """Read an optional numeric query parameter. Raises ValueError if it is not a finite number."""
+    value = args.get(name)
+    if value is None or value == '':
+        return None
+    try:
+        value = float(value)
+    except ValueError:
+        raise ValueError(f"{name} must be a number")
+    # float() also accepts 'nan' and 'inf', which would make every price comparison false or true
+    if not math.isfinite(value):
+        raise ValueError(f"{name} must be a finite number")
+    return value
+
+
+def encode_cursor(sort_key):
+    return base64.urlsafe_b64encode(json.dumps(sort_key, separators=(',', ':')).encode('utf-8')).decode('ascii')
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and not math.isnan(value)
+
+
+# Types of the sort key of each sort order (see ProductSearchIndex._sort_key); the last part is the product ID
+CURSOR_SHAPES = {
+    'price_asc': (_is_number,),
+    'price_desc': (_is_number,),
+    'name': (lambda value: isinstance(value, str),),
+    'relevance': (_is_number, _is_number),
+}
+
+
+def decode_cursor(cursor, sort):
+    """Sort key of the last result of the previous page. Raises ValueError on a malformed cursor, or one that
+    does not match the sort order."""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, TypeError, UnicodeError):
+        raise ValueError("Invalid cursor")
+    checks = CURSOR_SHAPES[sort]
+    if (not isinstance(key, list) or len(key) != len(checks) + 1 or not isinstance(key[-1], str)
+            or not all(check(value) for check, value in zip(checks, key))):
+        raise ValueError("Invalid cursor")
+    return tuple(key)
+
+
+class _Entry:
+    """What the index keeps per product: only the searchable fields, never the full record."""
+    __slots__ = ('name', 'name_tokens', 'tokens', 'price', 'store')
+
+    def __init__(self, product):
+        self.name = str(product.get('name') or '').lower()
+        self.name_tokens = frozenset(tokenize(product.get('name')))
+        self.tokens = self.name_tokens.union(*(tokenize(product.get(field)) for field in SEARCH_FIELDS[1:]))
+        self.price = as_price(product.get('price'))
+        self.store = store_key(product.get('store_name'))
+
+
+class ProductSearchIndex:
+    """In-process product search: an inverted index of name/description tokens, a price-sorted list and a
+    store -> product ids map.
+
+    The index is built from the products node on the first search and kept current by the product write
+    endpoints of this process (upsert/remove). Writes from other processes are picked up when the index is
+    rebuilt in the background, every refresh_interval seconds.
+    """
+
+    def __init__(self, database, refresh_interval=DEFAULT_REFRESH_SECONDS, clock=time.monotonic):
+        self._database = database
+        self._refresh_interval = refresh_interval
+        self._clock = clock
+        self._lock = threading.RLock()
+        self._load_lock = threading.Lock()
+        self._loaded_at = None
+        self._rebuilding = False
+        self._pending = []  # Writes made while a background rebuild was reading the products
+        self._reset()
+
+    def _reset(self):
+        self._entries = {}  # product_id -> _Entry
+        self._postings = {}  # token -> set of product ids
+        self._prices = []  # sorted (price, product_id) of products with a price
+        self._stores = {}  # store key -> set of product ids
+        self._vocabulary = None  # sorted tokens for prefix matching, rebuilt lazily after changes
+
+    # ---------------------- Maintenance ----------------------
+
+    def build(self, products):
+        """Replace the index with the given (product_id, product) pairs. Returns the number of products."""
+        # Built off to the side, so searches keep using the current index in the meantime
+        fresh = ProductSearchIndex(None)
+        for product_id, product in products:
+            if isinstance(product, dict):
+                fresh._add(product_id, _Entry(product))
+        fresh._prices.sort()
+        with self._lock:
+            self._entries, self._postings, self._prices, self._stores = (
+                fresh._entries, fresh._postings, fresh._prices, fresh._stores)
+            self._vocabulary = None
+            self._loaded_at = self._clock()
+            # Replay writes that raced with the rebuild, so none of them is lost
+            pending, self._pending = self._pending, []
+            for product_id, product in pending:
+                self._apply(product_id, product)
+            return len(self._entries)
+
+    def ensure_loaded(self):
+        """Build the index on first use and start a background rebuild once it is older than refresh_interval."""
+        if self._loaded_at is None:
+            with self._load_lock:
+                if self._loaded_at is None:
+                    with self._lock:
+                        self._rebuilding = True
+                    self._rebuild()
+            return
+        if self._clock() - self._loaded_at < self._refresh_interval:
+            return
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+        threading.Thread(target=self._rebuild, daemon=True).start()
+
+    def _rebuild(self):
+        # While _rebuilding is set, writes are also queued so build() can replay them on the new index
+        try:
+            self.build(iter_children(self._database, 'products', chunk_size=LOAD_CHUNK_SIZE))
+        finally:
+            with self._lock:
+                self._rebuilding = False
+                self._pending = []
+
+    def upsert(self, product_id, product):
+        """Index a created or changed product (the full record). Call after the database write."""
+        self._record(product_id, product)
+
+    def remove(self, product_id):
+        """Drop a deleted product from the index."""
+        self._record(product_id, None)
+
+    def _record(self, product_id, product):
+        with self._lock:
+            if self._rebuilding:
+                self._pending.append((product_id, product))
+            if self._loaded_at is not None:
+                self._apply(product_id, product)
+
+    def _apply(self, product_id, product):
+        # Caller must hold the lock
+        self._discard(product_id)
+        if isinstance(product, dict):
+            self._add(product_id, _Entry(product), keep_sorted=True)
+
+    def _add(self, product_id, entry, keep_sorted=False):
+        self._entries[product_id] = entry
+        for token in entry.tokens:
+            postings = self._postings.get(token)
+            if postings is None:
+                self._postings[token] = postings = set()
+                self._vocabulary = None
+            postings.add(product_id)
+        if entry.price is not None:
+            if keep_sorted:
+                bisect.insort(self._prices, (entry.price, product_id))
+            else:
+                self._prices.append((entry.price, product_id))
+        if entry.store is not None:
+            self._stores.setdefault(entry.store, set()).add(product_id)
+
+    def _discard(self, product_id):
+        entry = self._entries.pop(product_id, None)
+        if entry is None:
+            return
+        for token in entry.tokens:
+            postings = self._postings.get(token)
+            if postings is not None:
+                postings.discard(product_id)
+                if not postings:
+                    del self._postings[token]
+                    self._vocabulary = None
+        if entry.price is not None:
+            position = bisect.bisect_left(self._prices, (entry.price, product_id))
+            if position < len(self._prices) and self._prices[position] == (entry.price, product_id):
+                del self._prices[position]
+        if entry.store is not None:
+            store = self._stores.get(entry.store)
+            if store is not None:
+                store.discard(product_id)
+                if not store:
+                    del self._stores[entry.store]
+
+    # ---------------------- Queries ----------------------
+
+    def _matching_token(self, token, prefix):
+        """Product ids containing token, or (for the last word being typed) any token starting with it."""
+        if not prefix:
+            return self._postings.get(token, set())
+        if self._vocabulary is None:
+            self._vocabulary = sorted(self._postings)
+        matches = set()
+        position = bisect.bisect_left(self._vocabulary, token)
+        while position < len(self._vocabulary) and self._vocabulary[position].startswith(token):
+            matches |= self._postings[self._vocabulary[position]]
+            position += 1
+        return matches
+
+    def _price_range(self, min_price, max_price):
+        low = 0 if min_price is None else bisect.bisect_left(self._prices, (min_price,))
+        high = (len(self._prices) if max_price is None
+                else bisect.bisect_right(self._prices, (max_price, chr(0x10FFFF))))
+        return low, high
+
+    def search(self, q=None, min_price=None, max_price=None, store_name=None, sort=None, limit=20, cursor=None):
+        """Return (product ids of one page, total number of matches, cursor of the next page or None).
+
+        Every query word must match; the last one also matches as a prefix. sort defaults to relevance
+        when q is given and to price_asc otherwise.
+        """
+        self.ensure_loaded()
+        terms = tokenize(q)
+        sort = sort or ('relevance' if terms else 'price_asc')
+        after = decode_cursor(cursor, sort) if cursor else None
+
+        with self._lock:
+            candidates = None
+            if terms:
+                # Intersect the smallest posting lists first
+                matches = sorted((self._matching_token(term, index == len(terms) - 1)
+                                  for index, term in enumerate(terms)), key=len)
+                candidates = set(matches[0]).intersection(*matches[1:])
+            if store_name is not None:
+                store = self._stores.get(store_key(store_name), set())
+                candidates = store if candidates is None else candidates & store
+            if min_price is not None or max_price is not None:
+                low, high = self._price_range(min_price, max_price)
+                if candidates is None or high - low < len(candidates):
+                    in_range = {product_id for _, product_id in self._prices[low:high]}
+                    candidates = in_range if candidates is None else candidates & in_range
+                else:
+                    candidates = {product_id for product_id in candidates
+                                  if self._in_range(self._entries[product_id].price, min_price, max_price)}
+
+            if sort == 'price_asc' and candidates is None:
+                # Unfiltered price order: walk the sorted price list from the cursor
+                return self._walk_prices(after, limit)
+
+            if candidates is None:
+                candidates = self._entries.keys()
+            total = len(candidates)
+            keys = (self._sort_key(product_id, sort, terms) for product_id in candidates)
+            if after is not None:
+                keys = (key for key in keys if key > after)
+            try:
+                page = heapq.nsmallest(limit + 1, keys)
+            except TypeError:
+                # A cursor taken from a different sort order
+                raise ValueError("Invalid cursor")
+
+        next_cursor = encode_cursor(page[limit - 1]) if len(page) > limit else None
+        return [key[-1] for key in page[:limit]], total, next_cursor
+
+    @staticmethod
+    def _in_range(price, min_price, max_price):
+        return (price is not None and (min_price is None or price >= min_price)
+                and (max_price is None or price <= max_price))
+
+    def _walk_prices(self, after, limit):
+        # Caller must hold the lock. Products without a price come after every priced product.
+        page = []
+        if after is None or after[0] != MISSING_PRICE:
+            start = bisect.bisect_right(self._prices, after) if after is not None else 0
+            page = self._prices[start:start + limit + 1]
+        if len(page) <= limit:
+            unpriced = sorted((MISSING_PRICE, product_id) for product_id, entry in self._entries.items()
+                              if entry.price is None)
+            if after is not None and after[0] == MISSING_PRICE:
+                unpriced = [key for key in unpriced if key > after]
+            page += unpriced[:limit + 1 - len(page)]
+        next_cursor = encode_cursor(page[limit - 1]) if len(page) > limit else None
+        return [product_id for _, product_id in page[:limit]], len(self._entries), next_cursor
+
+    def _sort_key(self, product_id, sort, terms):
+        entry = self._entries[product_id]
+        price = MISSING_PRICE if entry.price is None else entry.price
+        if sort == 'price_asc':
+            return (price, product_id)
+        if sort == 'price_desc':
+            return (-price if entry.price is not None else MISSING_PRICE, product_id)
+        if sort == 'name':
+            return (entry.name, product_id)
+        # Relevance: most query words found in the name first, then cheaper, then by id for a stable order
+        in_name = sum(1 for term in terms if any(token.startswith(term) for token in entry.name_tokens))
+        return (-in_name, price, product_id)
+
+    def stats(self):
+        """Size of the index and the age of its last full build."""
+        with self._lock:
+            return {
+                'products': len(self._entries),
+                'tokens': len(self._postings),
+                'stores': len(self._stores),
+                'age_seconds': round(self._clock() - self._loaded_at, 3) if self._loaded_at is not None else None,
+                'rebuilding': self._rebuilding,
+            }
@@ -0,0 +1,682 @@
+import os
+import json
+import copy
+import time
+import heapq
+import random
+import sqlite3
+import threading
+import traceback
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+# ---------------------- Configuration ----------------------
+
+DEFAULT_BACKEND = 'firebase'
+DEFAULT_CREDENTIALS_PATH = 'firebase_credentials.json'
+DEFAULT_DATABASE_URL = 'https://dashdrobe-website-form-default-rtdb.firebaseio.com/'
+DEFAULT_SQLITE_PATH = 'dashdrobe.db'
+DEFAULT_READ_CONCURRENCY = 16
+
+# ---------------------- Path & value helpers ----------------------
+
+PUSH_CHARS = '-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz'
+
+# Characters the Realtime Database does not allow in a key ('/' would also split the path)
+INVALID_KEY_CHARS = frozenset('/.#$[]')
+MAX_KEY_BYTES = 768
+
+
+def split_path(path):
+    """Split a '/'-separated database path into its segments."""
+    return [segment for segment in str(path).strip('/').split('/') if segment]
+
+
+def is_valid_key(key):
+    """Whether key can be used as a single path segment: a non-empty string the Realtime Database accepts."""
+    return (
+        isinstance(key, str) and bool(key) and len(key.encode('utf-8')) <= MAX_KEY_BYTES
+        and not any(char in INVALID_KEY_CHARS or ord(char) < 32 or ord(char) == 127 for char in key)
+    )
+
+
+def join_path(*parts):
+    """Join path segments into a single '/'-separated database path."""
+    return '/'.join(segment for part in parts for segment in split_path(part))
+
+
+def normalize(value):
+    """Convert a value to the shape the Realtime Database stores (no lists, no nulls, no empty objects)."""
+    if isinstance(value, (list, tuple)):
+        value = {str(index): item for index, item in enumerate(value)}
+    if isinstance(value, dict):
+        children = {}
+        for key, child in value.items():
+            child = normalize(child)
+            if child is not None:
+                children[str(key)] = child
+        return children or None
+    return value
+
+
+def denormalize(value):
+    """Copy a stored value, turning array-like objects back into lists like the Firebase SDK does."""
+    if not isinstance(value, dict):
+        return value
+    children = {key: denormalize(child) for key, child in value.items()}
+    if children and all(key.isdigit() for key in children):
+        largest = max(int(key) for key in children)
+        if largest < 2 * len(children):
+            return [children.get(str(index)) for index in range(largest + 1)]
+    return children
+
+
+def key_order(key):
+    """Sort key matching the Realtime Database key ordering (integer keys first, then strings)."""
+    key = str(key)
+    if key.isdigit() and (key == '0' or not key.startswith('0')):
+        return (0, int(key), '')
+    return (1, 0, key)
+
+
+def value_order(value):
+    """Sort key matching the Realtime Database child-value ordering."""
+    if value is None:
+        return (0, 0, '')
+    if isinstance(value, bool):
+        return (1, int(value), '')
+    if isinstance(value, (int, float)):
+        return (2, value, '')
+    if isinstance(value, str):
+        return (3, 0, value)
+    return (4, 0, '')
+
+
+def apply_query(children, order_by=None, start_at=None, end_at=None, equal_to=None,
+                limit_to_first=None, limit_to_last=None):
+    """Filter and order the children of a node the way a Realtime Database query would."""
+    if not isinstance(children, dict):
+        return {}
+
+    if order_by in (None, '$key'):
+        def sort_key(item):
+            return (key_order(item[0]),)
+
+        def bound(value):
+            return (key_order(value),)
+    elif order_by == '$value':
+        def sort_key(item):
+            return (value_order(item[1]), key_order(item[0]))
+
+        def bound(value):
+            return (value_order(value),)
+    else:
+        def sort_key(item):
+            child = item[1].get(order_by) if isinstance(item[1], dict) else None
+            return (value_order(child), key_order(item[0]))
+
+        def bound(value):
+            return (value_order(value),)
+
+    if equal_to is not None:
+        start_at = end_at = equal_to
+    items = children.items()
+    if start_at is not None or end_at is not None:
+        lower = bound(start_at) if start_at is not None else None
+        upper = bound(end_at) if end_at is not None else None
+        items = [item for item in items
+                 if (lower is None or sort_key(item)[:1] >= lower) and (upper is None or sort_key(item)[:1] <= upper)]
+
+    # A page of a large node only needs its first or last few children in order, not a full sort
+    if limit_to_first is not None and limit_to_last is None:
+        items = heapq.nsmallest(limit_to_first, items, key=sort_key)
+    elif limit_to_last is not None and limit_to_first is None:
+        items = heapq.nlargest(limit_to_last, items, key=sort_key)[::-1] if limit_to_last else []
+    else:
+        items = sorted(items, key=sort_key)
+        if limit_to_first is not None:
+            items = items[:limit_to_first]
+        if limit_to_last is not None:
+            items = items[-limit_to_last:] if limit_to_last else []
+    return dict(items)
+
+
+class PushIdGenerator:
+    """Generate chronologically ordered 20-character keys in the same format as Firebase push IDs."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_time = 0
+        self._last_random = [0] * 12
+
+    def __call__(self, timestamp=None):
+        """Return a new key. timestamp (milliseconds) backdates the key, e.g. when indexing existing data."""
+        with self._lock:
+            now = int(time.time() * 1000) if timestamp is None else int(timestamp)
+            if now == self._last_time:
+                # Same millisecond: increment the random suffix so keys stay ordered
+                for index in range(11, -1, -1):
+                    if self._last_random[index] != 63:
+                        self._last_random[index] += 1
+                        break
+                    self._last_random[index] = 0
+            else:
+                self._last_random = [random.randrange(64) for _ in range(12)]
+            self._last_time = now
+
+            timestamp_chars = []
+            for _ in range(8):
+                timestamp_chars.append(PUSH_CHARS[now % 64])
+                now //= 64
+            return ''.join(reversed(timestamp_chars)) + ''.join(PUSH_CHARS[i] for i in self._last_random)
+
+
+generate_push_id = PushIdGenerator()
+
+# ---------------------- Storage interface ----------------------
+
+
+class InsufficientValueError(Exception):
+    """Raised by Storage.reserve when a stored number is smaller than the amount to subtract."""
+
+    def __init__(self, path, available):
+        super().__init__(f"Only {available} available at {path}")
+        self.path = path
+        self.available = available
+
+
+class Storage:
+    """Interface implemented by every database backend. Paths are '/'-separated, like Firebase references."""
+
+    def get(self, path):
+        """Return the value stored at path, or None if there is nothing there."""
+        raise NotImplementedError
+
+    def get_many(self, paths):
+        """Return a dict mapping each path to its value, reading every distinct path once."""
+        paths = list(dict.fromkeys(paths))
+        return dict(zip(paths, self._map(self.get, paths)))
+
+    def _map(self, fn, items):
+        """Apply fn to every item. Backends where each call is a network round trip run these concurrently."""
+        return list(map(fn, items))
+
+    # Set by backends where each call is a network round trip; independent calls are then run in parallel
+    _gather_executor = None
+
+    def gather(self, *calls):
+        """Run independent zero-argument calls (e.g. reads of unrelated nodes) and return their results in order."""
+        if self._gather_executor is None or len(calls) < 2:
+            return [call() for call in calls]
+        # The first call runs on this thread while the rest are in flight
+        futures = [self._gather_executor.submit(call) for call in calls[1:]]
+        first = calls[0]()
+        return [first] + [future.result() for future in futures]
+
+    def set(self, path, value):
+        """Replace the value stored at path. Setting None deletes it."""
+        raise NotImplementedError
+
+    def update(self, path, values):
+        """Atomically write several children of path. Keys may be nested paths (multi-path update)."""
+        raise NotImplementedError
+
+    def push(self, path, value=None):
+        """Store value under a new chronologically ordered key below path and return the key."""
+        key = generate_push_id()
+        if value is not None:
+            self.set(join_path(path, key), value)
+        return key
+
+    def delete(self, path):
+        """Remove the value stored at path."""
+        self.set(path, None)
+
+    def query(self, path, order_by=None, start_at=None, end_at=None, equal_to=None,
+              limit_to_first=None, limit_to_last=None):
+        """Return the ordered children of path matching the query. order_by is '$key', '$value' or a child name."""
+        raise NotImplementedError
+
+    def transaction(self, path, update_fn):
+        """Atomically replace the value at path with update_fn(current) and return the new value.
+
+        If update_fn raises, nothing is written and the exception propagates.
+        """
+        raise NotImplementedError
+
+    def reserve(self, decrements, updates=None):
+        """Atomically subtract amounts from stored numbers and apply a multi-path update in the same step.
+
+        decrements maps paths to the amount to subtract from the number stored there. If any number would
+        drop below zero, nothing is written and InsufficientValueError is raised for that path.
+        """
+        # Without multi-location transactions, every number is taken with its own compare-and-set
+        # transaction and whatever was already taken is given back if a later step fails
+        def take(item):
+            path, amount = item
+
+            def decrement(current):
+                if (current or 0) < amount:
+                    raise InsufficientValueError(path, current or 0)
+                return (current or 0) - amount
+
+            try:
+                self.transaction(path, decrement)
+            except Exception as e:
+                return e
+            return None
+
+        errors = self._map(take, list(decrements.items()))
+        error = next((error for error in errors if error is not None), None)
+        if error is None and updates:
+            try:
+                self.update('', updates)
+            except Exception as e:
+                error = e
+
+        if error is not None:
+            for path, take_error in zip(decrements, errors):
+                if take_error is None:
+                    amount = decrements[path]
+                    self.transaction(path, lambda current, amount=amount: (current or 0) + amount)
+            raise error
+
+    def increment(self, deltas, updates=None):
+        """Atomically add amounts to stored numbers (missing numbers count as 0) and apply a multi-path update."""
+        self.reserve({path: -amount for path, amount in deltas.items()}, updates)
+
+    def listen(self, path, callback):
+        """Call callback(event) for the current value at path and for every later change below it.
+
+        Events look like the Firebase SDK's: event_type is 'put' or 'patch', path is relative to the listened
+        path ('/' for the node itself) and data is the new value. Returns a registration with close().
+        """
+        raise NotImplementedError
+
+
+# What listeners of the in-process backends receive, with the attributes of firebase_admin.db.Event
+ChangeEvent = namedtuple('ChangeEvent', ['event_type', 'path', 'data'])
+
+
+class LocalListener:
+    """Registration returned by LocalChangeFeed.listen."""
+
+    def __init__(self, feed, path, callback):
+        self._feed = feed
+        self.path = path
+        self.callback = callback
+
+    def close(self):
+        self._feed._unlisten(self)
+
+
+class LocalChangeFeed:
+    """listen() for the in-process backends.
+
+    _write records the paths it touched and the public write methods call _publish once the write is
+    committed, still holding the backend lock, so listeners see committed writes only and in commit order.
+    Each changed path is delivered as a 'put' of its value after the write.
+    """
+
+    _listeners = ()
+    _changes = None
+
+    def listen(self, path, callback):
+        listener = LocalListener(self, join_path(path), callback)
+        with self._lock:
+            self._listeners = self._listeners + (listener,)
+            self._notify(listener, ChangeEvent('put', '/', self.get(listener.path)))
+        return listener
+
+    def _unlisten(self, listener):
+        with self._lock:
+            self._listeners = tuple(other for other in self._listeners if other is not listener)
+
+    def _changed(self, path):
+        # Caller must hold the lock. Nothing is recorded while nobody listens.
+        if self._listeners:
+            if self._changes is None:
+                self._changes = []
+            self._changes.append(join_path(path))
+
+    def _discard_changes(self):
+        self._changes = None
+
+    def _publish(self):
+        # Caller must hold the lock
+        changes, self._changes = self._changes, None
+        if not changes:
+            return
+        changes = list(dict.fromkeys(changes))
+        for listener in self._listeners:
+            for path in changes:
+                if not listener.path or path == listener.path or path.startswith(listener.path + '/'):
+                    relative = '/' + path[len(listener.path):].strip('/')
+                    self._notify(listener, ChangeEvent('put', relative, self.get(path)))
+                elif not path or listener.path.startswith(path + '/'):
+                    # An ancestor was replaced: the whole listened node may have changed
+                    self._notify(listener, ChangeEvent('put', '/', self.get(listener.path)))
+
+    @staticmethod
+    def _notify(listener, event):
+        # A failing listener must not fail a write that is already committed
+        try:
+            listener.callback(event)
+        except Exception:
+            traceback.print_exc()
+
+
+class FirebaseStorage(Storage):
+    """Storage backed by the Firebase Realtime Database."""
+
+    def __init__(self, credentials_path=DEFAULT_CREDENTIALS_PATH, database_url=DEFAULT_DATABASE_URL,
+                 read_concurrency=DEFAULT_READ_CONCURRENCY):
+        self._credentials_path = credentials_path
+        self._database_url = database_url
+        self._init_lock = threading.Lock()
+        self._db = None
+        # Every read is an HTTPS round trip, so independent reads are issued in parallel
+        self._executor = ThreadPoolExecutor(max_workers=read_concurrency)
+        # gather() has its own pool, so gathered calls that use get_many cannot starve the read pool
+        self._gather_executor = ThreadPoolExecutor(max_workers=read_concurrency)
+
+    def _firebase_db(self):
+        # The Firebase Admin SDK is slow to import and initialize, so that is deferred to the first
+        # database call instead of slowing down every cold start
+        if self._db is None:
+            with self._init_lock:
+                if self._db is None:
+                    import firebase_admin
+                    from firebase_admin import credentials, db
+
+                    # Initialize Firebase Admin SDK with Realtime Database URL
+                    try:
+                        firebase_admin.get_app()
+                    except ValueError:
+                        cred = credentials.Certificate(self._credentials_path)
+                        firebase_admin.initialize_app(cred, {'databaseURL': self._database_url})
+                    self._db = db
+        return self._db
+
+    def _reference(self, path):
+        return self._firebase_db().reference('/' + join_path(path))
+
+    def get(self, path):
+        return self._reference(path).get()
+
+    def _map(self, fn, items):
+        return list(self._executor.map(fn, items))
+
+    def set(self, path, value):
+        if value is None:
+            self._reference(path).delete()
+        else:
+            self._reference(path).set(value)
+
+    def update(self, path, values):
+        if values:
+            self._reference(path).update(values)
+
+    def push(self, path, value=None):
+        if value is None:
+            # Keys are generated locally in the same format, saving the round trip of an empty push
+            return generate_push_id()
+        return self._reference(path).push(value).key
+
+    def delete(self, path):
+        self._reference(path).delete()
+
+    def query(self, path, order_by=None, start_at=None, end_at=None, equal_to=None,
+              limit_to_first=None, limit_to_last=None):
+        ref = self._reference(path)
+        if order_by in (None, '$key'):
+            query = ref.order_by_key()
+        elif order_by == '$value':
+            query = ref.order_by_value()
+        else:
+            query = ref.order_by_child(order_by)
+        if equal_to is not None:
+            query = query.equal_to(equal_to)
+        if start_at is not None:
+            query = query.start_at(start_at)
+        if end_at is not None:
+            query = query.end_at(end_at)
+        if limit_to_first is not None:
+            query = query.limit_to_first(limit_to_first)
+        if limit_to_last is not None:
+            query = query.limit_to_last(limit_to_last)
+        return dict(query.get() or {})
+
+    def transaction(self, path, update_fn):
+        return self._reference(path).transaction(update_fn)
+
+    def listen(self, path, callback):
+        # The SDK keeps a streaming connection open and calls back on its own thread
+        return self._reference(path).listen(callback)
+
+
+class MemoryStorage(LocalChangeFeed, Storage):
+    """In-process storage holding the whole database as a nested dict. Intended for dev, CI and profiling."""
+
+    def __init__(self, data=None):
+        self._lock = threading.RLock()
+        self._root = normalize(data) or {}
+
+    def _write(self, path, value):
+        # Caller must hold the lock
+        self._changed(path)
+        segments = split_path(path)
+        value = normalize(value)
+        if not segments:
+            self._root = value if isinstance(value, dict) else {}
+            return
+
+        parents = [self._root]
+        node = self._root
+        for segment in segments[:-1]:
+            child = node.get(segment)
+            if not isinstance(child, dict):
+                if value is None:
+                    return
+                child = node[segment] = {}
+            node = child
+            parents.append(node)
+
+        if value is None:
+            node.pop(segments[-1], None)
+        else:
+            node[segments[-1]] = value
+
+        # Prune objects left empty, as the Realtime Database does not store them
+        for depth in range(len(parents) - 1, 0, -1):
+            if parents[depth]:
+                break
+            parents[depth - 1].pop(segments[depth - 1], None)
+
+    def _read(self, path):
+        # Caller must hold the lock
+        node = self._root
+        for segment in split_path(path):
+            if not isinstance(node, dict) or segment not in node:
+                return None
+            node = node[segment]
+        return None if node == {} else node
+
+    def get(self, path):
+        with self._lock:
+            return denormalize(copy.deepcopy(self._read(path)))
+
+    def get_many(self, paths):
+        with self._lock:
+            return {path: denormalize(copy.deepcopy(self._read(path))) for path in dict.fromkeys(paths)}
+
+    def set(self, path, value):
+        with self._lock:
+            self._write(path, value)
+            self._publish()
+
+    def update(self, path, values):
+        with self._lock:
+            for key, value in values.items():
+                self._write(join_path(path, key), value)
+            self._publish()
+
+    def query(self, path, order_by=None, start_at=None, end_at=None, equal_to=None,
+              limit_to_first=None, limit_to_last=None):
+        with self._lock:
+            children = apply_query(self._read(path), order_by, start_at, end_at, equal_to,
+                                   limit_to_first, limit_to_last)
+            return {key: denormalize(copy.deepcopy(child)) for key, child in children.items()}
+
+    def transaction(self, path, update_fn):
+        with self._lock:
+            new_value = update_fn(denormalize(copy.deepcopy(self._read(path))))
+            self._write(path, new_value)
+            self._publish()
+            return new_value
+
+    def reserve(self, decrements, updates=None):
+        with self._lock:
+            current = {path: self._read(path) or 0 for path in decrements}
+            for path, amount in decrements.items():
+                if current[path] < amount:
+                    raise InsufficientValueError(path, current[path])
+            for path, amount in decrements.items():
+                self._write(path, current[path] - amount)
+            for path, value in (updates or {}).items():
+                self._write(path, value)
+            self._publish()
+
+
+class SQLiteStorage(LocalChangeFeed, Storage):
+    """Storage persisted in a local SQLite file, one row per leaf value keyed by its full path."""
+
+    def __init__(self, database_path=DEFAULT_SQLITE_PATH):
+        self._lock = threading.RLock()
+        self._connection = sqlite3.connect(database_path, isolation_level=None, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS nodes (path TEXT PRIMARY KEY, value TEXT NOT NULL)'
+        )
+
+    @staticmethod
+    def _subtree_clause(path):
+        # '0' is the character right after '/', so this range covers every descendant of path
+        if not path:
+            return '1 = 1', ()
+        return 'path = ? OR (path >= ? AND path < ?)', (path, path + '/', path + '0')
+
+    def _read(self, path):
+        # Caller must hold the lock
+        path = join_path(path)
+        clause, params = self._subtree_clause(path)
+        rows = self._connection.execute(f'SELECT path, value FROM nodes WHERE {clause}', params).fetchall()
+        tree = None
+        for row_path, row_value in rows:
+            value = json.loads(row_value)
+            if row_path == path:
+                return value
+            segments = split_path(row_path[len(path):])
+            tree = tree if tree is not None else {}
+            node = tree
+            for segment in segments[:-1]:
+                node = node.setdefault(segment, {})
+            node[segments[-1]] = value
+        return tree
+
+    def _write(self, path, value):
+        # Caller must hold the lock and an open transaction
+        self._changed(path)
+        path = join_path(path)
+        clause, params = self._subtree_clause(path)
+        self._connection.execute(f'DELETE FROM nodes WHERE {clause}', params)
+
+        # A leaf stored at any ancestor would otherwise shadow the new children
+        segments = split_path(path)
+        for depth in range(1, len(segments)):
+            self._connection.execute('DELETE FROM nodes WHERE path = ?', ('/'.join(segments[:depth]),))
+
+        rows = []
+
+        def flatten(prefix, node):
+            if isinstance(node, dict):
+                for key, child in node.items():
+                    flatten(join_path(prefix, key), child)
+            else:
+                rows.append((prefix, json.dumps(node)))
+
+        value = normalize(value)
+        if value is not None:
+            flatten(path, value)
+        self._connection.executemany('INSERT INTO nodes (path, value) VALUES (?, ?)', rows)
+
+    def _atomic(self, write_fn):
+        with self._lock:
+            self._connection.execute('BEGIN IMMEDIATE')
+            try:
+                result = write_fn()
+            except BaseException:
+                self._connection.execute('ROLLBACK')
+                self._discard_changes()
+                raise
+            self._connection.execute('COMMIT')
+            self._publish()
+            return result
+
+    def get(self, path):
+        with self._lock:
+            return denormalize(self._read(path))
+
+    def get_many(self, paths):
+        with self._lock:
+            return {path: denormalize(self._read(path)) for path in dict.fromkeys(paths)}
+
+    def set(self, path, value):
+        self._atomic(lambda: self._write(path, value))
+
+    def update(self, path, values):
+        def write_all():
+            for key, value in values.items():
+                self._write(join_path(path, key), value)
+        self._atomic(write_all)
+
+    def query(self, path, order_by=None, start_at=None, end_at=None, equal_to=None,
+              limit_to_first=None, limit_to_last=None):
+        with self._lock:
+            children = apply_query(self._read(path), order_by, start_at, end_at, equal_to,
+                                   limit_to_first, limit_to_last)
+        return {key: denormalize(child) for key, child in children.items()}
+
+    def transaction(self, path, update_fn):
+        def read_modify_write():
+            new_value = update_fn(denormalize(self._read(path)))
+            self._write(path, new_value)
+            return new_value
+        return self._atomic(read_modify_write)
+
+    def reserve(self, decrements, updates=None):
+        def check_and_write():
+            current = {path: self._read(path) or 0 for path in decrements}
+            for path, amount in decrements.items():
+                if current[path] < amount:
+                    raise InsufficientValueError(path, current[path])
+            for path, amount in decrements.items():
+                self._write(path, current[path] - amount)
+            for path, value in (updates or {}).items():
+                self._write(path, value)
+        self._atomic(check_and_write)
+
+
+def create_storage(backend=None):
+    """Create the storage backend selected by the STORAGE_BACKEND environment variable."""
+    backend = (backend or os.environ.get('STORAGE_BACKEND', DEFAULT_BACKEND)).lower()
+    if backend == 'firebase':
+        return FirebaseStorage(
+            os.environ.get('FIREBASE_CREDENTIALS', DEFAULT_CREDENTIALS_PATH),
+            os.environ.get('FIREBASE_DATABASE_URL', DEFAULT_DATABASE_URL),
+        )
+    if backend == 'memory':
+        return MemoryStorage()
+    if backend == 'sqlite':
+        return SQLiteStorage(os.environ.get('SQLITE_PATH', DEFAULT_SQLITE_PATH))
+    raise ValueError(f"Unknown storage backend: {backend}")
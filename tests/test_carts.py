@@ -0,0 +1,47 @@
+from carts import cart_item_path, cart_items, legacy_cart_keys, legacy_item_keys, migrate_carts
+from storage import MemoryStorage
+
+
+def test_cart_items_of_a_keyed_cart():
+    cart = {'-a': {'product_id': '-a', 'quantity': 2}}
+    assert cart_items(cart) == [{'product_id': '-a', 'quantity': 2}]
+    assert cart_items(None) == []
+
+
+def test_cart_items_of_a_legacy_list_cart():
+    cart = [{'product_id': '-a', 'quantity': 2}, None, {'product_id': '-b', 'quantity': 1}]
+    assert cart_items(cart) == [{'product_id': '-a', 'quantity': 2}, {'product_id': '-b', 'quantity': 1}]
+
+
+def test_cart_items_merges_legacy_and_keyed_entries_of_a_product():
+    cart = {'0': {'product_id': '-a', 'quantity': 2}, '-a': {'product_id': '-a', 'quantity': 3},
+            '1': {'product_id': '-b', 'quantity': 1}}
+    assert sorted(cart_items(cart), key=lambda item: item['product_id']) == [
+        {'product_id': '-a', 'quantity': 5}, {'product_id': '-b', 'quantity': 1}]
+
+
+def test_legacy_cart_keys():
+    assert legacy_cart_keys([{'product_id': '-a'}, None, {'product_id': '-b'}]) == ['0', '2']
+    assert legacy_cart_keys({'0': {}, '-a': {}}) == ['0']
+    assert legacy_cart_keys({'-a': {}}) == []
+    assert legacy_cart_keys(None) == []
+
+
+def test_legacy_item_keys_finds_the_product_in_both_shapes():
+    assert legacy_item_keys([{'product_id': '-a'}, {'product_id': '-b'}, {'product_id': '-a'}], '-a') == ['0', '2']
+    assert legacy_item_keys({'0': {'product_id': '-b'}, '1': {'product_id': '-a'}, '-a': {}}, '-a') == ['1']
+    assert legacy_item_keys({'-a': {'product_id': '-a'}}, '-a') == []
+
+
+def test_migrate_carts_converts_list_and_mixed_carts():
+    storage = MemoryStorage({'carts': {
+        'u1': [{'product_id': '-a', 'quantity': 2}, {'product_id': '-b', 'quantity': 1}],
+        'u2': {'0': {'product_id': '-a', 'quantity': 1}, '-a': {'product_id': '-a', 'quantity': 4}},
+        'u3': {'-c': {'product_id': '-c', 'quantity': 1}},
+    }})
+    assert migrate_carts(storage) == 2
+    assert storage.get('carts/u1') == {'-a': {'product_id': '-a', 'quantity': 2},
+                                       '-b': {'product_id': '-b', 'quantity': 1}}
+    assert storage.get('carts/u2') == {'-a': {'product_id': '-a', 'quantity': 5}}
+    assert storage.get(cart_item_path('u3', '-c')) == {'product_id': '-c', 'quantity': 1}
+    assert migrate_carts(storage) == 0
@@ -0,0 +1,15 @@
+from indexes import product_fingerprint
+
+PRODUCT = {'name': 'Shirt', 'description': 'Cotton', 'price': 10, 'image_url': 'https://example.com/shirt.png',
+           'store_name': 'Store'}
+
+
+def test_fingerprint_ignores_stock_and_price_type():
+    assert product_fingerprint(dict(PRODUCT, stock=3)) == product_fingerprint(dict(PRODUCT, price=10.0))
+
+
+def test_fingerprint_differs_per_identifying_field():
+    fingerprints = {product_fingerprint(PRODUCT)}
+    for field in PRODUCT:
+        fingerprints.add(product_fingerprint(dict(PRODUCT, **{field: 'other'})))
+    assert len(fingerprints) == len(PRODUCT) + 1
@@ -0,0 +1,31 @@
+import pytest
+
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, key_order_page, newest_first_page, page_args
+from storage import MemoryStorage
+
+
+def test_page_args_defaults():
+    assert page_args({}) == (DEFAULT_PAGE_SIZE, None)
+    assert page_args({'limit': '5', 'cursor': 'k'}) == (5, 'k')
+
+
+def test_page_args_without_default_only_pages_when_asked():
+    assert page_args({}, default_limit=None) == (None, None)
+    assert page_args({'cursor': 'k'}, default_limit=None) == (DEFAULT_PAGE_SIZE, 'k')
+    assert page_args({'limit': '5'}, default_limit=None) == (5, None)
+
+
+@pytest.mark.parametrize('limit', ['0', str(MAX_PAGE_SIZE + 1), 'x'])
+def test_page_args_rejects_bad_limits(limit):
+    with pytest.raises(ValueError):
+        page_args({'limit': limit})
+
+
+def test_key_order_and_newest_first_pages():
+    storage = MemoryStorage({'node': {key: key for key in 'abcde'}})
+    assert key_order_page(storage, 'node', 2) == ([('a', 'a'), ('b', 'b')], 'c')
+    assert key_order_page(storage, 'node', 2, 'e') == ([('e', 'e')], None)
+    assert key_order_page(storage, 'node', None) == ([(key, key) for key in 'abcde'], None)
+    assert newest_first_page(storage, 'node', 2) == ([('e', 'e'), ('d', 'd')], 'c')
+    assert newest_first_page(storage, 'node', 2, 'a') == ([('a', 'a')], None)
+    assert newest_first_page(storage, 'node', None) == ([(key, key) for key in 'edcba'], None)
@@ -0,0 +1,42 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from riders import (RIDER_ORDERS_MIGRATION, assigned_order_ids, assigned_order_path, completed_count_path,
+                    completed_history_path, legacy_entries, migrate_rider_orders, take_legacy_assigned_order)
+from storage import MemoryStorage
+
+
+def test_legacy_entries_in_both_shapes():
+    assert legacy_entries(['o1', 'o2']) == [('0', 'o1'), ('1', 'o2')]
+    assert legacy_entries({'0': 'o1', 'o3': 1}) == [('0', 'o1')]
+    assert legacy_entries(None) == []
+
+
+def test_assigned_order_ids_reads_keyed_and_legacy_entries():
+    assert assigned_order_ids([('0', 'o1'), ('o2', 1), ('1', 0)]) == ['o1', 'o2']
+
+
+def test_migrate_rider_orders_converts_mixed_nodes():
+    storage = MemoryStorage({
+        'users': {
+            'r1': {'user_type': 'rider', 'assigned_orders': {'0': 'o1', 'o2': 1}, 'completed_orders': ['o3']},
+            'r2': {'user_type': 'rider', 'assigned_orders': {'o4': 1}},
+            'c1': {'user_type': 'customer', 'assigned_orders': ['x']},
+        },
+        'orders': {'o3': {'timestamp': 86400000}},
+    })
+    assert migrate_rider_orders(storage) == 1
+    assert storage.get(assigned_order_path('r1')) == {'o1': 1, 'o2': 1}
+    assert storage.get('users/r1/completed_orders') is None
+    assert storage.get(completed_count_path('r1')) == 1
+    assert list(storage.get(completed_history_path('r1')).values()) == [{'order_id': 'o3', 'date': '1970-01-02'}]
+    assert storage.get(assigned_order_path('r2')) == {'o4': 1}
+    assert storage.get('users/c1/assigned_orders') == ['x']
+    assert storage.get(RIDER_ORDERS_MIGRATION)
+
+
+def test_take_legacy_assigned_order_has_a_single_winner():
+    storage = MemoryStorage({'users': {'r1': {'assigned_orders': ['o1', 'o2']}}})
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        keys = list(executor.map(lambda _: take_legacy_assigned_order(storage, 'r1', 'o2'), range(16)))
+    assert [key for key in keys if key is not None] == ['1']
+    assert take_legacy_assigned_order(storage, 'r1', 'o3') is None
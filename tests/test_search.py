@@ -0,0 +1,48 @@
+import base64
+import json
+
+import pytest
+
+from search import decode_cursor, encode_cursor, price_arg
+
+
+def encoded(value):
+    return base64.urlsafe_b64encode(json.dumps(value).encode('utf-8')).decode('ascii')
+
+
+@pytest.mark.parametrize('sort, key', [
+    ('price_asc', (10.0, '-a')),
+    ('price_desc', (-10.0, '-a')),
+    ('price_asc', (float('inf'), '-a')),
+    ('name', ('shirt', '-a')),
+    ('relevance', (-1, 10.0, '-a')),
+])
+def test_cursor_round_trip(sort, key):
+    assert decode_cursor(encode_cursor(key), sort) == key
+
+
+@pytest.mark.parametrize('sort, cursor', [
+    ('price_asc', encoded([])),
+    ('price_asc', encoded(['a'])),
+    ('price_asc', encoded('x')),
+    ('price_asc', encoded([1, 2])),
+    ('price_asc', encoded([True, '-a'])),
+    ('name', encoded([1, '-a'])),
+    ('relevance', encoded([1, '-a'])),
+    ('price_asc', '%%%'),
+])
+def test_malformed_cursors_are_rejected(sort, cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor, sort)
+
+
+def test_price_arg():
+    assert price_arg({'min_price': '2.5'}, 'min_price') == 2.5
+    assert price_arg({}, 'min_price') is None
+    assert price_arg({'min_price': ''}, 'min_price') is None
+
+
+@pytest.mark.parametrize('value', ['abc', 'nan', 'inf', '-Infinity'])
+def test_price_arg_rejects_non_finite_values(value):
+    with pytest.raises(ValueError):
+        price_arg({'min_price': value}, 'min_price')
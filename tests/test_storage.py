@@ -0,0 +1,111 @@
+import pytest
+
+from storage import (InsufficientValueError, MemoryStorage, Storage, apply_query, denormalize, generate_push_id,
+                     is_valid_key, normalize)
+
+
+def test_normalize_turns_lists_into_digit_keys_and_drops_nulls():
+    assert normalize(['a', None, 'c']) == {'0': 'a', '2': 'c'}
+    assert normalize({'a': {'b': None}, 'c': 1}) == {'c': 1}
+    assert normalize({}) is None
+
+
+def test_denormalize_turns_array_like_objects_back_into_lists():
+    assert denormalize({'0': 'a', '1': 'b'}) == ['a', 'b']
+    assert denormalize({'0': 'a', '2': 'c'}) == ['a', None, 'c']
+
+
+def test_denormalize_keeps_mixed_and_sparse_objects():
+    assert denormalize({'0': 'a', '-key': 1}) == {'0': 'a', '-key': 1}
+    assert denormalize({'0': 'a', '9': 'b'}) == {'0': 'a', '9': 'b'}
+
+
+def test_apply_query_by_key():
+    children = {'c': 3, 'a': 1, 'b': 2, 'd': 4}
+    assert list(apply_query(children, start_at='b', limit_to_first=2)) == ['b', 'c']
+    assert list(apply_query(children, end_at='c', limit_to_last=2)) == ['b', 'c']
+    assert list(apply_query(children)) == ['a', 'b', 'c', 'd']
+
+
+def test_apply_query_orders_integer_keys_first():
+    assert list(apply_query({'b': 1, '10': 1, '2': 1})) == ['2', '10', 'b']
+
+
+def test_apply_query_by_child_and_value():
+    users = {'u1': {'user_type': 'rider'}, 'u2': {'user_type': 'customer'}, 'u3': {'user_type': 'rider'}}
+    assert list(apply_query(users, order_by='user_type', equal_to='rider')) == ['u1', 'u3']
+    assert list(apply_query({'k1': 'o1', 'k2': 'o2'}, order_by='$value', equal_to='o2')) == ['k2']
+
+
+def test_apply_query_on_a_leaf_is_empty():
+    assert apply_query('value') == {}
+
+
+@pytest.mark.parametrize('key', ['-P45qCBgJfPEtReTVUyZ', 'abc', '0'])
+def test_valid_keys(key):
+    assert is_valid_key(key)
+
+
+@pytest.mark.parametrize('key', ['', 'a/b', 'a.b', 'a$', 'a#', 'a[0]', 'a\n', 'x' * 769, 5, None])
+def test_invalid_keys(key):
+    assert not is_valid_key(key)
+
+
+def test_push_ids_sort_by_time():
+    keys = [generate_push_id(timestamp) for timestamp in (3000, 1000, 2000)]
+    assert sorted(keys) == [keys[1], keys[2], keys[0]]
+
+
+def test_memory_reserve_writes_nothing_when_a_number_is_short():
+    storage = MemoryStorage({'stock': {'a': 5, 'b': 1}})
+    with pytest.raises(InsufficientValueError) as error:
+        storage.reserve({'stock/a': 2, 'stock/b': 2}, {'orders/o1': {'status': 'pending'}})
+    assert error.value.path == 'stock/b'
+    assert storage.get('stock') == {'a': 5, 'b': 1}
+    assert storage.get('orders') is None
+
+
+class CompareAndSetStorage(MemoryStorage):
+    """Memory backend using the base Storage.reserve, whose update can be made to fail."""
+
+    reserve = Storage.reserve
+    fail_updates = False
+
+    def update(self, path, updates):
+        if self.fail_updates:
+            raise ConnectionError("Simulated failed update")
+        super().update(path, updates)
+
+
+def test_base_reserve_takes_numbers_and_writes_updates():
+    storage = CompareAndSetStorage({'stock': {'a': 5}})
+    storage.reserve({'stock/a': 2}, {'orders/o1': {'status': 'pending'}})
+    assert storage.get('stock/a') == 3
+    assert storage.get('orders/o1') == {'status': 'pending'}
+
+
+def test_base_reserve_gives_back_what_it_took_when_a_number_is_short():
+    storage = CompareAndSetStorage({'stock': {'a': 5, 'b': 1}})
+    with pytest.raises(InsufficientValueError):
+        storage.reserve({'stock/a': 2, 'stock/b': 2})
+    assert storage.get('stock') == {'a': 5, 'b': 1}
+
+
+def test_base_reserve_gives_back_what_it_took_when_the_update_fails():
+    storage = CompareAndSetStorage({'stock': {'a': 5, 'b': 1}})
+    storage.fail_updates = True
+    with pytest.raises(ConnectionError):
+        storage.reserve({'stock/a': 2, 'stock/b': 1}, {'orders/o1': {'status': 'pending'}})
+    assert storage.get('stock') == {'a': 5, 'b': 1}
+    assert storage.get('orders') is None
+
+
+def test_transaction_writes_nothing_when_the_function_raises():
+    storage = MemoryStorage({'a': 1})
+
+    def fail(current):
+        raise ValueError()
+
+    with pytest.raises(ValueError):
+        storage.transaction('a', fail)
+    assert storage.get('a') == 1
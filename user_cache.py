@@ -0,0 +1,77 @@
+import time
+import threading
+from collections import OrderedDict
+
+DEFAULT_MAX_ENTRIES = 10000
+DEFAULT_TTL_SECONDS = 300.0
+
+
+class UserCache:
+    """Look up single users by ID, caching users/<id> records in a bounded LRU with a time-to-live.
+
+    Only use cached records for fields that don't change after signup (such as user_type); read
+    mutable profile fields straight from the database.
+    """
+
+    def __init__(self, database, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL_SECONDS, clock=time.monotonic):
+        self._database = database
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # user_id -> (expires_at, user_data)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id):
+        """Return the user's record, or None if the user does not exist."""
+        if not user_id:
+            return None
+
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry and entry[0] > self._clock():
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        # Read only this user's record; unknown users are not cached so new signups show up immediately
+        user_data = self._database.get(f'users/{user_id}')
+        if user_data:
+            with self._lock:
+                self._entries[user_id] = (self._clock() + self._ttl, user_data)
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > self._max_entries:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return user_data
+
+    def user_type(self, user_id):
+        """Return the user's type (customer, rider or store_owner), or None if the user does not exist."""
+        user_data = self.get(user_id)
+        return user_data.get('user_type') if isinstance(user_data, dict) else None
+
+    def invalidate(self, user_id):
+        """Drop the cached record for user_id."""
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        """Drop every cached record."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Return hit/miss counters and the current size of the cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'max_entries': self._max_entries,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+            }